@@ -51,7 +51,21 @@ STRUCTURE = [
         ],
     ),
     ("Data import/export", ["csv export", "csv import", "mount"]),
-    ("Miscellaneous", ["rm", "init", "cleanup", "prune", "config", "dump", "eval", "upgrade"]),
+    (
+        "Miscellaneous",
+        [
+            "rm",
+            "init",
+            "cleanup",
+            "evict",
+            "simulate-eviction",
+            "prune",
+            "config",
+            "dump",
+            "eval",
+            "upgrade",
+        ],
+    ),
     ("Sharing images", ["clone", "push", "pull", "upstream"]),
     ("Splitfile execution", ["build", "rebuild", "provenance", "dependents"]),
     (
@@ -31,6 +31,8 @@ from splitgraph.commandline.misc import (
     rm_c,
     init_c,
     cleanup_c,
+    evict_c,
+    simulate_eviction_c,
     config_c,
     prune_c,
     dump_c,
@@ -167,6 +169,8 @@ cli.add_command(mount_c)
 cli.add_command(rm_c)
 cli.add_command(init_c)
 cli.add_command(cleanup_c)
+cli.add_command(evict_c)
+cli.add_command(simulate_eviction_c)
 cli.add_command(prune_c)
 cli.add_command(config_c)
 cli.add_command(dump_c)
@@ -26,7 +26,29 @@ from splitgraph.exceptions import TableNotFoundError
     is_flag=True,
     default=False,
 )
-def checkout_c(image_spec, force, uncheckout, layered):
+@click.option(
+    "-p",
+    "--prefetch",
+    type=int,
+    default=0,
+    help="With --layered, download this many fragments of every table in advance.",
+)
+@click.option(
+    "-w",
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of connections to use to materialize tables in parallel.",
+)
+@click.option(
+    "-d",
+    "--direct",
+    is_flag=True,
+    default=False,
+    help="With --layered, query tables whose fragments don't overlap through views "
+    "over the fragments instead of the FDW.",
+)
+def checkout_c(image_spec, force, uncheckout, layered, prefetch, workers, direct):
     """
     Check out a Splitgraph image into a Postgres schema.
 
@@ -40,6 +62,21 @@ def checkout_c(image_spec, force, uncheckout, layered):
 
     Layered querying is only supported for read-only queries.
 
+    With ``--layered``, ``-p`` or ``--prefetch`` downloads the first few fragments of every table into the
+    object cache in advance, in the order that layered queries read them in, so that the first queries
+    to the tables don't have to wait for them to be downloaded.
+
+    With ``--layered``, ``-d`` or ``--direct`` sets up tables whose fragments don't overlap each other as
+    ``UNION ALL`` views over the fragments instead. These are planned by PostgreSQL directly, which
+    lets it skip fragments that can't match a query (with ``constraint_exclusion = on``). The
+    fragments are downloaded in advance and kept in the object cache until the image is checked
+    out again. Other tables still use layered querying. The views are read-only and are committed
+    into new images unchanged.
+
+    ``-w`` or ``--workers`` materializes tables and groups of fragments that don't overlap each other
+    concurrently, using multiple connections to the engine. In that case, tables are committed
+    as soon as they're created, so an interrupted checkout might leave some of them empty.
+
     Image spec must be of the format ``[NAMESPACE/]REPOSITORY[:HASH_OR_TAG]``. Note that currently, the schema that the
     image is checked out into has to have the same name as the repository. If no image hash or tag is passed,
     "HEAD" is assumed.
@@ -55,7 +92,9 @@ def checkout_c(image_spec, force, uncheckout, layered):
         repository.uncheckout(force=force)
         click.echo("Unchecked out %s." % (str(repository),))
     else:
-        image.checkout(force=force, layered=layered)
+        image.checkout(
+            force=force, layered=layered, prefetch=prefetch, workers=workers, direct=direct
+        )
         click.echo("Checked out %s:%s." % (str(repository), image.image_hash[:12]))
 
 
@@ -101,6 +140,20 @@ def checkout_c(image_spec, force, uncheckout, layered):
 @click.option(
     "-o", "--overwrite", is_flag=True, help="Overwrite physical objects that already exist"
 )
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=int,
+    help="Number of engine connections to use to split new tables into chunks in parallel.",
+)
+@click.option(
+    "-T",
+    "--table-workers",
+    default=1,
+    type=int,
+    help="Number of engine connections to use to store tables in parallel.",
+)
 def commit_c(
     repository,
     snap,
@@ -110,6 +163,8 @@ def commit_c(
     index_options,
     message,
     overwrite,
+    workers,
+    table_workers,
 ):
     """
     Commit changes to a checked-out Splitgraph repository.
@@ -127,6 +182,14 @@ def commit_c(
     originally committed with `--chunk-size=10000`, this will create 2 fragments: one based on the first chunk
     and one on the second chunk of the table.
 
+    If `--workers` is greater than 1, tables that are stored as full snapshots are split into chunks
+    in parallel, each chunk being hashed, stored and indexed on a separate engine connection. This only
+    applies to tables with a primary key and is capped by the engine connection pool size (SG_ENGINE_POOL).
+
+    If `--table-workers` is greater than 1, tables are stored in parallel instead, each on a separate engine
+    connection (and each table's chunks serially). The new image and its objects are still registered
+    in a single transaction at the end of the commit.
+
     If `--chunk-sort-keys` is passed, data inside the chunk is sorted by this key (or multiple keys).
     This helps speed up queries on those keys for storage layers than can leverage that (e.g. CStore). The expected format is JSON, e.g. `{table_1: [col_1, col_2]}`
 
@@ -166,6 +229,8 @@ def commit_c(
         extra_indexes=index_options,
         in_fragment_order=chunk_sort_keys,
         overwrite=overwrite,
+        workers=workers,
+        table_workers=table_workers,
     ).image_hash
     click.echo("Committed %s as %s." % (str(repository), new_hash[:12]))
 
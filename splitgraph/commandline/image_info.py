@@ -476,10 +476,45 @@ def _emit_repository_data(repositories, engine):
             ],
         )
     )
+    _emit_cache_status(engine)
     click.echo("\nUse sgr status REPOSITORY to get information about a given repository.")
     click.echo("Use sgr show REPOSITORY:[HASH_OR_TAG] to get information about a given image.")
 
 
+def _emit_cache_status(engine):
+    from splitgraph.core.eviction import get_evictor_status
+    from splitgraph.core.object_manager import ObjectManager
+    from ..core.output import pretty_size
+
+    object_manager = ObjectManager(engine)
+    occupancy = object_manager.get_cache_occupancy()
+    click.echo(
+        "\nObject cache: %s/%s (%.1f%%)"
+        % (
+            pretty_size(occupancy),
+            pretty_size(object_manager.cache_size),
+            100 * occupancy / object_manager.cache_size if object_manager.cache_size else 0,
+        )
+    )
+
+    evictors = [e for e in get_evictor_status(engine) if e.is_alive()]
+    if not evictors:
+        click.echo("Background eviction: not running")
+    for evictor in evictors:
+        click.echo(
+            "Background eviction: running (%s), last run at %s, %d run(s), "
+            "%d eviction(s), %s freed%s"
+            % (
+                evictor.evictor_id,
+                evictor.heartbeat.isoformat(timespec="seconds"),
+                evictor.runs,
+                evictor.evictions,
+                pretty_size(evictor.bytes_freed),
+                ", last error: %s" % evictor.last_error if evictor.last_error else "",
+            )
+        )
+
+
 @click.command(name="status")
 @click.argument("repository", required=False, type=RepositoryType(exists=True))
 def status_c(repository):
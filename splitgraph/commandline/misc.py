@@ -207,6 +207,124 @@ def cleanup_c():
     click.echo("Deleted %s." % pluralise("object", len(deleted)))
 
 
+@click.command(name="evict")
+@click.option(
+    "-d",
+    "--daemon",
+    is_flag=True,
+    default=False,
+    help="Keep running eviction every SG_EVICTION_INTERVAL seconds until interrupted.",
+)
+@click.option("-i", "--interval", type=float, help="Override SG_EVICTION_INTERVAL (seconds).")
+@click.option("--low-watermark", type=float, help="Override SG_EVICTION_LOW_WATERMARK.")
+@click.option("--high-watermark", type=float, help="Override SG_EVICTION_HIGH_WATERMARK.")
+def evict_c(daemon, interval, low_watermark, high_watermark):
+    """
+    Free space in the object cache.
+
+    If the object cache occupancy is above the high watermark (SG_EVICTION_HIGH_WATERMARK
+    of the cache size), evict objects that aren't being used to bring it down to the low
+    watermark (SG_EVICTION_LOW_WATERMARK).
+
+    With `--daemon`, keep doing this in the background, so that queries rarely have
+    to run eviction themselves. The status of running evictors is shown in `sgr status`.
+    """
+    from splitgraph.core.eviction import CacheEvictor
+    from splitgraph.core.object_manager import ObjectManager
+    from splitgraph.engine import get_engine
+    from ..core.output import pretty_size
+
+    evictor = CacheEvictor(
+        ObjectManager(get_engine()),
+        interval=interval,
+        low_watermark=low_watermark,
+        high_watermark=high_watermark,
+    )
+    if not daemon:
+        click.echo("Freed %s." % pretty_size(evictor.run_once()))
+        return
+
+    try:
+        evictor.run()
+    except KeyboardInterrupt:
+        click.echo("Stopping the evictor.")
+
+
+@click.command(name="simulate-eviction")
+@click.argument("trace", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-c",
+    "--cache-size",
+    multiple=True,
+    type=int,
+    help="Cache size to simulate, in MB. Can be passed multiple times. "
+    "Default is the current object cache size (SG_OBJECT_CACHE_SIZE).",
+)
+@click.option(
+    "-p",
+    "--policy",
+    multiple=True,
+    help="Eviction policy to simulate. Can be passed multiple times. Default is all built-in policies.",
+)
+def simulate_eviction_c(trace, cache_size, policy):
+    """
+    Replay object cache accesses against eviction policies.
+
+    This reads a trace of object cache accesses recorded by setting `SG_OBJECT_CACHE_TRACE`
+    (a CSV file with the object ID, its size in bytes and the access timestamp) and simulates
+    the object cache with different eviction policies and cache sizes, printing out the hit
+    ratio and the byte hit ratio (fraction of requested bytes that didn't need to be downloaded)
+    for each one. For example:
+
+    ```
+    sgr simulate-eviction trace.csv -c 1024 -c 4096 -c 10240
+    ```
+    """
+    from splitgraph.config import CONFIG, get_singleton
+    from splitgraph.core.eviction import (
+        EVICTION_POLICIES,
+        get_eviction_policy,
+        read_trace,
+        simulate_eviction,
+    )
+    from tabulate import tabulate
+
+    entries = list(read_trace(trace))
+    cache_sizes = cache_size or [int(get_singleton(CONFIG, "SG_OBJECT_CACHE_SIZE"))]
+    policies = policy or list(EVICTION_POLICIES)
+
+    rows = []
+    for size in cache_sizes:
+        for policy_name in policies:
+            result = simulate_eviction(
+                entries, get_eviction_policy(policy_name), size * 1024 * 1024
+            )
+            rows.append(
+                (
+                    size,
+                    policy_name,
+                    "%.2f%%" % (result.hit_ratio * 100),
+                    "%.2f%%" % (result.byte_hit_ratio * 100),
+                    result.evictions,
+                    result.objects_evicted,
+                )
+            )
+    click.echo(
+        tabulate(
+            rows,
+            headers=(
+                "Cache size (MB)",
+                "Policy",
+                "Hit ratio",
+                "Byte hit ratio",
+                "Evictions",
+                "Evicted",
+            ),
+            tablefmt="plain",
+        )
+    )
+
+
 @click.command(name="config")
 @click.option(
     "-s",
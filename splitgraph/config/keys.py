@@ -29,8 +29,14 @@ DEFAULTS: ConfigDict = {
     # US election dataset build by about 30% (82s -> 56s) for the version that uses FROM IMPORT and
     # by about 50% (101s -> 53s) for the version that runs a single big join against multiple images.
     "SG_LQ_TUNING": "SET enable_sort=off; SET enable_hashagg=on;",
+    "SG_LQ_PREFETCH": "false",
+    "SG_LQ_PREFETCH_BATCH": "16",
     "SG_COMMIT_CHUNK_SIZE": "10000",
+    "SG_COMMIT_CONFLATE_ON_ENGINE": "false",
+    "SG_CHANGE_TRACKING": "row",
+    "SG_CHANGE_TRACKING_OVERRIDE": "",
     "SG_ENGINE_POOL": "16",
+    "SG_INDEX_BUILD_WORKERS": "0",
     "SG_CONFIG_FILE": "",
     "SG_META_SCHEMA": "splitgraph_meta",
     "SG_CONFIG_DIRS": "",
@@ -43,10 +49,21 @@ DEFAULTS: ConfigDict = {
     "SG_S3_BUCKET": "splitgraph",
     "SG_S3_KEY": "",
     "SG_S3_PWD": "",
+    "SG_S3_PART_SIZE": "67108864",
+    "SG_S3_DOWNLOAD_THREADS": "4",
+    "SG_S3_RETRIES": "5",
     "SG_OBJECT_CACHE_SIZE": "10240",
     "SG_EVICTION_DECAY": "0.002",
     "SG_EVICTION_FLOOR": "1",
     "SG_EVICTION_MIN_FRACTION": "0.05",
+    "SG_EVICTION_POLICY": "decay",
+    "SG_EVICTION_HIGH_WATERMARK": "0.9",
+    "SG_EVICTION_LOW_WATERMARK": "0.75",
+    "SG_EVICTION_INTERVAL": "10",
+    "SG_OBJECT_CACHE_TRACE": "",
+    "SG_METADATA_CACHE_SIZE": "100000",
+    "SG_QUERY_PLAN_CACHE_SIZE": "1024",
+    "SG_QUERY_PLAN_CACHE_DIR": "",
     "SG_FDW_CLASS": "splitgraph.core.fdw_checkout.QueryingForeignDataWrapper",
     "SG_CMD_ASCII": "false",
     # Some default sections: these can't be overridden via envvars.
@@ -83,6 +100,11 @@ ARGUMENT_KEY_MAP = {
     "--engine-postgres-db-name": "SG_ENGINE_POSTGRES_DB_NAME",
     "--engine-object-path": "SG_ENGINE_OBJECT_PATH",
     "--engine-pool": "SG_ENGINE_POOL",
+    "--lq-prefetch": "SG_LQ_PREFETCH",
+    "--lq-prefetch-batch": "SG_LQ_PREFETCH_BATCH",
+    "--commit-conflate-on-engine": "SG_COMMIT_CONFLATE_ON_ENGINE",
+    "--change-tracking": "SG_CHANGE_TRACKING",
+    "--change-tracking-override": "SG_CHANGE_TRACKING_OVERRIDE",
     "--config-file": "SG_CONFIG_FILE",
     "--meta-schema": "SG_META_SCHEMA",
     "--config-dirs": "SG_CONFIG_DIRS",
@@ -94,10 +116,21 @@ ARGUMENT_KEY_MAP = {
     "--s3-access-key": "SG_S3_KEY",
     "--s3-secret-key": "SG_S3_PWD",
     "--s3-bucket": "SG_S3_BUCKET",
+    "--s3-part-size": "SG_S3_PART_SIZE",
+    "--s3-download-threads": "SG_S3_DOWNLOAD_THREADS",
+    "--s3-retries": "SG_S3_RETRIES",
     "--object-cache-size": "SG_OBJECT_CACHE_SIZE",
     "--eviction-decay": "SG_EVICTION_DECAY",
     "--eviction-floor": "SG_EVICTION_FLOOR",
     "--eviction-fraction": "SG_EVICTION_MIN_FRACTION",
+    "--eviction-policy": "SG_EVICTION_POLICY",
+    "--eviction-high-watermark": "SG_EVICTION_HIGH_WATERMARK",
+    "--eviction-low-watermark": "SG_EVICTION_LOW_WATERMARK",
+    "--eviction-interval": "SG_EVICTION_INTERVAL",
+    "--object-cache-trace": "SG_OBJECT_CACHE_TRACE",
+    "--metadata-cache-size": "SG_METADATA_CACHE_SIZE",
+    "--query-plan-cache-size": "SG_QUERY_PLAN_CACHE_SIZE",
+    "--query-plan-cache-dir": "SG_QUERY_PLAN_CACHE_DIR",
     "--fdw-class": "SG_FDW_CLASS",
 }
 
@@ -134,8 +167,14 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_ENGINE_POSTGRES_DB_NAME": "Name of the default database that the superuser connects to to initialize Splitgraph.",
     "SG_ENGINE_OBJECT_PATH": "Path on the engine's filesystem where Splitgraph physical object files are stored.",
     "SG_LQ_TUNING": "Postgres query planner configuration for Splitfile execution and table imports. This is run before a layered query is executed and allows to tune query planning in case of LQ performance issues. For possible values, see the [PostgreSQL documentation](https://www.postgresql.org/docs/12/runtime-config-query.html).",
+    "SG_LQ_PREFETCH": "Set to `true` to make layered queries start returning rows from fragments that have already been downloaded instead of waiting for all required fragments to be downloaded. The remaining fragments are downloaded in the background, in the order the query reads them in.",
+    "SG_LQ_PREFETCH_BATCH": "Maximum number of fragments that layered queries download at a time when `SG_LQ_PREFETCH` is enabled. The first batch is a single fragment and every next batch is twice as big, up to this size.",
     "SG_COMMIT_CHUNK_SIZE": "Default chunk size when `sgr commit` is run. Can be overriden in the command line client by passing `--chunk-size`",
+    "SG_COMMIT_CONFLATE_ON_ENGINE": "Set to `true` to conflate pending changes to a table on the engine when committing it as a patch and to only fetch the result in batches, instead of fetching and conflating every change recorded by the audit trigger in `sgr`. This uses less memory in `sgr` when committing large changes.",
+    "SG_CHANGE_TRACKING": "Type of audit triggers used to track changes to checked out tables: `row` (run the trigger for every changed row) or `statement` (run the trigger once per statement and log all changed rows in bulk, which is faster for statements that change many rows). Takes effect when a repository is checked out.",
+    "SG_CHANGE_TRACKING_OVERRIDE": "List of overrides for the type of audit triggers for some repositories. For example, `override_repo_1:statement,namespace/override_repo_2:row`.",
     "SG_ENGINE_POOL": "Size of the connection pool used to download/upload objects. Note that in the case of layered querying with joins on multiple tables, each table will use this many parallel threads to download objects, which can overwhelm the engine. Decrease this value in that case.",
+    "SG_INDEX_BUILD_WORKERS": "Number of parallel workers that Postgres can use to build the primary key of a table that was materialized without one (when none of its fragments overlap). Sets `max_parallel_maintenance_workers` for the index build (PostgreSQL 11+). Set to `0` to use the engine's default.",
     "SG_CONFIG_FILE": "Location of the Splitgraph configuration file. By default, Splitgraph looks for the configuration in `~/.splitgraph/.sgconfig` and then the current directory.",
     "SG_META_SCHEMA": "Name of the metadata schema. Note that whilst this can be changed, it hasn't been tested and won't be taken into account by engines connecting to this one.",
     "SG_CONFIG_DIRS": "List of directories used to look up the configuration file.",
@@ -148,10 +187,21 @@ This can also be changed by passing `--verbosity` to `sgr`, e.g. `sgr --verbosit
     "SG_S3_BUCKET": "S3 bucket used by the engine for object storage.",
     "SG_S3_KEY": "S3 access key.",
     "SG_S3_PWD": "S3 secure key.",
+    "SG_S3_PART_SIZE": "Object files bigger than this (in bytes) are downloaded by the engine in ranges of this size, in parallel.",
+    "SG_S3_DOWNLOAD_THREADS": "Number of ranges of a single object file that the engine downloads in parallel.",
+    "SG_S3_RETRIES": "Number of times the engine retries a request to upload or download an object file after a transient error (a connection error, a timeout or a 5xx response), with exponential backoff. Downloads are resumed from the last received byte.",
     "SG_OBJECT_CACHE_SIZE": "Object cache size, in megabytes. This only concerns objects downloaded from an external location or a remote engine. When there is no space in the object cache, an eviction is run and objects that haven't been used recently or that are small enough to be easily redownloaded are deleted to free up space.",
     "SG_EVICTION_DECAY": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_FLOOR": "Significance of recent usage time and object size in cache eviction. See documentation for splitgraph.core.object_manager for an explanation.",
     "SG_EVICTION_MIN_FRACTION": "Minimum fraction of the total cache size that has to get freed when an eviction is run. This is to avoid frequent evictions.",
+    "SG_EVICTION_POLICY": "Policy that decides which objects get evicted from the object cache first: decay (default), lru, lfu, gdsf or a fully qualified name of a custom policy class. See documentation for splitgraph.core.eviction for an explanation.",
+    "SG_EVICTION_HIGH_WATERMARK": "Fraction of the object cache size above which the background evictor (`sgr evict --daemon`) starts freeing space.",
+    "SG_EVICTION_LOW_WATERMARK": "Fraction of the object cache size that the background evictor brings the cache occupancy down to.",
+    "SG_EVICTION_INTERVAL": "Interval, in seconds, between background evictor runs.",
+    "SG_OBJECT_CACHE_TRACE": "If set, path to a file that object cache accesses get appended to. The file can be used with `sgr simulate-eviction` to see how different eviction policies and cache sizes would perform.",
+    "SG_METADATA_CACHE_SIZE": "Maximum number of objects to cache the metadata of (indexes, hashes, sizes) in every `sgr` process (including the layered querying foreign data wrapper). Objects are immutable, so their metadata is only dropped from the cache when it's deleted, overwritten or when the cache is full. Set to 0 to disable caching.",
+    "SG_QUERY_PLAN_CACHE_SIZE": "Maximum number of layered query plans (fragments that a query on a table has to scan) to cache in every `sgr` process. Plans are shared between all tables that consist of the same fragments. Set to 0 to disable caching.",
+    "SG_QUERY_PLAN_CACHE_DIR": "Directory to additionally store query plans in, so that they can be reused by other processes (for example, every new connection to the engine runs the layered querying foreign data wrapper in a new backend). Disabled if empty.",
     "SG_FDW_CLASS": "Name of the class used by the layered querying foreign data wrapper on the engine. Internal.",
     "SG_CMD_ASCII": "Set to `true` to disable Unicode output in sgr. Note that `sgr sql` will still output Unicode data.",
 }
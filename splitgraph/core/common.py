@@ -8,7 +8,7 @@ from datetime import date, datetime, time
 from decimal import Decimal
 from functools import wraps
 from pkgutil import get_data
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING, cast, Set
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING, cast, Set
 
 from psycopg2.sql import Identifier, SQL
 
@@ -36,10 +36,17 @@ META_TABLES = [
     "object_locations",
     "object_cache_status",
     "object_cache_occupancy",
+    "object_cache_evictor",
+    "fragment_views",
     "info",
     "version",
 ]
-OBJECT_MANAGER_TABLES = ["object_cache_status", "object_cache_occupancy"]
+OBJECT_MANAGER_TABLES = [
+    "object_cache_status",
+    "object_cache_occupancy",
+    "object_cache_evictor",
+    "fragment_views",
+]
 _SPLITGRAPH_META_DIR = "resources/splitgraph_meta"
 
 
@@ -87,6 +94,9 @@ def manage_audit_triggers(
         * Drop audit triggers for those and delete all audit info for them
         * Set up audit triggers for new tables
 
+    New tables are tracked with row-level or statement-level audit triggers, as set by
+    the ``SG_CHANGE_TRACKING`` and ``SG_CHANGE_TRACKING_OVERRIDE`` config variables.
+
     If the metadata engine isn't the same as the object engine, this does nothing.
 
     :param engine: Metadata engine with information about images and their checkout state
@@ -98,13 +108,16 @@ def manage_audit_triggers(
     if object_engine != engine:
         return
 
-    from splitgraph.core.engine import get_current_repositories
+    from splitgraph.core.engine import get_current_repositories, get_change_tracking_mode
 
+    # Views (e.g. tables checked out as views over their fragments) can't have
+    # row-level audit triggers and are read-only anyway.
     repos_tables = [
         (r.to_schema(), t)
         for r, head in get_current_repositories(engine)
         if head is not None
         for t in set(object_engine.get_all_tables(r.to_schema())) & set(head.get_tables())
+        if object_engine.get_table_type(r.to_schema(), t) != "VIEW"
     ]
     tracked_tables = object_engine.get_tracked_tables()
 
@@ -115,7 +128,13 @@ def manage_audit_triggers(
         object_engine.untrack_tables(to_untrack)
 
     if to_track:
-        object_engine.track_tables(to_track)
+        statement_level = [t for t in to_track if get_change_tracking_mode(t[0]) == "statement"]
+        row_level = [t for t in to_track if t not in statement_level]
+
+        if row_level:
+            object_engine.track_tables(row_level)
+        if statement_level:
+            object_engine.track_tables(statement_level, statement_level=True)
 
 
 def manage_audit(func: Callable) -> Callable:
@@ -177,34 +196,6 @@ def aggregate_changes(
     return result[0], result[1], result[2]
 
 
-def slow_diff(
-    repository: "Repository",
-    table_name: str,
-    image_1: Optional[str],
-    image_2: Optional[str],
-    aggregate: bool,
-) -> Union[Tuple[int, int, int], List[Tuple[bool, Tuple]]]:
-    """Materialize both tables and manually diff them"""
-    with repository.materialized_table(table_name, image_1) as (mp_1, table_1):
-        with repository.materialized_table(table_name, image_2) as (mp_2, table_2):
-            # Check both tables out at the same time since then table_2 calculation can be based
-            # on table_1's snapshot.
-            left = repository.object_engine.run_sql(
-                SQL("SELECT * FROM {}.{}").format(Identifier(mp_1), Identifier(table_1))
-            )
-            right = repository.object_engine.run_sql(
-                SQL("SELECT * FROM {}.{}").format(Identifier(mp_2), Identifier(table_2))
-            )
-
-    if aggregate:
-        return sum(1 for r in right if r not in left), sum(1 for r in left if r not in right), 0
-
-    # Return format: list of [(False for deleted/True for inserted, full row)]
-    return [(False, r) for r in left if r not in right] + [
-        (True, r) for r in right if r not in left
-    ]
-
-
 def gather_sync_metadata(
     target: "Repository",
     source: "Repository",
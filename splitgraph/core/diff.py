@@ -0,0 +1,398 @@
+"""
+Comparing the contents of a table in two images.
+
+Rows are compared on the engine with a set-based anti-join (``EXCEPT ALL``) and streamed
+back in primary key order, so diffs of large tables don't have to be loaded into Python.
+If both images store the table as fragments with the same schema and primary key, only
+the fragments that aren't shared by both images (and the rows they touch) are compared.
+"""
+import logging
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, List, NamedTuple, Optional, Tuple, TYPE_CHECKING, Union
+
+from psycopg2.extensions import TRANSACTION_STATUS_INERROR
+from psycopg2.sql import SQL, Identifier, Composable
+
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core.types import TableSchema
+from splitgraph.engine.postgres.engine import SG_UD_FLAG, chunk, get_change_key
+
+if TYPE_CHECKING:
+    from splitgraph.core.repository import Repository
+    from splitgraph.core.table import Table
+    from splitgraph.engine.postgres.engine import PostgresEngine
+
+# Prefix of temporary tables with the PKs of rows mentioned by a set of fragments
+# (see load_fragment_keys)
+_FRAGMENT_KEYS_PREFIX = "sg_tmp_diff_keys_"
+
+# Number of objects to load PKs from in one query
+_KEYS_BATCH_SIZE = 100
+
+# Number of rows to fetch from the engine at a time when streaming a diff
+DIFF_BATCH_SIZE = 10000
+
+
+class _DiffSources(NamedTuple):
+    # Queries returning the rows of the table in the first and the second image
+    left: Composable
+    right: Composable
+    # 1-based positions of columns to order the rows of each side by
+    left_order: List[int]
+    right_order: List[int]
+    # False if the two sides have different column types and so no rows are the same
+    comparable: bool
+
+
+def _column_expr(column: str, pg_type: str) -> Composable:
+    # json doesn't have an equality operator, compare it as jsonb instead.
+    if pg_type == "json":
+        return SQL("{}::jsonb").format(Identifier(column))
+    return Identifier(column)
+
+
+def _column_types(schema: TableSchema) -> List[str]:
+    return ["jsonb" if c.pg_type == "json" else c.pg_type for c in schema]
+
+
+def _order_positions(schema: TableSchema) -> List[int]:
+    key = {c for c, _ in get_change_key(schema)}
+    return [i + 1 for i, c in enumerate(schema) if c.name in key]
+
+
+def _table_query(schema_name: str, table_name: str, schema: TableSchema) -> Composable:
+    return (
+        SQL("SELECT ")
+        + SQL(",").join(_column_expr(c.name, c.pg_type) for c in schema)
+        + SQL(" FROM {}.{}").format(Identifier(schema_name), Identifier(table_name))
+    )
+
+
+def fragment_rows_query(
+    objects: List[str], schema: TableSchema, keys_table: str, for_comparison: bool = True
+) -> Composable:
+    """
+    Build a query that returns the rows that applying the fragments in order would produce
+    for PKs in the keys table (see `load_fragment_keys`): for every PK, that's the rows with
+    the upsert flag set in the last fragment that mentions that PK
+    (see `PostgresEngine.apply_fragments`).
+
+    :param objects: Fragments in the order they're applied in
+    :param schema: Schema of the table
+    :param keys_table: Name of the keys table returned by `load_fragment_keys`
+    :param for_comparison: Cast columns to types that can be compared with ``EXCEPT``.
+        Otherwise, columns are returned with their original types.
+    """
+    if not objects:
+        return (
+            SQL("SELECT ")
+            + SQL(",").join(
+                SQL("NULL::" + t)
+                for t in (_column_types(schema) if for_comparison else [c.pg_type for c in schema])
+            )
+            + SQL(" WHERE false")
+        )
+
+    pks = [c.name for c in schema if c.is_pk]
+    all_cols = [c.name for c in schema]
+    pk_tuple = SQL("(") + SQL(",").join(Identifier(c) for c in pks) + SQL(")")
+
+    fragments = SQL(" UNION ALL ").join(
+        SQL("SELECT %d AS sg_diff_ord," % i)
+        + SQL(",").join(Identifier(c) for c in all_cols + [SG_UD_FLAG])
+        + SQL(" FROM {}.{} WHERE ").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(o))
+        + pk_tuple
+        + SQL(" IN (SELECT ")
+        + SQL(",").join(Identifier(c) for c in pks)
+        + SQL(" FROM pg_temp.{})").format(Identifier(keys_table))
+        for i, o in enumerate(objects)
+    )
+    return (
+        SQL("SELECT ")
+        + SQL(",").join(
+            _column_expr(c.name, c.pg_type) if for_comparison else Identifier(c.name)
+            for c in schema
+        )
+        + SQL(" FROM (SELECT *, max(sg_diff_ord) OVER (PARTITION BY ")
+        + SQL(",").join(Identifier(c) for c in pks)
+        + SQL(") AS sg_diff_last FROM (")
+        + fragments
+        + SQL(") f) f WHERE sg_diff_ord = sg_diff_last AND {}").format(Identifier(SG_UD_FLAG))
+    )
+
+
+def _schema_key(schema: TableSchema) -> List[Tuple[str, str, bool]]:
+    return [(c.name, c.pg_type, c.is_pk) for c in schema]
+
+
+def filter_overlapping_fragments(
+    repository: "Repository", table: "Table", objects: List[str], changed: List[str]
+) -> List[str]:
+    """
+    Use the range index to discard fragments that can't contain any of the PKs that
+    are mentioned in another set of fragments.
+
+    :param repository: Repository the table belongs to
+    :param table: Table the fragments belong to
+    :param objects: Fragments to filter
+    :param changed: Fragments with the PKs
+    :return: List of fragments from `objects` that might mention the same PKs.
+    """
+    if not objects:
+        return []
+    changed_meta = repository.objects.get_object_meta(changed)
+    quals = []
+    for column in [c.name for c in table.table_schema if c.is_pk]:
+        ranges = [changed_meta[o].object_index.get("range", {}).get(column) for o in changed]
+        if any(r is None for r in ranges):
+            continue
+        # (col >= min_1 OR col >= min_2 ...) AND (col <= max_1 OR col <= max_2 ...)
+        # is the range spanned by all changed fragments.
+        quals.append([(column, ">=", r[0]) for r in ranges])
+        quals.append([(column, "<=", r[1]) for r in ranges])
+    return repository.objects.filter_fragments(objects, table, quals)
+
+
+def load_fragment_keys(engine: "PostgresEngine", objects: List[str], schema: TableSchema) -> str:
+    """
+    Load the PKs of all rows mentioned in a set of fragments into a temporary table.
+    The table is dropped when the transaction commits. The caller can drop it
+    earlier with `drop_fragment_keys`.
+
+    :param engine: Engine the fragments are stored on
+    :param objects: Fragments to load the PKs from
+    :param schema: Schema of the table the fragments belong to (must have a primary key)
+    :return: Name of the temporary table
+    """
+    keys_table = _FRAGMENT_KEYS_PREFIX + uuid.uuid4().hex
+    pks = [c for c in schema if c.is_pk]
+    engine.run_sql(
+        SQL("CREATE TEMPORARY TABLE {} (").format(Identifier(keys_table))
+        + SQL(",").join(SQL("{} " + c.pg_type).format(Identifier(c.name)) for c in pks)
+        + SQL(", PRIMARY KEY (")
+        + SQL(",").join(Identifier(c.name) for c in pks)
+        + SQL(")) ON COMMIT DROP")
+    )
+    for batch in chunk(objects, chunk_size=_KEYS_BATCH_SIZE):
+        engine.run_sql(
+            SQL(";").join(
+                SQL("INSERT INTO pg_temp.{} SELECT ").format(Identifier(keys_table))
+                + SQL(",").join(Identifier(c.name) for c in pks)
+                + SQL(" FROM {}.{} ON CONFLICT DO NOTHING").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(o)
+                )
+                for o in batch
+            )
+        )
+    engine.run_sql(SQL("ANALYZE pg_temp.{}").format(Identifier(keys_table)))
+    return keys_table
+
+
+def drop_fragment_keys(engine: "PostgresEngine", keys_table: str) -> None:
+    """
+    Drop the temporary table created by `load_fragment_keys`. If the transaction has
+    failed, this does nothing, since the table goes away when it's rolled back
+    (and trying to drop it would raise an error, hiding the original one).
+    """
+    if engine.connection.get_transaction_status() == TRANSACTION_STATUS_INERROR:
+        return
+    engine.run_sql(SQL("DROP TABLE IF EXISTS pg_temp.{}").format(Identifier(keys_table)))
+
+
+@contextmanager
+def _fragment_sources(
+    repository: "Repository", table_1: "Table", table_2: "Table"
+) -> Iterator[Optional[_DiffSources]]:
+    """
+    Set up the diff of two versions of a table that only reads the rows that can differ
+    between them. Yields None if the tables can't be compared this way.
+
+    Rows whose PKs are only mentioned by fragments that both tables share (in the same order)
+    are the same in both tables. So we only have to compare rows with PKs from the fragments
+    that aren't shared, reconstructing them from those fragments and shared fragments that
+    might mention the same PKs.
+    """
+    schema = table_1.table_schema
+    pks = [c.name for c in schema if c.is_pk]
+    objects_1, objects_2 = table_1.objects, table_2.objects
+    shared = set(objects_1).intersection(objects_2)
+
+    if (
+        not pks
+        or _schema_key(schema) != _schema_key(table_2.table_schema)
+        or [o for o in objects_1 if o in shared] != [o for o in objects_2 if o in shared]
+    ):
+        yield None
+        return
+
+    disjoint = [o for o in objects_1 if o not in shared] + [o for o in objects_2 if o not in shared]
+    needed_shared = set(
+        filter_overlapping_fragments(
+            repository, table_2, [o for o in objects_2 if o in shared], disjoint
+        )
+        if disjoint
+        else []
+    )
+    needed_1 = [o for o in objects_1 if o not in shared or o in needed_shared]
+    needed_2 = [o for o in objects_2 if o not in shared or o in needed_shared]
+    logging.debug(
+        "Diffing %s: %d shared fragment(s), %d different, reading %d shared",
+        table_1.table_name,
+        len(shared),
+        len(disjoint),
+        len(needed_shared),
+    )
+
+    engine = repository.object_engine
+    required = list(dict.fromkeys(needed_1 + needed_2))
+    with repository.objects.ensure_objects(table=table_2, objects=required):
+        keys_table = load_fragment_keys(engine, disjoint, schema)
+        try:
+            order = _order_positions(schema)
+            yield _DiffSources(
+                left=fragment_rows_query(needed_1, schema, keys_table),
+                right=fragment_rows_query(needed_2, schema, keys_table),
+                left_order=order,
+                right_order=order,
+                comparable=True,
+            )
+        finally:
+            drop_fragment_keys(engine, keys_table)
+
+
+@contextmanager
+def _materialized_sources(
+    repository: "Repository", table_name: str, image_1: Optional[str], image_2: Optional[str]
+) -> Iterator[_DiffSources]:
+    """Set up the diff of two versions of a table by materializing both of them."""
+    engine = repository.object_engine
+    with repository.materialized_table(table_name, image_1) as (mp_1, table_1):
+        with repository.materialized_table(table_name, image_2) as (mp_2, table_2):
+            # Check both tables out at the same time since then table_2 calculation can be based
+            # on table_1's snapshot.
+            schema_1 = engine.get_full_table_schema(mp_1, table_1)
+            schema_2 = engine.get_full_table_schema(mp_2, table_2)
+            yield _DiffSources(
+                left=_table_query(mp_1, table_1, schema_1),
+                right=_table_query(mp_2, table_2, schema_2),
+                left_order=_order_positions(schema_1),
+                right_order=_order_positions(schema_2),
+                comparable=_column_types(schema_1) == _column_types(schema_2),
+            )
+
+
+@contextmanager
+def _diff_sources(
+    repository: "Repository", table_name: str, image_1: Optional[str], image_2: Optional[str]
+) -> Iterator[_DiffSources]:
+    if image_1 is not None and image_2 is not None:
+        table_1 = repository.images.by_hash(image_1).get_table(table_name)
+        table_2 = repository.images.by_hash(image_2).get_table(table_name)
+        with _fragment_sources(repository, table_1, table_2) as sources:
+            if sources:
+                yield sources
+                return
+
+    with _materialized_sources(repository, table_name, image_1, image_2) as sources:
+        yield sources
+
+
+def _difference_query(
+    left: Composable, right: Composable, order: List[int], comparable: bool
+) -> Composable:
+    query = SQL("SELECT * FROM ((") + left + SQL(")")
+    if comparable:
+        query += SQL(" EXCEPT ALL (") + right + SQL(")")
+    query += SQL(") d")
+    if order:
+        query += SQL(" ORDER BY " + ",".join(str(p) for p in order))
+    return query
+
+
+def _stream_rows(engine: "PostgresEngine", query: Composable, batch_size: int) -> Iterator[Tuple]:
+    # Use a unique cursor name so that several diffs can be streamed at the same time.
+    with engine.connection.cursor(name="sg_table_diff_" + uuid.uuid4().hex) as cur:
+        cur.itersize = batch_size
+        cur.execute(query)
+        for row in cur:
+            yield tuple(row)
+
+
+def iter_table_diff(
+    repository: "Repository",
+    table_name: str,
+    image_1: Optional[str],
+    image_2: Optional[str],
+    batch_size: int = DIFF_BATCH_SIZE,
+) -> Iterator[Tuple[bool, Tuple]]:
+    """
+    Stream the differences between the contents of a table in two images.
+
+    :param repository: Repository the table belongs to
+    :param table_name: Name of the table
+    :param image_1: First image hash or None for the staging area
+    :param image_2: Second image hash or None for the staging area
+    :param batch_size: Number of rows to fetch from the engine at a time
+    :return: Iterator of `(True for added, False for removed, row contents)`: all removed rows
+        come first, followed by all added rows, each ordered by the table's primary key.
+    """
+    engine = repository.object_engine
+    with _diff_sources(repository, table_name, image_1, image_2) as sources:
+        for added, query in (
+            (
+                False,
+                _difference_query(
+                    sources.left, sources.right, sources.left_order, sources.comparable
+                ),
+            ),
+            (
+                True,
+                _difference_query(
+                    sources.right, sources.left, sources.right_order, sources.comparable
+                ),
+            ),
+        ):
+            for row in _stream_rows(engine, query, batch_size):
+                yield added, row
+
+
+def diff_table(
+    repository: "Repository",
+    table_name: str,
+    image_1: Optional[str],
+    image_2: Optional[str],
+    aggregate: bool,
+) -> Union[Tuple[int, int, int], List[Tuple[bool, Tuple]]]:
+    """
+    Compare the contents of a table in two images.
+
+    :param repository: Repository the table belongs to
+    :param table_name: Name of the table
+    :param image_1: First image hash or None for the staging area
+    :param image_2: Second image hash or None for the staging area
+    :param aggregate: If True, only count the rows on the engine and return a tuple of
+        (added, removed, updated) row counts. Updates are reported as a removal and an addition.
+    :return: Counts of changed rows or a list of changes (see `iter_table_diff`).
+    """
+    if not aggregate:
+        return list(iter_table_diff(repository, table_name, image_1, image_2))
+
+    with _diff_sources(repository, table_name, image_1, image_2) as sources:
+        query = (
+            SQL("WITH l AS (")
+            + sources.left
+            + SQL("), r AS (")
+            + sources.right
+            + SQL(") SELECT (SELECT count(*) FROM (")
+            + _difference_query(
+                SQL("SELECT * FROM r"), SQL("SELECT * FROM l"), [], sources.comparable
+            )
+            + SQL(") a), (SELECT count(*) FROM (")
+            + _difference_query(
+                SQL("SELECT * FROM l"), SQL("SELECT * FROM r"), [], sources.comparable
+            )
+            + SQL(") d)")
+        )
+        added, removed = repository.object_engine.run_sql(query)[0]
+    return int(added), int(removed), 0
@@ -35,6 +35,21 @@ _LOOKUP_PATH, _LOOKUP_PATH_OVERRIDE = _parse_paths_overrides(
 )
 
 
+def get_change_tracking_mode(schema: str) -> str:
+    """
+    Get the type of audit triggers that tables checked out into a schema are tracked with,
+    as set by the ``SG_CHANGE_TRACKING`` and ``SG_CHANGE_TRACKING_OVERRIDE`` config variables.
+
+    :param schema: Schema the tables are checked out into
+    :return: ``row`` or ``statement``
+    """
+    default_mode, mode_overrides = _parse_paths_overrides(
+        get_singleton(CONFIG, "SG_CHANGE_TRACKING"),
+        get_singleton(CONFIG, "SG_CHANGE_TRACKING_OVERRIDE"),
+    )
+    return mode_overrides.get(schema, default_mode[0] if default_mode else "row")
+
+
 def init_engine(skip_object_handling: bool = False) -> None:  # pragma: no cover
     # Method exercised in test_commandline.test_init_new_db but in
     # an external process
@@ -0,0 +1,534 @@
+"""
+Policies that decide which objects get evicted from the object cache first and a simulator
+that replays recorded object cache accesses against them.
+
+A policy gives every object in the cache a score: when the cache needs to free some space,
+objects with the lowest scores are deleted first. The policy used by the engine is set with
+the ``SG_EVICTION_POLICY`` configuration key and can be one of:
+
+  * ``decay`` (default): an object's size (floored to ``SG_EVICTION_FLOOR``) multiplied by
+    an exponential decay factor of the time since the object was last used
+    (controlled by ``SG_EVICTION_DECAY``). Large, recently used objects are evicted last.
+  * ``lru``: least recently used objects are evicted first.
+  * ``lfu``: least frequently used objects are evicted first (LFU with dynamic aging).
+  * ``gdsf``: Greedy-Dual-Size-Frequency: objects with the lowest access frequency per
+    byte are evicted first, with dynamic aging.
+
+Custom policies can be used by setting ``SG_EVICTION_POLICY`` to the fully qualified name
+of a class that extends :class:`EvictionPolicy`, for example ``mypackage.policies.MyPolicy``.
+
+Policies with dynamic aging keep an inflation value for the whole cache. Every time objects
+get evicted, the inflation value is raised to the score of the last evicted object and objects
+that get accessed afterwards are scored on top of it. This stops objects that were used many
+times in the past from staying in the cache forever.
+
+To pick a policy and a cache size for a given workload, record the object cache accesses by
+setting ``SG_OBJECT_CACHE_TRACE`` to a path to a file and replay them with
+:func:`simulate_eviction` (or ``sgr simulate-eviction``).
+
+Eviction normally runs when a query needs to download objects that don't fit in the cache.
+To make this rare, a :class:`CacheEvictor` can keep the cache occupancy under a low watermark
+in the background (``sgr evict --daemon``).
+"""
+import csv
+import heapq
+import itertools
+import logging
+import math
+import os
+import socket
+import threading
+from datetime import datetime as dt
+from importlib import import_module
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+)
+
+from psycopg2.sql import SQL, Identifier
+
+from splitgraph.config import CONFIG, SPLITGRAPH_META_SCHEMA, get_singleton
+from splitgraph.engine import ResultShape
+from splitgraph.exceptions import ObjectCacheError
+
+if TYPE_CHECKING:
+    from splitgraph.core.object_manager import ObjectManager
+    from splitgraph.engine.postgres.engine import PsycopgEngine
+
+
+class CacheEntry(NamedTuple):
+    """An object in the object cache, as seen by the eviction policy."""
+
+    object_id: str
+    size: int
+    last_used: dt
+    # Number of times the object has been claimed since it was downloaded
+    access_count: int = 1
+    # Inflation value of the cache when the object was last used
+    inflation: float = 0.0
+
+
+class EvictionPolicy:
+    """
+    Base class for object cache eviction policies.
+
+    :param decay_constant: See ``SG_EVICTION_DECAY``.
+    :param floor: Objects smaller than this size (in bytes) are assumed to have this size
+        (to simulate the latency of downloading them).
+    """
+
+    #: Whether the policy uses dynamic aging: if True, the cache's inflation value is set
+    #: to the highest score of the objects that were evicted.
+    aging = False
+
+    def __init__(self, decay_constant: float, floor: float) -> None:
+        self.decay_constant = decay_constant
+        self.floor = floor
+
+    def score(self, entry: CacheEntry, now: dt) -> float:
+        """
+        Score an object in the cache: objects with lower scores get evicted first.
+
+        :param entry: Cache entry
+        :param now: Time the eviction is run at.
+        """
+        raise NotImplementedError()
+
+    def select_victims(
+        self, entries: List[CacheEntry], required_space: int, now: Optional[dt] = None
+    ) -> Tuple[List[CacheEntry], float]:
+        """
+        Pick objects to evict until at least `required_space` bytes are freed (or until
+        there are no more objects left).
+
+        Only the objects that actually get evicted are ordered, so this is cheaper than sorting
+        all candidates when the cache holds a lot of them.
+
+        :param entries: Eviction candidates.
+        :param required_space: Space to free, in bytes.
+        :param now: Time the eviction is run at (current time by default).
+        :return: List of entries to evict and the highest score among them.
+        """
+        now = now or dt.utcnow()
+        heap = [(self.score(e, now), i) for i, e in enumerate(entries)]
+        heapq.heapify(heap)
+
+        victims: List[CacheEntry] = []
+        freed_space = 0
+        max_score = 0.0
+        while heap and freed_space < required_space:
+            score, index = heapq.heappop(heap)
+            victims.append(entries[index])
+            freed_space += entries[index].size
+            max_score = max(max_score, score)
+        return victims, max_score
+
+
+class DecayPolicy(EvictionPolicy):
+    """
+    Evict objects in order to minimize P(object is requested again) * (cost of redownloading
+    the object).
+
+    To approximate the probability, we use an exponential decay function (1 if last_used = now,
+    dropping down to 0 as time since the object's last usage time passes). To approximate the
+    cost, we use the object's size, floored to a constant (so if the object has size <= floor,
+    we'd use the floor value -- this is to simulate the latency of re-fetching the object,
+    as opposed to the bandwidth).
+    """
+
+    def score(self, entry: CacheEntry, now: dt) -> float:
+        time_since_used = (now - entry.last_used).total_seconds()
+        time_factor = math.exp(-self.decay_constant * time_since_used)
+        size_factor = entry.size if entry.size > self.floor else self.floor
+        return time_factor * size_factor
+
+
+class LRUPolicy(EvictionPolicy):
+    """Evict least recently used objects first."""
+
+    def score(self, entry: CacheEntry, now: dt) -> float:
+        return -(now - entry.last_used).total_seconds()
+
+
+class LFUPolicy(EvictionPolicy):
+    """Evict least frequently used objects first (LFU with dynamic aging)."""
+
+    aging = True
+
+    def score(self, entry: CacheEntry, now: dt) -> float:
+        return entry.inflation + entry.access_count
+
+
+class GDSFPolicy(EvictionPolicy):
+    """
+    Greedy-Dual-Size-Frequency: evict objects with the lowest access frequency per byte
+    first (objects smaller than the floor are treated as having the floor size), with
+    dynamic aging.
+    """
+
+    aging = True
+
+    def score(self, entry: CacheEntry, now: dt) -> float:
+        return entry.inflation + entry.access_count / max(entry.size, self.floor, 1)
+
+
+EVICTION_POLICIES: Dict[str, Callable[..., EvictionPolicy]] = {
+    "decay": DecayPolicy,
+    "lru": LRUPolicy,
+    "lfu": LFUPolicy,
+    "gdsf": GDSFPolicy,
+}
+
+
+def get_eviction_policy(
+    name: Optional[str] = None,
+    decay_constant: Optional[float] = None,
+    floor: Optional[float] = None,
+) -> EvictionPolicy:
+    """
+    Load an eviction policy by its name or by the fully qualified name of its class.
+
+    :param name: Name of the policy. By default, uses ``SG_EVICTION_POLICY``.
+    :param decay_constant: Override ``SG_EVICTION_DECAY``.
+    :param floor: Override ``SG_EVICTION_FLOOR`` (in bytes).
+    """
+    name = name or get_singleton(CONFIG, "SG_EVICTION_POLICY")
+    if decay_constant is None:
+        decay_constant = float(get_singleton(CONFIG, "SG_EVICTION_DECAY"))
+    if floor is None:
+        floor = float(get_singleton(CONFIG, "SG_EVICTION_FLOOR")) * 1024 * 1024
+
+    try:
+        policy_class = EVICTION_POLICIES[name.lower()]
+    except KeyError:
+        if "." not in name:
+            raise ObjectCacheError(
+                "Unknown eviction policy %s! Supported policies: %s"
+                % (name, ", ".join(EVICTION_POLICIES))
+            )
+        index = name.rindex(".")
+        try:
+            policy_class = getattr(import_module(name[:index]), name[index + 1 :])
+        except (ImportError, AttributeError) as e:
+            raise ObjectCacheError("Error loading eviction policy %s" % name) from e
+    return policy_class(decay_constant=decay_constant, floor=floor)
+
+
+class TraceEntry(NamedTuple):
+    """A recorded object cache access."""
+
+    object_id: str
+    size: int
+    timestamp: dt
+
+
+def write_trace(path: str, entries: Iterable[TraceEntry]) -> None:
+    """Append object cache accesses to a trace file (CSV of object ID, size and ISO timestamp)."""
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        for entry in entries:
+            writer.writerow((entry.object_id, entry.size, entry.timestamp.isoformat()))
+
+
+def read_trace(path: str) -> Iterator[TraceEntry]:
+    """
+    Read object cache accesses from a trace file. The timestamps can be either in
+    the ISO format or UNIX timestamps.
+    """
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if not row:
+                continue
+            object_id, size, timestamp = row
+            yield TraceEntry(object_id, int(size), _parse_timestamp(timestamp))
+
+
+def _parse_timestamp(timestamp: str) -> dt:
+    try:
+        return dt.utcfromtimestamp(float(timestamp))
+    except ValueError:
+        pass
+    # datetime.fromisoformat is only available from Python 3.7.
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f"):
+        try:
+            return dt.strptime(timestamp, fmt)
+        except ValueError:
+            continue
+    raise ValueError("Invalid timestamp %s" % timestamp)
+
+
+class SimulationResult(NamedTuple):
+    """Statistics of replaying an object cache trace against an eviction policy."""
+
+    requests: int
+    hits: int
+    bytes_requested: int
+    bytes_hit: int
+    evictions: int
+    objects_evicted: int
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.requests if self.requests else 0.0
+
+    @property
+    def byte_hit_ratio(self) -> float:
+        return self.bytes_hit / self.bytes_requested if self.bytes_requested else 0.0
+
+
+def simulate_eviction(
+    trace: Iterable[TraceEntry],
+    policy: EvictionPolicy,
+    cache_size: int,
+    min_fraction: Optional[float] = None,
+) -> SimulationResult:
+    """
+    Replay object cache accesses against an eviction policy.
+
+    This simulates the object manager: objects that aren't in the cache are downloaded,
+    and if the cache doesn't have enough space for them, eviction frees at least
+    ``min_fraction`` of the cache. Objects are assumed to be released straight after they've
+    been accessed (so that they can always be evicted) and objects bigger than the whole cache
+    are counted as misses without being cached.
+
+    :param trace: Object cache accesses, ordered by time.
+    :param policy: Eviction policy
+    :param cache_size: Cache size in bytes
+    :param min_fraction: See ``SG_EVICTION_MIN_FRACTION``.
+    :return: Statistics of the run.
+    """
+    if min_fraction is None:
+        min_fraction = float(get_singleton(CONFIG, "SG_EVICTION_MIN_FRACTION"))
+
+    cache: Dict[str, CacheEntry] = {}
+    occupancy = 0
+    inflation = 0.0
+    requests = hits = bytes_requested = bytes_hit = evictions = objects_evicted = 0
+
+    for object_id, size, timestamp in trace:
+        requests += 1
+        bytes_requested += size
+
+        entry = cache.get(object_id)
+        if entry:
+            hits += 1
+            bytes_hit += entry.size
+            cache[object_id] = entry._replace(
+                last_used=timestamp, access_count=entry.access_count + 1, inflation=inflation
+            )
+            continue
+
+        if size > cache_size:
+            continue
+
+        if occupancy + size > cache_size:
+            required_space = max(occupancy + size - cache_size, int(min_fraction * cache_size))
+            victims, max_score = policy.select_victims(
+                list(cache.values()), required_space, now=timestamp
+            )
+            for victim in victims:
+                del cache[victim.object_id]
+                occupancy -= victim.size
+            if policy.aging and victims:
+                inflation = max(inflation, max_score)
+            evictions += 1
+            objects_evicted += len(victims)
+
+        cache[object_id] = CacheEntry(object_id, size, timestamp, 1, inflation)
+        occupancy += size
+
+    return SimulationResult(
+        requests=requests,
+        hits=hits,
+        bytes_requested=bytes_requested,
+        bytes_hit=bytes_hit,
+        evictions=evictions,
+        objects_evicted=objects_evicted,
+    )
+
+
+# Distinguishes evictors running in the same process
+_EVICTOR_IDS = itertools.count(1)
+
+
+class CacheEvictor:
+    """
+    Keeps the object cache occupancy under a low watermark in the background, so that
+    queries rarely have to run eviction themselves.
+
+    When the cache occupancy goes above ``SG_EVICTION_HIGH_WATERMARK`` of the cache size,
+    the evictor evicts objects until it's down to ``SG_EVICTION_LOW_WATERMARK``. Objects that
+    are being used can't be evicted, so the evictor frees as much space as it can instead.
+
+    Every run is recorded in ``splitgraph_meta.object_cache_evictor`` (see
+    :func:`get_evictor_status`).
+
+    :param object_manager: Object manager to run eviction with. If the evictor runs in
+        a thread, this has to have its own engines (see
+        :meth:`splitgraph.core.object_manager.ObjectManager.start_background_eviction`).
+    :param interval: Time between runs, in seconds. Default ``SG_EVICTION_INTERVAL``.
+    :param low_watermark: Default ``SG_EVICTION_LOW_WATERMARK``.
+    :param high_watermark: Default ``SG_EVICTION_HIGH_WATERMARK``.
+    """
+
+    def __init__(
+        self,
+        object_manager: "ObjectManager",
+        interval: Optional[float] = None,
+        low_watermark: Optional[float] = None,
+        high_watermark: Optional[float] = None,
+    ) -> None:
+        self.object_manager = object_manager
+        self.interval = interval or float(get_singleton(CONFIG, "SG_EVICTION_INTERVAL"))
+        self.low_watermark = (
+            low_watermark
+            if low_watermark is not None
+            else float(get_singleton(CONFIG, "SG_EVICTION_LOW_WATERMARK"))
+        )
+        self.high_watermark = (
+            high_watermark
+            if high_watermark is not None
+            else float(get_singleton(CONFIG, "SG_EVICTION_HIGH_WATERMARK"))
+        )
+        if not 0 <= self.low_watermark <= self.high_watermark <= 1:
+            raise ObjectCacheError(
+                "Invalid eviction watermarks: need 0 <= low (%s) <= high (%s) <= 1"
+                % (self.low_watermark, self.high_watermark)
+            )
+
+        self.evictor_id = "%s:%d:%d" % (socket.gethostname(), os.getpid(), next(_EVICTOR_IDS))
+        self.started = dt.utcnow()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> int:
+        """
+        Run eviction if the cache occupancy is above the high watermark.
+
+        :return: Space freed, in bytes.
+        """
+        object_manager = self.object_manager
+        occupancy = object_manager.get_cache_occupancy()
+        object_manager.object_engine.commit()
+
+        freed_space = 0
+        if occupancy > self.high_watermark * object_manager.cache_size:
+            to_free = occupancy - int(self.low_watermark * object_manager.cache_size)
+            logging.info("Cache occupancy above the high watermark, evicting %d bytes", to_free)
+            freed_space = object_manager.run_eviction(
+                keep_objects=[], required_space=to_free, best_effort=True
+            )
+        self._record_run(freed_space)
+        return freed_space
+
+    def run(self) -> None:
+        """Run eviction every `interval` seconds until :meth:`stop` is called."""
+        logging.info(
+            "Starting the cache evictor %s (interval %.1fs, watermarks %.2f/%.2f)",
+            self.evictor_id,
+            self.interval,
+            self.low_watermark,
+            self.high_watermark,
+        )
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    logging.exception("Error running eviction")
+                    self.object_manager.object_engine.rollback()
+                    self._record_run(0, error=str(e))
+                self._stop_event.wait(self.interval)
+        finally:
+            self._unregister()
+
+    def start(self) -> None:
+        """Start running eviction in a daemon thread."""
+        self._thread = threading.Thread(target=self.run, name="sg-cache-evictor", daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = True) -> None:
+        """Stop the evictor (waiting for the current run to finish if it's in a thread)."""
+        self._stop_event.set()
+        if wait and self._thread:
+            self._thread.join()
+
+    def _record_run(self, freed_space: int, error: Optional[str] = None) -> None:
+        try:
+            engine = self.object_manager.object_engine
+            engine.run_sql(
+                SQL(
+                    "INSERT INTO {0}.object_cache_evictor (evictor_id, started, heartbeat, interval, "
+                    "runs, evictions, bytes_freed, last_error) VALUES (%s, %s, %s, %s, 1, %s, %s, %s) "
+                    "ON CONFLICT (evictor_id) DO UPDATE SET heartbeat = EXCLUDED.heartbeat, "
+                    "interval = EXCLUDED.interval, "
+                    "runs = {0}.object_cache_evictor.runs + 1, "
+                    "evictions = {0}.object_cache_evictor.evictions + EXCLUDED.evictions, "
+                    "bytes_freed = {0}.object_cache_evictor.bytes_freed + EXCLUDED.bytes_freed, "
+                    "last_error = EXCLUDED.last_error"
+                ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                (
+                    self.evictor_id,
+                    self.started,
+                    dt.utcnow(),
+                    self.interval,
+                    1 if freed_space else 0,
+                    freed_space,
+                    error,
+                ),
+            )
+            engine.commit()
+        except Exception:
+            logging.exception("Error recording the evictor status")
+
+    def _unregister(self) -> None:
+        engine = self.object_manager.object_engine
+        try:
+            engine.run_sql(
+                SQL("DELETE FROM {}.object_cache_evictor WHERE evictor_id = %s").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA)
+                ),
+                (self.evictor_id,),
+            )
+            engine.commit()
+        except Exception:
+            logging.exception("Error unregistering the evictor")
+
+
+class EvictorStatus(NamedTuple):
+    """Status of a background cache evictor."""
+
+    evictor_id: str
+    started: dt
+    heartbeat: dt
+    interval: float
+    runs: int
+    evictions: int
+    bytes_freed: int
+    last_error: Optional[str]
+
+    def is_alive(self, now: Optional[dt] = None) -> bool:
+        """Whether the evictor has run recently (within 3 of its intervals)."""
+        now = now or dt.utcnow()
+        return (now - self.heartbeat).total_seconds() <= max(3 * self.interval, 60)
+
+
+def get_evictor_status(engine: "PsycopgEngine") -> List[EvictorStatus]:
+    """Get the status of the background cache evictors registered on an engine."""
+    return [
+        EvictorStatus(*r)
+        for r in engine.run_sql(
+            SQL(
+                "SELECT evictor_id, started, heartbeat, interval, runs, evictions, "
+                "bytes_freed, last_error FROM {}.object_cache_evictor ORDER BY evictor_id"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            return_shape=ResultShape.MANY_MANY,
+        )
+    ]
@@ -3,6 +3,7 @@ layered querying (read-only queries to Splitgraph tables without materialization
 import logging
 
 import splitgraph.config
+from splitgraph.config import CONFIG, get_singleton
 from splitgraph.core.output import pretty_size
 from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository, get_engine
@@ -108,7 +109,9 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
 
         log_to_postgres("CNF quals: %r" % (cnf_quals,), _PG_LOGLEVEL)
 
-        queries, self.end_scan_callback, self.plan = self.table.query_indirect(columns, cnf_quals)
+        queries, self.end_scan_callback, self.plan = self.table.query_indirect(
+            columns, cnf_quals, prefetch=self.prefetch
+        )
         yield from queries
 
     def end_scan(self):
@@ -182,3 +185,6 @@ class QueryingForeignDataWrapper(ForeignDataWrapper):
 
         # A QueryPlan object for the last query with stats
         self.plan = None
+
+        # Start returning rows from fragments as soon as they've been downloaded
+        self.prefetch = get_singleton(CONFIG, "SG_LQ_PREFETCH") == "true"
@@ -7,23 +7,47 @@ import itertools
 import json
 import logging
 import math
-import operator
 import struct
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from functools import reduce
 from hashlib import sha256
 from random import getrandbits
-from typing import Any, Dict, List, Optional, Set, Tuple, Union, TYPE_CHECKING, cast
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    TYPE_CHECKING,
+    cast,
+)
 
 from psycopg2.errors import UniqueViolation
-from psycopg2.sql import SQL, Identifier
+from psycopg2.sql import SQL, Composable, Identifier
 from tqdm import tqdm
 
-from splitgraph.config import SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
-from splitgraph.core.indexing.bloom import generate_bloom_index, filter_bloom_index
+from splitgraph.config import CONFIG, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII, get_singleton
+from splitgraph.core.indexing.bloom import (
+    build_bloom_index,
+    generate_bloom_index,
+    get_bloom_digests,
+)
+from splitgraph.core.indexing.fragment_index import FragmentIndex
 from splitgraph.core.indexing.range import (
+    finalize_range_index,
     generate_range_index,
     filter_range_index,
+    get_min_max_pk,
+    get_range_aggregates,
+    get_range_index_columns,
 )
 from splitgraph.core.metadata_manager import MetadataManager, Object
 from splitgraph.core.types import Changeset, TableSchema
@@ -38,6 +62,9 @@ if TYPE_CHECKING:
     from splitgraph.core.table import Table
     from splitgraph.engine.postgres.engine import PostgresEngine
 
+# Temporary table that values of deleted rows are loaded into to hash them
+_DELETED_ROWS_TABLE = "sg_tmp_deleted_rows"
+
 
 def _split_changeset(
     changeset: Changeset, min_max: List[Tuple[Any, Any]], table_pks: List[Tuple[str, str]]
@@ -126,6 +153,10 @@ def get_chunk_groups(chunks: List[Tuple[str, Any, Any]],) -> List[List[Tuple[str
     return [[c[1:] for c in sorted(chunks)] for chunks in groups]
 
 
+# Number of digests that Digest.sum_many loads into memory at the same time
+_SUM_BATCH_SIZE = 65536
+
+
 class Digest:
     """
     Homomorphic hashing similar to LtHash (but limited to being backed by 256-bit hashes). The main property is that
@@ -167,6 +198,29 @@ class Digest:
         assert len(hex_string) == 64
         return cls(tuple(int(hex_string[i : i + 4], base=16) for i in range(0, 64, 4)))
 
+    @classmethod
+    def sum_many(cls, memories: Iterable[Union[bytes, memoryview]]) -> "Digest":
+        """
+        Add up multiple 256-bit digests (as memoryviews/bytearrays). This is equivalent to
+        adding them up one by one but much faster for large amounts of digests: every batch
+        of digests is loaded into an N x 16 array of unsigned shorts and each of the 16
+        columns is summed up in one go, with the wraparound only applied at the end.
+        """
+        totals = [0] * 16
+        memories = iter(memories)
+        while True:
+            batch = b"".join(itertools.islice(memories, _SUM_BATCH_SIZE))
+            if not batch:
+                break
+            assert len(batch) % 32 == 0
+            shorts = array("H", batch)
+            # Digests are stored as big-endian shorts.
+            if sys.byteorder == "little":
+                shorts.byteswap()
+            for i in range(16):
+                totals[i] += sum(shorts[i::16])
+        return cls(tuple(t & 0xFFFF for t in totals))
+
     # In these routines, we treat each hash as a vector of 16 2-byte integers and do component-wise addition.
     # To simulate the wraparound behaviour of C shorts, throw away all remaining bits after the action.
     def __add__(self, other: "Digest") -> "Digest":
@@ -200,6 +254,12 @@ class FragmentManager(MetadataManager):
     that are required for a given query.
     """
 
+    # Process-wide cache of compiled fragment indexes, keyed by the engine, the table's
+    # objects and its column types (see FragmentIndex)
+    _fragment_index_cache: "OrderedDict[Tuple, Tuple[int, FragmentIndex]]" = OrderedDict()
+    _fragment_index_cache_size = 32
+    _fragment_index_lock = threading.Lock()
+
     def __init__(
         self, object_engine: "PostgresEngine", metadata_engine: Optional["PostgresEngine"] = None
     ) -> None:
@@ -223,7 +283,41 @@ class FragmentManager(MetadataManager):
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
         :return: Dict containing the object index.
         """
-        extra_indexes: ExtraIndexInfo = extra_indexes or {}
+        range_index_columns, bloom_index_cols = self._get_index_options(extra_indexes)
+        range_index: Dict[str, Any] = generate_range_index(
+            self.object_engine, object_id, table_schema, changeset, columns=range_index_columns
+        )
+        indexes = {"range": range_index}
+
+        # Process extra indexes
+        if bloom_index_cols is not None:
+            index_dict = {}
+            for index_col, index_kwargs in bloom_index_cols.items():
+                logging.debug(
+                    "Running index %s on column %s with parameters %r",
+                    "bloom",
+                    index_col,
+                    index_kwargs,
+                )
+                index_dict[index_col] = generate_bloom_index(
+                    self.object_engine, object_id, changeset, index_col, **index_kwargs
+                )
+            indexes["bloom"] = index_dict
+
+        return indexes
+
+    @staticmethod
+    def _get_index_options(
+        extra_indexes: Optional[ExtraIndexInfo],
+    ) -> Tuple[Optional[List[str]], Optional[Dict[str, Dict[str, Any]]]]:
+        """
+        Validate the extra index options.
+
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :return: Tuple of (columns to run the range index on or None for all columns,
+            dictionary of {column: bloom index kwargs} or None if the bloom index isn't requested)
+        """
+        extra_indexes = extra_indexes or {}
 
         # Default None, meaning run range index on all columns.
         range_index_columns: Optional[List[str]]
@@ -231,12 +325,8 @@ class FragmentManager(MetadataManager):
             range_index_columns = list(extra_indexes["range"])
         except KeyError:
             range_index_columns = None
-        range_index: Dict[str, Any] = generate_range_index(
-            self.object_engine, object_id, table_schema, changeset, columns=range_index_columns
-        )
-        indexes = {"range": range_index}
 
-        # Process extra indexes
+        bloom_index_cols = None
         for index_name, index_cols in extra_indexes.items():
             if index_name == "range":
                 continue
@@ -247,21 +337,8 @@ class FragmentManager(MetadataManager):
                     "Unexpected options for index 'bloom': "
                     "got list, expected dictionary {column: {probability/size: ...}}!"
                 )
-
-            index_dict = {}
-            for index_col, index_kwargs in index_cols.items():
-                logging.debug(
-                    "Running index %s on column %s with parameters %r",
-                    index_name,
-                    index_col,
-                    index_kwargs,
-                )
-                index_dict[index_col] = generate_bloom_index(
-                    self.object_engine, object_id, changeset, index_col, **index_kwargs
-                )
-            indexes[index_name] = index_dict
-
-        return indexes
+            bloom_index_cols = cast(Dict[str, Dict[str, Any]], index_cols)
+        return range_index_columns, bloom_index_cols
 
     def _register_object(
         self,
@@ -274,6 +351,7 @@ class FragmentManager(MetadataManager):
         rows_deleted: int,
         changeset: Optional[Changeset] = None,
         extra_indexes: Optional[ExtraIndexInfo] = None,
+        object_index: Optional[Dict[str, Any]] = None,
     ) -> None:
         """
         Registers a Splitgraph object in the object tree and indexes it
@@ -290,26 +368,60 @@ class FragmentManager(MetadataManager):
             are used to generate the min/max index for an object to know if it removes/updates some rows
             that might be pertinent to a query.
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :param object_index: Precomputed object index. If specified, the object isn't reindexed.
         """
-        object_size = self.object_engine.get_object_size(object_id)
-        object_index = self.generate_object_index(object_id, table_schema, changeset, extra_indexes)
         self.register_objects(
             [
-                Object(
-                    object_id=object_id,
-                    format="FRAG",
-                    namespace=namespace,
-                    size=object_size,
-                    created=datetime.utcnow(),
-                    insertion_hash=insertion_hash,
-                    deletion_hash=deletion_hash,
-                    object_index=object_index,
-                    rows_inserted=rows_inserted,
-                    rows_deleted=rows_deleted,
+                self._get_object_meta(
+                    object_id,
+                    namespace,
+                    insertion_hash,
+                    deletion_hash,
+                    table_schema,
+                    rows_inserted,
+                    rows_deleted,
+                    changeset,
+                    extra_indexes,
+                    object_index,
                 )
             ]
         )
 
+    def _get_object_meta(
+        self,
+        object_id: str,
+        namespace: str,
+        insertion_hash: str,
+        deletion_hash: str,
+        table_schema: TableSchema,
+        rows_inserted: int,
+        rows_deleted: int,
+        changeset: Optional[Changeset] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        object_index: Optional[Dict[str, Any]] = None,
+    ) -> Object:
+        """
+        Indexes a stored Splitgraph object and builds its metadata without registering it.
+        Only uses the object engine. See `_register_object` for the parameters.
+        """
+        object_size = self.object_engine.get_object_size(object_id)
+        if object_index is None:
+            object_index = self.generate_object_index(
+                object_id, table_schema, changeset, extra_indexes
+            )
+        return Object(
+            object_id=object_id,
+            format="FRAG",
+            namespace=namespace,
+            size=object_size,
+            created=datetime.utcnow(),
+            insertion_hash=insertion_hash,
+            deletion_hash=deletion_hash,
+            object_index=object_index,
+            rows_inserted=rows_inserted,
+            rows_deleted=rows_deleted,
+        )
+
     @staticmethod
     def _extract_deleted_rows(changeset: Any, table_schema: TableSchema) -> Any:
         change_key = get_change_key(table_schema)
@@ -349,23 +461,56 @@ class FragmentManager(MetadataManager):
 
         # Horror alert: we hash newly created tables by essentially calling digest(row::text) in Postgres and
         # we don't really know how it turns some types to strings. So instead we give Postgres all of its deleted
-        # rows back and ask it to hash them for us in the same way.
-        inner_tuple = "(" + ",".join("%s::" + c.pg_type for c in table_schema) + ")"
+        # rows back (loading them into a temporary table with COPY) and ask it to hash them for us in the same way.
+        self.object_engine.copy_to_temporary_table(
+            _DELETED_ROWS_TABLE, [(c.name, c.pg_type) for c in table_schema], rows
+        )
         query = (
-            "SELECT digest(o::text, 'sha256') FROM (VALUES "
-            + ",".join(itertools.repeat(inner_tuple, len(rows)))
-            + ") o"
+            SQL("SELECT digest(ROW(")
+            + SQL(",").join(
+                SQL("o.{}::%s" % c.pg_type).format(Identifier(c.name)) for c in table_schema
+            )
+            + SQL(")::text, 'sha256') FROM pg_temp.{} o").format(Identifier(_DELETED_ROWS_TABLE))
         )
 
         # By default (e.g. for changesets where nothing was deleted) we use a 0 hash (since adding it to any other
         # hash has no effect).
-        digests = self.object_engine.run_sql(
-            query, [o for row in rows for o in row], return_shape=ResultShape.MANY_ONE
+        result = self._sum_row_digests(query)
+        self.object_engine.run_sql(
+            SQL("DROP TABLE pg_temp.{}").format(Identifier(_DELETED_ROWS_TABLE))
         )
-        return (
-            reduce(operator.add, map(Digest.from_memoryview, digests), Digest.empty()),
-            len(digests),
+        return result
+
+    def _sum_row_digests(
+        self, digest_query: Composable, args: Optional[Sequence[Any]] = None
+    ) -> Tuple[Digest, int]:
+        """
+        Sum up row digests produced by a query.
+
+        If the engine has `splitgraph_api.lthash_sum` installed, the sum is calculated
+        on the engine and only one row is sent back. Otherwise, every row digest
+        is fetched and added up by the `Digest` class.
+
+        :param digest_query: Query returning one sha256 digest (bytea) per row
+        :param args: Arguments to the query
+        :return: `Digest` object and the number of rows hashed.
+        """
+        if self.object_engine.has_lthash_sum():
+            with self.object_engine.connection.cursor() as cur:
+                query = cur.mogrify(digest_query, args).decode("utf-8")
+            content_hash, rows = self.object_engine.run_sql(
+                SQL("SELECT content_hash, row_count FROM {}.lthash_sum(%s)").format(
+                    Identifier(SPLITGRAPH_API_SCHEMA)
+                ),
+                (query,),
+                return_shape=ResultShape.ONE_MANY,
+            )
+            return Digest.from_hex(content_hash), rows
+
+        row_digests = self.object_engine.run_sql(
+            digest_query, args, return_shape=ResultShape.MANY_ONE
         )
+        return Digest.sum_many(row_digests), len(row_digests)
 
     def _store_changesets(
         self,
@@ -503,11 +648,10 @@ class FragmentManager(MetadataManager):
             )
             + SQL(" WHERE o.{} = true").format(Identifier(SG_UD_FLAG))
         )
-        row_digests = self.object_engine.run_sql(digest_query, return_shape=ResultShape.MANY_ONE)
-        insertion_hash = reduce(
-            operator.add, (Digest.from_memoryview(r) for r in row_digests), Digest.empty()
-        )
-        return insertion_hash, len(row_digests)
+        return self._sum_row_digests(digest_query)
+
+    def _discard_pending_changes(self, schema: str, table: str) -> None:
+        self.object_engine.discard_pending_changes(schema, table)
 
     def record_table_as_patch(
         self,
@@ -540,14 +684,20 @@ class FragmentManager(MetadataManager):
 
         # Accumulate the diff in-memory. This might become a bottleneck in the future.
         changeset: Changeset = {}
-        _conflate_changes(
-            changeset,
-            cast(
-                List[Tuple[Tuple[str, ...], bool, Dict[str, Any], Dict[str, Any]]],
-                self.object_engine.get_pending_changes(schema, old_table.table_name),
-            ),
-        )
-        self.object_engine.discard_pending_changes(schema, old_table.table_name)
+        if get_singleton(CONFIG, "SG_COMMIT_CONFLATE_ON_ENGINE") == "true":
+            # Let the engine conflate the audit log and stream the result in batches
+            # instead of fetching every logged action.
+            for batch in self.object_engine.get_conflated_changes(schema, old_table.table_name):
+                _conflate_changes(changeset, batch)
+        else:
+            _conflate_changes(
+                changeset,
+                cast(
+                    List[Tuple[Tuple[str, ...], bool, Dict[str, Any], Dict[str, Any]]],
+                    self.object_engine.get_pending_changes(schema, old_table.table_name),
+                ),
+            )
+        self._discard_pending_changes(schema, old_table.table_name)
         current_objects = old_table.objects
 
         new_schema_spec = new_schema_spec or old_table.table_schema
@@ -614,43 +764,29 @@ class FragmentManager(MetadataManager):
         """
         # If the PK isn't composite, we can read the range for the corresponding column
         # from the index, otherwise, the indexer stored the min/max tuple under $pk.
+        # Use the cached object metadata rather than query the index on the engine.
         pk = table_pks[0][0] if len(table_pks) == 1 else "$pk"
-        fields = SQL("object_id, index #>> '{{range,{0},0}}', index #>> '{{range,{0},1}}'").format(
-            Identifier(pk)
-        )
-
-        result = {
-            r[0]: (r[1], r[2])
-            for r in self.metadata_engine.run_chunked_sql(
-                select(
-                    "get_object_meta",
-                    fields.as_string(self.metadata_engine.connection),
-                    table_args="(%s)",
-                    schema=SPLITGRAPH_API_SCHEMA,
-                ),
-                (fragments,),
-                chunk_position=0,
-            )
-        }
-
-        # Since the PK can't contain a NULL, if we do get one here, it's from the JSON query
-        # (column doesn't exist in the index).
+        object_meta = self.get_object_meta(fragments)
 
         min_max = []
         for fragment in fragments:
-            if fragment not in result:
+            if fragment not in object_meta:
                 raise SplitGraphError("No metadata found for object %s!" % fragment)
-            min_pk, max_pk = result[fragment]
-            if min_pk is None or max_pk is None:
+            pk_range = (object_meta[fragment].object_index or {}).get("range", {}).get(pk)
+            # Since the PK can't contain a NULL, if we do get one here, the column
+            # doesn't exist in the index.
+            if not pk_range or pk_range[0] is None or pk_range[1] is None:
                 raise SplitGraphError("No index found for object %s!" % fragment)
+            min_pk, max_pk = pk_range
             if pk == "$pk":
-                # For composite PKs, we're given back a JSON array and need to load it.
-                min_pk = tuple(json.loads(min_pk))
-                max_pk = tuple(json.loads(max_pk))
+                min_pk = tuple(min_pk)
+                max_pk = tuple(max_pk)
             else:
-                # Single-column PKs still need to be returned as tuples.
-                min_pk = (min_pk,)
-                max_pk = (max_pk,)
+                # Single-column PKs still need to be returned as tuples. Also turn non-string
+                # JSON values into text (like the ->> operator would) to make sure they
+                # get coerced in the same way.
+                min_pk = (min_pk if isinstance(min_pk, str) else json.dumps(min_pk),)
+                max_pk = (max_pk if isinstance(max_pk, str) else json.dumps(max_pk),)
 
             # Coerce the PKs to the actual Python types
             min_pk = tuple(adapt(v, c[1]) for v, c in zip(min_pk, table_pks))
@@ -666,6 +802,8 @@ class FragmentManager(MetadataManager):
         table_schema: Optional[TableSchema] = None,
         chunk_id_col: Optional[str] = None,
         chunk_id: Optional[int] = None,
+        extra_quals: Optional[Composable] = None,
+        extra_qual_args: Optional[Sequence[Any]] = None,
     ) -> Tuple[str, int]:
         """
         Calculates the homomorphic hash of table contents.
@@ -675,6 +813,9 @@ class FragmentManager(MetadataManager):
         :param table_schema: Schema of the table
         :param chunk_id_col: Column the table is partitioned on
         :param chunk_id: Column value to get rows from
+        :param extra_quals: Optional, alternative to chunk_id_col: SQL condition that selects
+            the rows to hash.
+        :param extra_qual_args: Arguments for `extra_quals`.
         :return: A 64-character (256-bit) hexadecimal string with the content hash of the table
             and the number of rows in the hash.
         """
@@ -690,16 +831,124 @@ class FragmentManager(MetadataManager):
         if chunk_id_col:
             digest_query += SQL(" WHERE {} = %s").format(Identifier(chunk_id_col))
             args = [chunk_id]
+        elif extra_quals:
+            digest_query += SQL(" WHERE ") + extra_quals
+            args = extra_qual_args
 
-        row_digests = self.object_engine.run_sql(
-            digest_query, args, return_shape=ResultShape.MANY_ONE
+        content_hash, rows = self._sum_row_digests(digest_query, args)
+        return content_hash.hex(), rows
+
+    def _calculate_base_fragment_stats(
+        self,
+        source_schema: str,
+        source_table: str,
+        table_schema: TableSchema,
+        extra_quals: Optional[Composable] = None,
+        extra_qual_args: Optional[Sequence[Any]] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+    ) -> Tuple[str, int, Dict[str, Any]]:
+        """
+        Calculate the content hash, the number of rows and the index of a new base fragment
+        from the rows that it will be created from. This is equivalent to running
+        `calculate_content_hash` and `generate_object_index` on the new fragment, but
+        computes the hash, the ranges of all columns and the bloom filter digests in one scan.
+
+        :param source_schema: Schema the source table belongs to
+        :param source_table: Name of the source table
+        :param table_schema: Schema of the fragment
+        :param extra_quals: Optional SQL condition that selects the rows to be stored.
+        :param extra_qual_args: Arguments for `extra_quals`.
+        :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
+        :return: Tuple of (content hash, number of rows, object index).
+        """
+        range_index_columns, bloom_index_cols = self._get_index_options(extra_indexes)
+        columns_to_index, object_pk, column_types = get_range_index_columns(
+            table_schema, range_index_columns
+        )
+
+        # Calculate the digest of every row in a subquery (OFFSET 0 stops the planner from inlining
+        # it and recomputing the digest for every LtHash component) and aggregate the digests,
+        # the column ranges and the distinct digests of columns with a bloom index on top of it.
+        # The subquery only outputs the fragment's columns and the digest, which gets a name that
+        # none of these columns have.
+        column_names = {c.name for c in table_schema}
+        digest_name = "sg_row_digest"
+        while digest_name in column_names:
+            digest_name = "_" + digest_name
+        digest_col = Identifier(digest_name)
+        aggregates: List[Composable] = [SQL("count({})").format(digest_col)]
+        aggregates.extend(
+            SQL("sum(get_byte({0}, %d) * 256 + get_byte({0}, %d))" % (2 * i, 2 * i + 1)).format(
+                digest_col
+            )
+            for i in range(16)
+        )
+        if columns_to_index:
+            aggregates.append(get_range_aggregates(columns_to_index, column_types))
+        if bloom_index_cols:
+            aggregates.extend(
+                SQL("array_agg(DISTINCT ") + SQL(" || ").join(get_bloom_digests(c)) + SQL(")")
+                for c in bloom_index_cols
+            )
+
+        query = (
+            SQL("SELECT ")
+            + SQL(",").join(aggregates)
+            + SQL(" FROM (SELECT digest((")
+            + SQL(",").join(Identifier(c.name) for c in table_schema)
+            + SQL(")::text, 'sha256'::text) AS {},").format(digest_col)
+            + SQL(",").join(Identifier(c.name) for c in table_schema)
+            + SQL(" FROM {}.{} o").format(Identifier(source_schema), Identifier(source_table))
         )
+        if extra_quals:
+            query += SQL(" WHERE ") + extra_quals
+        query += SQL(" OFFSET 0) o")
 
-        return (
-            reduce(operator.add, (Digest.from_memoryview(r) for r in row_digests)).hex(),
-            len(row_digests),
+        logging.debug("Running range index on columns %s", columns_to_index)
+        result = self.object_engine.run_sql(
+            query, extra_qual_args, return_shape=ResultShape.ONE_MANY
         )
 
+        rows = result[0]
+        content_hash = Digest(tuple((s or 0) % 65536 for s in result[1:17])).hex()
+        ranges = result[17 : 17 + len(columns_to_index) * 2]
+        index = {
+            col: (cmin, cmax)
+            for col, cmin, cmax in zip(columns_to_index, ranges[0::2], ranges[1::2])
+        }
+        # Composite PK ranges can't be calculated with an aggregate, so get them with
+        # ORDER BY ... LIMIT 1 queries against the source rather than the new object. Text PK
+        # columns are ordered with COLLATE "C" (like in the rest of the range index), so unless
+        # the source uses that collation, these can't use its PK index and are top-N sorts.
+        if len(object_pk) > 1:
+            index["$pk"] = get_min_max_pk(
+                self.object_engine,
+                SQL("{}.{}").format(Identifier(source_schema), Identifier(source_table)),
+                object_pk,
+                [column_types[c] for c in object_pk],
+                extra_quals,
+                extra_qual_args,
+            )
+        object_index: Dict[str, Any] = {
+            "range": finalize_range_index(index, None, columns_to_index, column_types)
+        }
+
+        if bloom_index_cols is not None:
+            bloom_digests = result[17 + len(columns_to_index) * 2 :]
+            object_index["bloom"] = {
+                index_col: build_bloom_index(
+                    [(bytes(d[:32]), bytes(d[32:])) for d in digests or []],
+                    None,
+                    index_col,
+                    **index_kwargs
+                )
+                for (index_col, index_kwargs), digests in zip(
+                    bloom_index_cols.items(), bloom_digests
+                )
+            }
+
+        return content_hash, rows, object_index
+
     def create_base_fragment(
         self,
         source_schema: str,
@@ -727,10 +976,67 @@ class FragmentManager(MetadataManager):
             if c.name != chunk_id_col
         ]
 
+        extra_quals: Optional[Composable] = None
+        extra_qual_args: List[Any] = []
+        if chunk_id_col:
+            extra_quals = SQL("{} = %s").format(Identifier(chunk_id_col))
+            extra_qual_args = [chunk_id]
+
+        object_id, content_hash, rows_inserted, object_index = self._store_base_fragment(
+            source_schema,
+            source_table,
+            table_schema,
+            extra_quals,
+            extra_qual_args,
+            extra_indexes=extra_indexes,
+            in_fragment_order=in_fragment_order,
+            overwrite=overwrite,
+        )
+
+        with self.metadata_engine.savepoint("object_register"):
+            try:
+                self._register_object(
+                    object_id,
+                    namespace=namespace,
+                    insertion_hash=content_hash,
+                    deletion_hash="0" * 64,
+                    table_schema=table_schema,
+                    rows_inserted=rows_inserted,
+                    rows_deleted=0,
+                    object_index=object_index,
+                )
+            except UniqueViolation:
+                # Someone registered this object (perhaps a concurrent pull) already.
+                logging.info(
+                    "Object %s for table %s/%s already exists, continuing...",
+                    object_id,
+                    source_schema,
+                    source_table,
+                )
+
+        return object_id
+
+    def _store_base_fragment(
+        self,
+        source_schema: str,
+        source_table: str,
+        table_schema: TableSchema,
+        extra_quals: Optional[Composable] = None,
+        extra_qual_args: Optional[Sequence[Any]] = None,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+    ) -> Tuple[str, str, int, Dict[str, Any]]:
+        """
+        Hashes and indexes rows of a table (optionally filtered by `extra_quals`) and stores them
+        as a physical object without registering it.
+
+        :return: Tuple of (object ID, content hash, number of rows, object index).
+        """
         schema_hash = self._calculate_schema_hash(table_schema)
-        # Get content hash for this chunk.
-        content_hash, rows_inserted = self.calculate_content_hash(
-            source_schema, source_table, table_schema, chunk_id_col=chunk_id_col, chunk_id=chunk_id
+        # Get content hash and the index for this chunk.
+        content_hash, rows_inserted, object_index = self._calculate_base_fragment_stats(
+            source_schema, source_table, table_schema, extra_quals, extra_qual_args, extra_indexes,
         )
 
         # Object IDs are also used to key tables in Postgres so they can't be more than 63 characters.
@@ -740,7 +1046,7 @@ class FragmentManager(MetadataManager):
 
         with self.object_engine.savepoint("object_rename"):
             # Store the object adding the extra update/delete column (always True in this case
-            # since we don't overwrite any rows) and filtering on the chunk ID.
+            # since we don't overwrite any rows) and filtering on the chunk.
 
             source_query = (
                 SQL("SELECT ")
@@ -749,11 +1055,9 @@ class FragmentManager(MetadataManager):
                 + Identifier(SG_UD_FLAG)
                 + SQL("FROM {}.{}").format(Identifier(source_schema), Identifier(source_table))
             )
-            source_query_args = []
 
-            if chunk_id_col:
-                source_query += SQL("WHERE {} = %s").format(Identifier(chunk_id_col))
-                source_query_args = [chunk_id]
+            if extra_quals:
+                source_query += SQL(" WHERE ") + extra_quals
 
             if in_fragment_order:
                 source_query += SQL(" ") + self._get_order_by_clause(
@@ -763,31 +1067,10 @@ class FragmentManager(MetadataManager):
                 object_id=object_id,
                 source_query=source_query,
                 schema_spec=add_ud_flag_column(table_schema),
-                source_query_args=source_query_args,
+                source_query_args=list(extra_qual_args or []),
                 overwrite=overwrite,
             )
-        with self.metadata_engine.savepoint("object_register"):
-            try:
-                self._register_object(
-                    object_id,
-                    namespace=namespace,
-                    insertion_hash=content_hash,
-                    deletion_hash="0" * 64,
-                    table_schema=table_schema,
-                    extra_indexes=extra_indexes,
-                    rows_inserted=rows_inserted,
-                    rows_deleted=0,
-                )
-            except UniqueViolation:
-                # Someone registered this object (perhaps a concurrent pull) already.
-                logging.info(
-                    "Object %s for table %s/%s already exists, continuing...",
-                    object_id,
-                    source_schema,
-                    source_table,
-                )
-
-        return object_id
+        return object_id, content_hash, rows_inserted, object_index
 
     @staticmethod
     def _get_order_by_clause(in_fragment_order, table_schema):
@@ -816,6 +1099,7 @@ class FragmentManager(MetadataManager):
         extra_indexes: Optional[ExtraIndexInfo] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        workers: int = 1,
     ) -> List[str]:
         """
         Copies the full table verbatim into one or more new base fragments and registers them.
@@ -829,6 +1113,9 @@ class FragmentManager(MetadataManager):
         :param extra_indexes: Dictionary of {index_type: column: index_specific_kwargs}.
         :param in_fragment_order: Key to sort data inside each chunk by.
         :param overwrite: Overwrite physical objects that already exist.
+        :param workers: If greater than 1, create the chunks in parallel using up to this many
+            extra connections to the object engine. The source table must be committed (visible to
+            other connections) and have a primary key, otherwise the table is chunked serially.
         """
         source_schema = source_schema or repository.to_schema()
         source_table = source_table or table_name
@@ -851,6 +1138,7 @@ class FragmentManager(MetadataManager):
                 extra_indexes,
                 in_fragment_order=in_fragment_order,
                 overwrite=overwrite,
+                workers=workers,
             )
 
         elif table_size:
@@ -882,6 +1170,7 @@ class FragmentManager(MetadataManager):
         table_schema: Optional[TableSchema] = None,
         in_fragment_order: Optional[List[str]] = None,
         overwrite: bool = False,
+        workers: int = 1,
     ) -> List[str]:
         table_pk = [p[0] for p in self.object_engine.get_change_key(source_schema, source_table)]
         table_schema = table_schema or self.object_engine.get_full_table_schema(
@@ -889,6 +1178,24 @@ class FragmentManager(MetadataManager):
         )
         object_ids = []
 
+        if workers > 1 and table_size > chunk_size:
+            if source_schema != "pg_temp" and any(c.is_pk for c in table_schema):
+                return self._chunk_table_parallel(
+                    repository,
+                    source_schema,
+                    source_table,
+                    table_size,
+                    chunk_size,
+                    table_schema,
+                    extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                    workers=workers,
+                )
+            logging.debug(
+                "Table %s.%s has no primary key, chunking it serially", source_schema, source_table
+            )
+
         # We need to do multiple things here in a specific way to not tank the performance:
         #  * Chunk the table up ordering by PK (or potentially another chunk key in the future)
         #  * Run LTHash on added rows in every chunk
@@ -976,6 +1283,193 @@ class FragmentManager(MetadataManager):
         self.object_engine.delete_table("pg_temp", temp_table)
         return object_ids
 
+    def _get_chunk_boundaries(
+        self, source_schema: str, source_table: str, table_schema: TableSchema, chunk_size: int
+    ) -> List[Tuple]:
+        """
+        Get the primary key of the first row of every chunk of a table in a single ordered pass
+        over the table's primary key.
+
+        :return: List of PK tuples, sorted.
+        """
+        pk_sql = SQL(",").join(Identifier(c.name) for c in table_schema if c.is_pk)
+        # Example query: SELECT pk FROM (SELECT pk, ROW_NUMBER() OVER (ORDER BY pk) - 1 AS
+        # sg_row_number FROM source_schema.table) r WHERE mod(sg_row_number, chunk_size) = 0
+        # ORDER BY pk
+        query = (
+            SQL("SELECT ")
+            + pk_sql
+            + SQL(" FROM (SELECT ")
+            + pk_sql
+            + SQL(", ROW_NUMBER() OVER (ORDER BY ")
+            + pk_sql
+            + SQL(") - 1 AS sg_row_number FROM {}.{}) r ").format(
+                Identifier(source_schema), Identifier(source_table)
+            )
+            + SQL("WHERE mod(sg_row_number, %s) = 0 ORDER BY ")
+            + pk_sql
+        )
+        return [tuple(b) for b in self.object_engine.run_sql(query, (chunk_size,))]
+
+    @staticmethod
+    def _get_pk_range_quals(
+        table_schema: TableSchema, start: Tuple, end: Optional[Tuple]
+    ) -> Tuple[Composable, List[Any]]:
+        """
+        Build a condition that selects rows with start <= PK < end (or PK >= start if end is None).
+        Row comparisons order the same way as ORDER BY pk and can use the PK index.
+        """
+        pks = [c for c in table_schema if c.is_pk]
+        pk_row = SQL("(") + SQL(",").join(Identifier(c.name) for c in pks) + SQL(")")
+        value_row = SQL("(") + SQL(",").join(SQL("%s::" + c.pg_type) for c in pks) + SQL(")")
+
+        quals = pk_row + SQL(" >= ") + value_row
+        args = list(start)
+        if end is not None:
+            quals += SQL(" AND ") + pk_row + SQL(" < ") + value_row
+            args.extend(end)
+        return quals, args
+
+    def _chunk_table_parallel(
+        self,
+        repository: "Repository",
+        source_schema: str,
+        source_table: str,
+        table_size: int,
+        chunk_size: int,
+        table_schema: TableSchema,
+        extra_indexes: Optional[ExtraIndexInfo] = None,
+        in_fragment_order: Optional[List[str]] = None,
+        overwrite: bool = False,
+        workers: int = 2,
+    ) -> List[str]:
+        # Instead of copying the table into a temporary partitioned table (which other connections
+        # can't see), get the PK boundaries of all chunks in one pass and then get every chunk out
+        # of the source table with a PK range query. Chunks are then hashed, stored and indexed in
+        # parallel, each on its own connection from the engine's pool and in its own transaction.
+        # Since chunks don't overlap, they can't produce the same object. Objects are registered
+        # in the main transaction at the end, so the commit is still atomic from the point of view
+        # of the metadata. If that transaction gets rolled back, the object engine deletes the
+        # objects that the workers have written.
+        logging.info("Processing table %s", source_table)
+        no_chunks = int(math.ceil(table_size / chunk_size))
+
+        log_progress = _log_commit_progress(table_size, no_chunks)
+        log_func = logging.info if log_progress else logging.debug
+
+        log_func("Computing table partitions")
+        boundaries = self._get_chunk_boundaries(
+            source_schema, source_table, table_schema, chunk_size
+        )
+        chunk_quals = [
+            self._get_pk_range_quals(
+                table_schema, start, boundaries[i + 1] if i + 1 < len(boundaries) else None
+            )
+            for i, start in enumerate(boundaries)
+        ]
+
+        # Leave one connection in the pool for the main thread.
+        max_workers = min(
+            workers, int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1, len(chunk_quals)
+        )
+
+        def _store_chunk(quals_args: Tuple[Composable, List[Any]]) -> Object:
+            quals, args = quals_args
+            engine = self.object_engine.clone()
+            fragment_manager = FragmentManager(engine)
+            try:
+                (
+                    object_id,
+                    content_hash,
+                    rows_inserted,
+                    object_index,
+                ) = fragment_manager._store_base_fragment(
+                    source_schema,
+                    source_table,
+                    table_schema,
+                    quals,
+                    args,
+                    extra_indexes=extra_indexes,
+                    in_fragment_order=in_fragment_order,
+                    overwrite=overwrite,
+                )
+                object_meta = fragment_manager._get_object_meta(
+                    object_id,
+                    namespace=repository.namespace,
+                    insertion_hash=content_hash,
+                    deletion_hash="0" * 64,
+                    table_schema=table_schema,
+                    rows_inserted=rows_inserted,
+                    rows_deleted=0,
+                    object_index=object_index,
+                )
+                engine.commit()
+                # The object has been committed, but the main transaction can still fail
+                # before it's registered: make sure it gets deleted in that case.
+                self.object_engine.add_uncommitted_objects([object_id])
+                return object_meta
+            except Exception:
+                engine.rollback()
+                raise
+
+        log_func("Storing and indexing the table using %d workers", max_workers)
+        objects: List[Object] = []
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as tpe:
+                pbar = tqdm(
+                    tpe.map(_store_chunk, chunk_quals),
+                    unit="objs",
+                    total=len(chunk_quals),
+                    ascii=SG_CMD_ASCII,
+                    disable=not log_progress,
+                )
+                for object_meta in pbar:
+                    objects.append(object_meta)
+        finally:
+            self.object_engine.close_others()
+
+        for object_meta in objects:
+            with self.metadata_engine.savepoint("object_register"):
+                try:
+                    self.register_objects([object_meta])
+                except UniqueViolation:
+                    # Someone registered this object (perhaps a concurrent pull) already.
+                    logging.info(
+                        "Object %s for table %s/%s already exists, continuing...",
+                        object_meta.object_id,
+                        source_schema,
+                        source_table,
+                    )
+        return [o.object_id for o in objects]
+
+    def get_fragment_index(
+        self, object_ids: List[str], column_types: Dict[str, str]
+    ) -> FragmentIndex:
+        """
+        Get an in-memory index that can be used to filter a table's fragments. Indexes
+        are cached in the process and rebuilt when cached object metadata is invalidated.
+
+        :param object_ids: Object IDs the table consists of
+        :param column_types: Dictionary of column name -> PG type
+        :return: FragmentIndex
+        """
+        key = (self._engine_key, tuple(object_ids), tuple(sorted(column_types.items())))
+        generation = self.object_meta_cache.generation
+        with self._fragment_index_lock:
+            cached = self._fragment_index_cache.get(key)
+            if cached and cached[0] == generation:
+                self._fragment_index_cache.move_to_end(key)
+                return cached[1]
+
+        fragment_index = FragmentIndex(object_ids, self.get_object_meta(object_ids), column_types)
+        if self.object_meta_cache.capacity > 0:
+            with self._fragment_index_lock:
+                self._fragment_index_cache[key] = (generation, fragment_index)
+                self._fragment_index_cache.move_to_end(key)
+                while len(self._fragment_index_cache) > self._fragment_index_cache_size:
+                    self._fragment_index_cache.popitem(last=False)
+        return fragment_index
+
     def filter_fragments(self, object_ids: List[str], table: "Table", quals: Any) -> List[str]:
         """
         Performs fuzzy filtering on the given object IDs using the index and a set of qualifiers, discarding
@@ -999,11 +1493,14 @@ class FragmentManager(MetadataManager):
             return object_ids
 
         column_types = {c[1]: c[2] for c in table.table_schema}
+        fragment_index = self.get_fragment_index(object_ids, column_types)
 
-        # Run the range filter
-        range_filter_result = filter_range_index(
-            self.metadata_engine, object_ids, quals, column_types
-        )
+        # Run the range filter in Python if we can, otherwise push it down to the engine.
+        range_filter_result = fragment_index.filter_range(quals)
+        if range_filter_result is None:
+            range_filter_result = filter_range_index(
+                self.metadata_engine, object_ids, quals, column_types
+            )
         if len(range_filter_result) < len(object_ids):
             logging.info(
                 "Range filter discarded %d/%d fragment(s)",
@@ -1013,7 +1510,7 @@ class FragmentManager(MetadataManager):
 
         # Run other filters: currently we can attempt to run the bloom filter
         # if the fragment metadata has bloom fingerprints.
-        bloom_filter_result = filter_bloom_index(self.metadata_engine, range_filter_result, quals)
+        bloom_filter_result = fragment_index.filter_bloom(range_filter_result, quals)
         if len(bloom_filter_result) < len(range_filter_result):
             logging.info(
                 "Bloom filter discarded %d/%d fragment(s)",
@@ -1024,11 +1521,14 @@ class FragmentManager(MetadataManager):
         # Preserve original object order.
         return [r for r in object_ids if r in bloom_filter_result]
 
-    def delete_objects(self, objects: Union[Set[str], List[str]]) -> None:
+    def delete_objects(self, objects: Union[Set[str], List[str]], discard: bool = False) -> None:
         """
         Deletes objects from the Splitgraph cache
 
         :param objects: A sequence of objects to be deleted
+        :param discard: If True, only discard objects' files (they have to be deleted with
+            `object_engine.purge_discarded_objects`) and don't commit, so that this can be done
+            as a part of a bigger transaction.
         """
         objects = list(objects)
         for i in range(0, len(objects), 100):
@@ -1059,9 +1559,64 @@ class FragmentManager(MetadataManager):
                     )
                 )
             if foreign_tables:
-                self.object_engine.delete_objects(foreign_tables)
+                if discard:
+                    self.object_engine.discard_objects(foreign_tables)
+                else:
+                    self.object_engine.delete_objects(foreign_tables)
+
+            if not discard:
+                self.object_engine.commit()
+
+
+class DeferredFragmentManager(FragmentManager):
+    """
+    Fragment manager that stores new objects but doesn't register them or link tables
+    to them. Instead, it records the metadata so that the caller can register it later
+    in its own transaction. It also leaves pending changes in the audit log for the
+    caller to discard.
 
-            self.object_engine.commit()
+    This is used to store tables in parallel, each on its own connection and in its own
+    transaction, whilst keeping the metadata changes atomic.
+    """
+
+    def __init__(
+        self, object_engine: "PostgresEngine", metadata_engine: Optional["PostgresEngine"] = None
+    ) -> None:
+        super().__init__(object_engine, metadata_engine)
+        self.deferred_objects: List[Tuple[List[Object], Optional[str]]] = []
+        self.deferred_tables: List[
+            Tuple["Repository", List[Tuple[str, str, TableSchema, List[str]]]]
+        ] = []
+
+    def register_objects(self, objects: List[Object], namespace: Optional[str] = None) -> None:
+        self.deferred_objects.append((objects, namespace))
+
+    def register_tables(
+        self, repository: "Repository", table_meta: List[Tuple[str, str, TableSchema, List[str]]]
+    ) -> None:
+        self.deferred_tables.append((repository, table_meta))
+
+    def _discard_pending_changes(self, schema: str, table: str) -> None:
+        pass
+
+    def register_deferred(self, fragment_manager: FragmentManager) -> None:
+        """
+        Register the recorded objects and tables using another fragment manager.
+
+        :param fragment_manager: FragmentManager to register the metadata with.
+        """
+        for objects, namespace in self.deferred_objects:
+            with fragment_manager.metadata_engine.savepoint("object_register"):
+                try:
+                    fragment_manager.register_objects(objects, namespace)
+                except UniqueViolation:
+                    # Someone registered this object (perhaps a concurrent pull) already.
+                    logging.info(
+                        "Object(s) %s already exist(s), continuing...",
+                        ", ".join(o.object_id for o in objects),
+                    )
+        for repository, table_meta in self.deferred_tables:
+            fragment_manager.register_tables(repository, table_meta)
 
 
 def _conflate_changes(
@@ -30,8 +30,9 @@ from splitgraph.engine import ResultShape
 from splitgraph.exceptions import SplitGraphError, TableNotFoundError
 from splitgraph.hooks.mount_handlers import init_fdw
 from .common import set_tag, manage_audit, set_head
+from .output import pluralise
 from .sql import select, prepare_splitfile_sql, POSTGRES_MAX_IDENTIFIER
-from .table import Table
+from .table import Table, ParallelMaterializer
 from .types import TableColumn, ProvenanceLine
 
 if TYPE_CHECKING:
@@ -123,7 +124,14 @@ class Image(NamedTuple):
         )
 
     @manage_audit
-    def checkout(self, force: bool = False, layered: bool = False) -> None:
+    def checkout(
+        self,
+        force: bool = False,
+        layered: bool = False,
+        prefetch: int = 0,
+        workers: int = 1,
+        direct: bool = False,
+    ) -> None:
         """
         Checks the image out, changing the current HEAD pointer. Raises an error
         if there are pending changes to its checkout.
@@ -131,6 +139,15 @@ class Image(NamedTuple):
         :param force: Discards all pending changes to the schema.
         :param layered: If True, uses layered querying to check out the image (doesn't materialize tables
             inside of it).
+        :param prefetch: With layered querying, download this many fragments of every table
+            in advance (see `prefetch`).
+        :param workers: Number of connections to use to materialize tables in parallel
+            (see :class:`splitgraph.core.table.ParallelMaterializer`). Note that with more than
+            one worker, tables are committed as soon as they're created.
+        :param direct: With layered querying, set up tables whose fragments don't overlap as
+            views over the fragments instead of foreign tables (see `Table.create_fragment_view`).
+            These views are read-only and aren't tracked for changes: new images committed
+            from the checkout reuse the tables' objects.
         """
         target_schema = self.repository.to_schema()
         if len(target_schema) > POSTGRES_MAX_IDENTIFIER:
@@ -144,6 +161,7 @@ class Image(NamedTuple):
                 POSTGRES_MAX_IDENTIFIER,
             )
 
+        old_head = self.repository.head
         if self.repository.has_pending_changes():
             if not force:
                 raise SplitGraphError(
@@ -153,25 +171,80 @@ class Image(NamedTuple):
                 )
             logging.warning("%s has pending changes, discarding...", target_schema)
             self.object_engine.discard_pending_changes(target_schema)
-
-        # Drop all current tables in staging
+            # The tables in staging don't match HEAD anymore.
+            old_head = None
+
+        # Tables that are in both the current HEAD and the new image can be updated in place
+        # by applying only the fragments that changed (see Table.materialize_from).
+        old_tables: Dict[str, Table] = {}
+        if old_head is not None and not layered:
+            old_tables = {
+                t: old_head.get_table(t)
+                for t in set(old_head.get_tables()) & set(self.get_tables())
+            }
+
+        # Drop all other current tables in staging. Views over fragments hold on to them,
+        # so they have to be released first.
         self.object_engine.create_schema(target_schema)
+        self.repository.objects.release_fragment_views(target_schema)
         for table in self.object_engine.get_all_tables(target_schema):
-            self.object_engine.delete_table(target_schema, table)
+            if table not in old_tables:
+                self.object_engine.delete_table(target_schema, table)
 
         if layered:
-            self._lq_checkout()
+            self._lq_checkout(direct=direct)
+            if prefetch > 0:
+                self.prefetch(fragments_per_table=prefetch)
         else:
-            for table in self.get_tables():
-                self.get_table(table).materialize(table)
+            to_materialize: List[Tuple[Table, str]] = []
+            for table_name in self.get_tables():
+                table = self.get_table(table_name)
+                if table_name in old_tables and table.materialize_from(
+                    old_tables[table_name], table_name
+                ):
+                    continue
+                if workers > 1:
+                    to_materialize.append((table, table_name))
+                else:
+                    table.materialize(table_name)
+            if to_materialize:
+                ParallelMaterializer(self.repository, workers).materialize(to_materialize)
         set_head(self.repository, self.image_hash)
 
+    def prefetch(self, fragments_per_table: Optional[int] = None) -> None:
+        """
+        Download the fragments of this image's tables that layered queries read first (in
+        the order they read them in) into the object cache, so that the first queries to the
+        tables don't have to wait for them to be downloaded.
+
+        :param fragments_per_table: Number of fragments of every table to download.
+            By default, downloads all fragments.
+        """
+        object_manager = self.repository.objects
+        for table_name in self.get_tables():
+            table = self.get_table(table_name)
+            plan = table.get_query_plan(None, [c.name for c in table.table_schema])
+            objects = plan.singletons + plan.non_singletons
+            if fragments_per_table is not None:
+                objects = objects[:fragments_per_table]
+            if not objects:
+                continue
+            logging.info("Prefetching %s of %s", pluralise("fragment", len(objects)), table_name)
+            with object_manager.ensure_objects(table, objects=objects):
+                pass
+
     def _lq_checkout(
-        self, target_schema: Optional[str] = None, wrapper: Optional[str] = FDW_CLASS
+        self,
+        target_schema: Optional[str] = None,
+        wrapper: Optional[str] = FDW_CLASS,
+        direct: bool = False,
     ) -> None:
         """
         Intended to be run on the sgr side. Initializes the FDW for all tables in a given image,
         allowing to query them directly without materializing the tables.
+
+        If `direct` is True, tables whose fragments don't overlap are set up as views
+        over the fragments instead.
         """
         # assumes that we got to the point in the normal checkout where we're about to materialize the tables
         # (e.g. the schemata are cleared)
@@ -204,7 +277,10 @@ class Image(NamedTuple):
                 table_name,
                 target_schema,
             )
-            self.get_table(table_name).materialize(table_name, target_schema, lq_server=server_id)
+            table = self.get_table(table_name)
+            if direct and table.create_fragment_view(table_name, target_schema):
+                continue
+            table.materialize(table_name, target_schema, lq_server=server_id)
 
     @contextmanager
     def query_schema(self, wrapper: Optional[str] = FDW_CLASS) -> Iterator[str]:
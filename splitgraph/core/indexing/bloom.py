@@ -7,7 +7,7 @@ from hashlib import sha256
 from math import ceil, log, exp
 from typing import Any, Dict, List, Optional, Tuple, Union, cast, TYPE_CHECKING
 
-from psycopg2.sql import SQL, Identifier
+from psycopg2.sql import SQL, Composable, Identifier
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.output import pretty_size
@@ -72,18 +72,45 @@ def generate_bloom_index(
     # it will only mean chunks with NULLs will be fetched for a query with "NULL"
     # and vice versa, which doesn't break anything (this is just a preflight optimisation).
 
-    digest_query = SQL(
-        "SELECT digest(coalesce({0}::text, 'NULL'), 'sha256'), "
-        "digest(coalesce({0}::text, 'NULL') || 'salt', 'sha256') "
-        "FROM {1}.{2} o WHERE o.{3} = true"
-    ).format(
-        Identifier(column),
-        Identifier(SPLITGRAPH_META_SCHEMA),
-        Identifier(object_id),
-        Identifier(SG_UD_FLAG),
+    digest_query = (
+        SQL("SELECT ")
+        + SQL(",").join(get_bloom_digests(column))
+        + SQL(" FROM {}.{} o WHERE o.{} = true").format(
+            Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id), Identifier(SG_UD_FLAG),
+        )
     )
 
     digests = engine.run_sql(digest_query)
+    return build_bloom_index(digests, changeset, column, probability, size)
+
+
+def get_bloom_digests(column: str) -> Tuple[Composable, Composable]:
+    """
+    Get expressions for the two SHA256 digests of a column value that are used
+    to build the bloom filter (see `generate_bloom_index`).
+    """
+    return (
+        SQL("digest(coalesce({}::text, 'NULL'), 'sha256')").format(Identifier(column)),
+        SQL("digest(coalesce({}::text, 'NULL') || 'salt', 'sha256')").format(Identifier(column)),
+    )
+
+
+def build_bloom_index(
+    digests: List[Tuple[bytes, bytes]],
+    changeset: Optional[Changeset],
+    column: str,
+    probability: Optional[float] = None,
+    size: Optional[int] = None,
+) -> Tuple[int, str]:
+    """
+    Builds the bloom filter signature from pairs of digests of column values.
+    See `generate_bloom_index` for the description of parameters.
+
+    :param digests: List of pairs of digests of every value in the column (can contain duplicates).
+    :return: Dictionary to be inserted into the index.
+    """
+    if not (probability is None) ^ (size is None):
+        raise ValueError("One of probability or size must be specified, but not both!")
 
     # Add digests of the old values in the changeset for this column.
     if changeset:
@@ -267,13 +294,26 @@ def filter_bloom_index(engine: "PsycopgEngine", object_ids: List[str], quals: An
         object_ids,
     )
 
-    bloom_index = {
-        o: {col: (i[0], base64.b64decode(i[1])) for col, i in index.items()}
-        for o, index in bloom_index
-        if index
-    }
+    bloom_index = {o: decode_bloom_index(index) for o, index in bloom_index if index}
+    return _filter_bloom_quals(object_ids, quals, bloom_index)
+
+
+def decode_bloom_index(index: Dict[str, Tuple[int, str]]) -> Dict[str, Tuple[int, bytes]]:
+    """
+    Decode the bloom index of an object.
+
+    :param index: Dictionary of column -> (k, base64-encoded filter), as stored in the object's index
+    :return: Dictionary of column -> (k, filter bytes)
+    """
+    return {col: (i[0], base64.b64decode(i[1])) for col, i in index.items()}
+
 
-    dropped = []
+def _filter_bloom_quals(
+    object_ids: List[str],
+    quals: List[List[Tuple[str, int, int]]],
+    bloom_index: Dict[str, Dict[str, Tuple[int, bytes]]],
+) -> List[str]:
+    dropped = set()
 
     for object_id in object_ids:
         if object_id not in bloom_index:
@@ -292,6 +332,6 @@ def filter_bloom_index(engine: "PsycopgEngine", object_ids: List[str], quals: An
                 break
 
         if not and_result:
-            dropped.append(object_id)
+            dropped.add(object_id)
 
     return [o for o in object_ids if o not in dropped]
@@ -0,0 +1,295 @@
+"""
+In-memory index of a table's fragments that can evaluate qualifiers without
+a roundtrip to the engine.
+"""
+import math
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
+
+from splitgraph.core.indexing.bloom import (
+    _filter_bloom_quals,
+    _prepare_bloom_quals,
+    decode_bloom_index,
+)
+from splitgraph.core.indexing.range import _strip_type_mod
+from splitgraph.core.output import parse_date, parse_dt
+
+if TYPE_CHECKING:
+    from splitgraph.core.types import Quals
+    from splitgraph.core.metadata_manager import Object
+
+
+class _Unsupported(Exception):
+    """Raised when a value can't be compared in Python the same way the engine would."""
+
+
+def _to_int(value: Any) -> Any:
+    if isinstance(value, bool):
+        raise _Unsupported
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise _Unsupported
+        # Python compares ints and floats exactly, same as Postgres comparing
+        # integers with numeric literals.
+        return value
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            raise _Unsupported
+        return value
+    if isinstance(value, str):
+        return int(value)
+    raise _Unsupported
+
+
+def _to_decimal(value: Any) -> Decimal:
+    if isinstance(value, bool):
+        raise _Unsupported
+    if isinstance(value, float):
+        # psycopg2 passes floats to the engine as their repr
+        value = repr(value)
+    if isinstance(value, (int, str, Decimal)):
+        result = Decimal(value)
+        if not result.is_finite():
+            raise _Unsupported
+        return result
+    raise _Unsupported
+
+
+def _to_float(value: Any) -> float:
+    if isinstance(value, bool):
+        raise _Unsupported
+    if isinstance(value, (int, float, Decimal, str)):
+        result = float(value)
+        if math.isnan(result):
+            raise _Unsupported
+        return result
+    raise _Unsupported
+
+
+def _to_str(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    raise _Unsupported
+
+
+def _to_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            raise _Unsupported
+        return value
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    if isinstance(value, str):
+        return parse_dt(value)
+    raise _Unsupported
+
+
+def _to_date(value: Any) -> date:
+    if isinstance(value, datetime):
+        raise _Unsupported
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        return parse_date(value)
+    raise _Unsupported
+
+
+# Types that we can compare in Python with the same results as the engine, mapped to
+# functions that coerce both index values and qual values to comparable Python objects.
+# Text types are compared by code point, which is what COLLATE "C" in the SQL-side
+# filter does. Other types (e.g. real, for which the engine casts values to double
+# precision before comparing them) fall back to the SQL filter.
+_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    k: v
+    for ks, v in [
+        (["integer", "bigint", "smallint"], _to_int),
+        (["numeric", "decimal"], _to_decimal),
+        (["double precision"], _to_float),
+        (["text", "varchar", "character varying"], _to_str),
+        (["timestamp", "timestamp without time zone"], _to_timestamp),
+        (["date"], _to_date),
+    ]
+    for k in ks
+}
+
+
+class _ColumnRanges:
+    """Object positions sorted by the minimum and the maximum value of a column."""
+
+    def __init__(
+        self,
+        converter: Callable[[Any], Any],
+        missing: int,
+        bounds: List[Tuple[int, Any, Any]],
+    ) -> None:
+        self.converter = converter
+        # Bitmask of objects that don't have index information for this column
+        # and so might match any qual on it.
+        self.missing = missing
+
+        mins = sorted((b[1], b[0]) for b in bounds if b[1] is not None)
+        maxs = sorted((b[2], b[0]) for b in bounds if b[2] is not None)
+        self.min_values = [m[0] for m in mins]
+        self.min_positions = [m[1] for m in mins]
+        self.max_values = [m[0] for m in maxs]
+        self.max_positions = [m[1] for m in maxs]
+
+    def match(self, qual_op: str, value: Any) -> int:
+        """Return a bitmask of objects that might match a qual on this column."""
+        if value is None:
+            # Comparisons with NULL are never true.
+            return self.missing
+
+        if qual_op in (">", ">="):
+            bisect = bisect_right if qual_op == ">" else bisect_left
+            positions = self.max_positions[bisect(self.max_values, value) :]
+        elif qual_op in ("<", "<="):
+            bisect = bisect_left if qual_op == "<" else bisect_right
+            positions = self.min_positions[: bisect(self.min_values, value)]
+        else:
+            # Equality: value has to be between the minimum and the maximum.
+            below = _to_mask(self.min_positions[: bisect_right(self.min_values, value)])
+            above = _to_mask(self.max_positions[bisect_left(self.max_values, value) :])
+            return self.missing | (below & above)
+        return self.missing | _to_mask(positions)
+
+
+def _to_mask(positions: Sequence[int]) -> int:
+    result = 0
+    for position in positions:
+        result |= 1 << position
+    return result
+
+
+class FragmentIndex:
+    """
+    Index of a table's fragments that evaluates qualifiers in Python instead of
+    pushing them down to the metadata engine. It mirrors the semantics of
+    :func:`splitgraph.core.indexing.range.filter_range_index` and
+    :func:`splitgraph.core.indexing.bloom.filter_bloom_index`.
+
+    For every column, object positions are kept in arrays sorted by the minimum and the
+    maximum value of the column in each object, so a range qual becomes a binary search.
+    Results of quals are combined as bitmasks over object positions. Column arrays and
+    bloom filters are decoded lazily, the first time a qual uses them.
+    """
+
+    def __init__(
+        self,
+        object_ids: Sequence[str],
+        object_meta: Dict[str, "Object"],
+        column_types: Dict[str, str],
+    ) -> None:
+        """
+        :param object_ids: Object IDs, in the order they're in in the table
+        :param object_meta: Dictionary of object ID -> Object (metadata)
+        :param column_types: Dictionary of column name -> PG type
+        """
+        self.object_ids = list(object_ids)
+        self.column_types = column_types
+        self._indexes = [
+            object_meta[o].object_index if o in object_meta else None for o in self.object_ids
+        ]
+        self._columns: Dict[str, Optional[_ColumnRanges]] = {}
+        self._bloom_index: Optional[Dict[str, Dict[str, Tuple[int, bytes]]]] = None
+
+        # Objects that we don't have metadata for are never returned by the range filter.
+        self._present = _to_mask([i for i, o in enumerate(self.object_ids) if o in object_meta])
+
+    def _get_column(self, column_name: str) -> Optional[_ColumnRanges]:
+        if column_name in self._columns:
+            return self._columns[column_name]
+
+        result: Optional[_ColumnRanges] = None
+        converter = _CONVERTERS.get(_strip_type_mod(self.column_types[column_name]))
+        if converter:
+            missing = 0
+            bounds = []
+            try:
+                for position, index in enumerate(self._indexes):
+                    if not index or index.get("range") is None:
+                        continue
+                    if column_name not in index["range"]:
+                        missing |= 1 << position
+                        continue
+                    col_range = index["range"][column_name] or (None, None)
+                    bounds.append(
+                        (
+                            position,
+                            None if col_range[0] is None else converter(col_range[0]),
+                            None if col_range[1] is None else converter(col_range[1]),
+                        )
+                    )
+                result = _ColumnRanges(converter, missing, bounds)
+            except (_Unsupported, ValueError, ArithmeticError, TypeError):
+                result = None
+
+        self._columns[column_name] = result
+        return result
+
+    def _match_qual(self, qual: Tuple[str, str, Any]) -> int:
+        column_name, qual_op, value = qual
+        if qual_op not in (">", ">=", "<", "<=", "="):
+            # Same as the SQL filter: we don't know if any objects definitely don't match
+            # other operators, so we assume they all do.
+            return self._present
+
+        if column_name not in self.column_types:
+            raise _Unsupported
+        column = self._get_column(column_name)
+        if not column:
+            raise _Unsupported
+        if value is not None:
+            value = column.converter(value)
+        return column.match(qual_op, value)
+
+    def filter_range(self, quals: "Quals") -> Optional[List[str]]:
+        """
+        Run the range filter on the objects in the index.
+
+        :param quals: List of qualifiers in conjunctive normal form
+            (see :meth:`splitgraph.core.fragment_manager.FragmentManager.filter_fragments`)
+        :return: List of object IDs that might match the qualifiers or None if the
+            qualifiers can't be evaluated in Python (e.g. because of the column types),
+            in which case the caller has to run the SQL filter instead.
+        """
+        result = self._present
+        try:
+            for or_quals in quals:
+                or_result = 0
+                for qual in or_quals:
+                    or_result |= self._match_qual(qual)
+                result &= or_result
+                if not result:
+                    break
+        except (_Unsupported, ValueError, ArithmeticError, TypeError):
+            return None
+        return [o for i, o in enumerate(self.object_ids) if result >> i & 1]
+
+    def filter_bloom(self, object_ids: List[str], quals: "Quals") -> List[str]:
+        """
+        Run the bloom filter on a subset of objects in the index.
+
+        :param object_ids: Object IDs to filter
+        :param quals: List of qualifiers in conjunctive normal form
+        :return: List of object IDs that might match the qualifiers (including
+            IDs that don't have a bloom index).
+        """
+        if not object_ids:
+            return object_ids
+
+        bloom_quals = _prepare_bloom_quals(quals)
+        if not bloom_quals:
+            return object_ids
+
+        if self._bloom_index is None:
+            self._bloom_index = {
+                o: decode_bloom_index(index["bloom"])
+                for o, index in zip(self.object_ids, self._indexes)
+                if index and index.get("bloom")
+            }
+        return _filter_bloom_quals(object_ids, bloom_quals, self._bloom_index)
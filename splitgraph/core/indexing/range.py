@@ -1,5 +1,16 @@
 import logging
-from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, cast, TYPE_CHECKING
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    cast,
+    TYPE_CHECKING,
+)
 
 from psycopg2.sql import Composed, SQL, Composable
 from psycopg2.sql import Identifier
@@ -171,51 +182,68 @@ def extract_min_max_pks(
     # it fits both the first and the second chunk. This essentially means that chunks now overlap,
     # so we'll be fetching/scanning through them when it might not be necessary.
 
-    min_max = []
+    return [
+        get_min_max_pk(
+            engine,
+            SQL("{}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(fragment)),
+            table_pks,
+            table_pk_types,
+        )
+        for fragment in fragments
+    ]
+
+
+def get_min_max_pk(
+    engine: "PsycopgEngine",
+    relation: Composable,
+    table_pks: List[str],
+    table_pk_types: List[str],
+    quals: Optional[Composable] = None,
+    qual_args: Optional[Sequence[Any]] = None,
+) -> Tuple[Tuple, Tuple]:
+    """
+    Get the minimum/maximum primary key of rows in a relation (see `extract_min_max_pks`).
+
+    :param engine: Engine the relation lives on
+    :param relation: Composable with the relation (e.g. a schema-qualified table) to query
+    :param table_pks: List of columns forming the table primary key
+    :param table_pk_types: List of types for table PK columns
+    :param quals: Optional condition the rows have to satisfy
+    :param qual_args: Arguments for `quals`
+    :return: Tuple of (minimum PK, maximum PK)
+    """
     pk_sql = SQL(",").join(
         Identifier(p) + SQL(_inject_collation("", t)) for p, t in zip(table_pks, table_pk_types)
     )
-    for fragment in fragments:
-        query = (
-            SQL("SELECT ")
-            + pk_sql
-            + SQL(" FROM {}.{} ORDER BY ").format(
-                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(fragment)
-            )
-        )
-        frag_min = engine.run_sql(
-            query + pk_sql + SQL(" LIMIT 1"), return_shape=ResultShape.ONE_MANY
-        )
-        frag_max = engine.run_sql(
-            query
-            + SQL(",").join(
-                Identifier(p) + SQL(_inject_collation("", t) + " DESC")
-                for p, t in zip(table_pks, table_pk_types)
-            )
-            + SQL(" LIMIT 1"),
-            return_shape=ResultShape.ONE_MANY,
+    query = SQL("SELECT ") + pk_sql + SQL(" FROM ") + relation
+    if quals:
+        query += SQL(" WHERE ") + quals
+    query += SQL(" ORDER BY ")
+    frag_min = engine.run_sql(
+        query + pk_sql + SQL(" LIMIT 1"), qual_args, return_shape=ResultShape.ONE_MANY
+    )
+    frag_max = engine.run_sql(
+        query
+        + SQL(",").join(
+            Identifier(p) + SQL(_inject_collation("", t) + " DESC")
+            for p, t in zip(table_pks, table_pk_types)
         )
-
-        min_max.append((frag_min, frag_max))
-    return min_max
+        + SQL(" LIMIT 1"),
+        qual_args,
+        return_shape=ResultShape.ONE_MANY,
+    )
+    return frag_min, frag_max
 
 
-def generate_range_index(
-    object_engine: "PsycopgEngine",
-    object_id: str,
-    table_schema: "TableSchema",
-    changeset: Optional[Changeset],
-    columns: Optional[List[str]] = None,
-) -> Dict[str, Tuple[T, T]]:
+def get_range_index_columns(
+    table_schema: "TableSchema", columns: Optional[List[str]] = None
+) -> Tuple[List[str], List[str], Dict[str, str]]:
     """
-    Calculate the minimum/maximum values of every column in the object (including deleted values).
+    Get the columns that the range index will be calculated on.
 
-    :param object_engine: Engine the object is located on
-    :param object_id: ID of the object.
     :param table_schema: Schema of the table
-    :param changeset: Changeset (old values will be included in the index)
     :param columns: Columns to run the index on (default all)
-    :return: Dictionary of {column: [min, max]}
+    :return: Tuple of (columns to index, columns forming the object PK, {column: type})
     """
     columns = columns or [c.name for c in table_schema]
 
@@ -228,9 +256,14 @@ def generate_range_index(
         for c in table_schema
         if _strip_type_mod(c.pg_type) in PG_INDEXABLE_TYPES and (c.is_pk or c.name in columns)
     ]
+    return columns_to_index, object_pk, column_types
 
-    logging.debug("Running range index on columns %s", columns_to_index)
-    query = SQL("SELECT ") + SQL(",").join(
+
+def get_range_aggregates(columns_to_index: List[str], column_types: Dict[str, str]) -> Composable:
+    """
+    Get a list of MIN/MAX aggregates (two for every column) that computes the range index.
+    """
+    return SQL(",").join(
         SQL(
             _inject_collation("MIN({0}", column_types[c])
             + "), "
@@ -239,19 +272,24 @@ def generate_range_index(
         ).format(Identifier(c))
         for c in columns_to_index
     )
-    query += SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
-    result = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
-    index = {
-        col: (cmin, cmax) for col, cmin, cmax in zip(columns_to_index, result[0::2], result[1::2])
-    }
-    # Also explicitly store the ranges of composite PKs (since they won't be included
-    # in the columns list) to be used for faster chunking/querying.
-    if len(object_pk) > 1:
-        # Add the PK to the same index dict but prefix it with a dollar sign so that
-        # it explicitly doesn't clash with any other columns.
-        index["$pk"] = extract_min_max_pks(
-            object_engine, [object_id], object_pk, [column_types[c] for c in object_pk]
-        )[0]
+
+
+def finalize_range_index(
+    index: Dict[str, Tuple[Any, Any]],
+    changeset: Optional[Changeset],
+    columns_to_index: List[str],
+    column_types: Dict[str, str],
+) -> Dict[str, Tuple[T, T]]:
+    """
+    Expand the ranges to include old values in the changeset and turn the
+    range index into a JSON-serializable dictionary.
+
+    :param index: Dictionary of {column: (min, max)}
+    :param changeset: Changeset (old values will be included in the index)
+    :param columns_to_index: Columns that the index is calculated on
+    :param column_types: Dictionary of {column: type}
+    :return: Dictionary of {column: [min, max]}
+    """
     if changeset:
         # Expand the index ranges to include the old row values in this chunk.
         # Why is this necessary? Say we have a table of (key (PK), value) and a
@@ -290,6 +328,43 @@ def generate_range_index(
     return range_index
 
 
+def generate_range_index(
+    object_engine: "PsycopgEngine",
+    object_id: str,
+    table_schema: "TableSchema",
+    changeset: Optional[Changeset],
+    columns: Optional[List[str]] = None,
+) -> Dict[str, Tuple[T, T]]:
+    """
+    Calculate the minimum/maximum values of every column in the object (including deleted values).
+
+    :param object_engine: Engine the object is located on
+    :param object_id: ID of the object.
+    :param table_schema: Schema of the table
+    :param changeset: Changeset (old values will be included in the index)
+    :param columns: Columns to run the index on (default all)
+    :return: Dictionary of {column: [min, max]}
+    """
+    columns_to_index, object_pk, column_types = get_range_index_columns(table_schema, columns)
+
+    logging.debug("Running range index on columns %s", columns_to_index)
+    query = SQL("SELECT ") + get_range_aggregates(columns_to_index, column_types)
+    query += SQL(" FROM {}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
+    result = object_engine.run_sql(query, return_shape=ResultShape.ONE_MANY)
+    index = {
+        col: (cmin, cmax) for col, cmin, cmax in zip(columns_to_index, result[0::2], result[1::2])
+    }
+    # Also explicitly store the ranges of composite PKs (since they won't be included
+    # in the columns list) to be used for faster chunking/querying.
+    if len(object_pk) > 1:
+        # Add the PK to the same index dict but prefix it with a dollar sign so that
+        # it explicitly doesn't clash with any other columns.
+        index["$pk"] = extract_min_max_pks(
+            object_engine, [object_id], object_pk, [column_types[c] for c in object_pk]
+        )[0]
+    return finalize_range_index(index, changeset, columns_to_index, column_types)
+
+
 def filter_range_index(
     metadata_engine: "PsycopgEngine",
     object_ids: List[str],
@@ -2,13 +2,31 @@
 Classes related to managing table/image/object metadata tables.
 """
 import itertools
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING, NamedTuple, cast, Sequence
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TYPE_CHECKING,
+    NamedTuple,
+    cast,
+    Sequence,
+    Iterable,
+)
 
 from psycopg2.extras import Json
 from psycopg2.sql import SQL, Identifier
 
-from splitgraph.config import SPLITGRAPH_API_SCHEMA, SPLITGRAPH_META_SCHEMA
+from splitgraph.config import (
+    CONFIG,
+    SPLITGRAPH_API_SCHEMA,
+    SPLITGRAPH_META_SCHEMA,
+    get_singleton,
+)
 from splitgraph.core.types import TableSchema
 from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import API_MAX_VARIADIC_ARGS, chunk
@@ -31,6 +49,26 @@ OBJECT_COLS = [
     "rows_deleted",
 ]
 
+# PG types of object metadata columns (same order as OBJECT_COLS)
+_OBJECT_COL_TYPES = [
+    "varchar",
+    "varchar",
+    "varchar",
+    "bigint",
+    "timestamp",
+    "varchar",
+    "varchar",
+    "jsonb",
+    "integer",
+    "integer",
+]
+
+# Batches with at least this many rows are registered on non-registry engines by loading
+# them into a temporary table with COPY and merging them with one set-based statement
+# (see MetadataManager._copy_and_merge). Smaller batches go through the per-row API calls,
+# since the COPY path has a few more roundtrips.
+COPY_MIN_ROWS = 100
+
 
 class Object(NamedTuple):
     """Represents a Splitgraph object that tables are composed of."""
@@ -47,15 +85,113 @@ class Object(NamedTuple):
     rows_deleted: int
 
 
+class ObjectMetaCache:
+    """
+    Size-bounded LRU cache of object metadata, keyed by the engine and the object ID.
+
+    Objects are content-addressed and immutable, so their metadata can be cached until
+    it's deleted or overwritten. The cache is thread-safe and is shared by all metadata
+    managers in the process.
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        # Bumped every time cached metadata is dropped so that structures derived
+        # from it (like compiled fragment indexes) can tell if they're stale.
+        self.generation = 0
+        self._cache: "OrderedDict[Tuple[str, str], Object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, engine_key: str, object_ids: Sequence[str]) -> Dict[str, Object]:
+        """
+        Get cached metadata for multiple objects.
+
+        :param engine_key: Key of the engine the metadata was loaded from
+        :param object_ids: Object IDs
+        :return: Dictionary of object_id -> Object for objects that are in the cache.
+        """
+        result = {}
+        with self._lock:
+            for object_id in object_ids:
+                key = (engine_key, object_id)
+                try:
+                    result[object_id] = self._cache[key]
+                    self._cache.move_to_end(key)
+                    self.hits += 1
+                except KeyError:
+                    self.misses += 1
+        return result
+
+    def put_many(self, engine_key: str, objects: Sequence[Object]) -> None:
+        """Add object metadata to the cache, evicting least recently used entries if it's full."""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            for obj in objects:
+                key = (engine_key, obj.object_id)
+                self._cache[key] = obj
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, engine_key: str, object_ids: Sequence[str]) -> None:
+        """Drop cached metadata for given objects."""
+        with self._lock:
+            self.generation += 1
+            for object_id in object_ids:
+                self._cache.pop((engine_key, object_id), None)
+
+    def clear(self) -> None:
+        """Drop all cached metadata and reset the counters."""
+        with self._lock:
+            self.generation += 1
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: Dictionary with the number of cache hits, misses, the number of
+            cached objects and the cache capacity.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "capacity": self.capacity,
+            }
+
+
 class MetadataManager:
     """
     A data access layer for the metadata tables in the splitgraph_meta schema that concerns itself
     with image, table and object information.
     """
 
+    # Process-wide cache of object metadata (see ObjectMetaCache)
+    object_meta_cache = ObjectMetaCache(int(get_singleton(CONFIG, "SG_METADATA_CACHE_SIZE")))
+
     def __init__(self, metadata_engine: "PsycopgEngine") -> None:
         self.metadata_engine = metadata_engine
 
+    @property
+    def _engine_key(self) -> str:
+        # Engines pointing to the same database have the same representation (including
+        # engines cloned from one another) and share cached metadata.
+        return repr(self.metadata_engine)
+
+    def _invalidate_object_meta(self, object_ids: Sequence[str]) -> None:
+        # Drop the cached metadata now and again when the transaction ends. If it's rolled
+        # back, metadata that we cached from inside of it is wrong. If it's committed, other
+        # connections could have cached the old metadata whilst it was running.
+        cache = self.object_meta_cache
+        engine_key = self._engine_key
+        cache.invalidate(engine_key, object_ids)
+        self.metadata_engine.on_transaction_end(lambda: cache.invalidate(engine_key, object_ids))
+
     def register_objects(self, objects: List[Object], namespace: Optional[str] = None) -> None:
         """
         Registers multiple Splitgraph objects in the tree.
@@ -64,6 +200,8 @@ class MetadataManager:
         :param namespace: If specified, overrides the original object namespace, required
             in the case where the remote repository has a different namespace than the local one.
         """
+        # Objects that already exist get overwritten, so drop their cached metadata.
+        self._invalidate_object_meta([o.object_id for o in objects])
         object_meta = [
             tuple(
                 namespace
@@ -74,6 +212,17 @@ class MetadataManager:
             for o in objects
         ]
 
+        if self._use_copy(object_meta):
+            # Later objects overwrite earlier ones, same as with add_object.
+            deduped = {o[0]: o for o in object_meta}
+            self._copy_and_merge(
+                "sg_tmp_objects",
+                list(zip(OBJECT_COLS, _OBJECT_COL_TYPES)),
+                deduped.values(),
+                "bulk_add_objects",
+            )
+            return
+
         self.metadata_engine.run_sql_batch(
             SQL(
                 "SELECT {}.add_object(" + ",".join(itertools.repeat("%s", len(OBJECT_COLS))) + ")"
@@ -91,6 +240,33 @@ class MetadataManager:
         :param repository: Repository that the tables belong to.
         :param table_meta: A list of (image_hash, table_name, table_schema, object_ids).
         """
+        if self._use_copy(table_meta):
+            # add_table appends objects to the table if it already exists, so do
+            # the same with duplicate tables in the batch.
+            merged: Dict[Tuple[str, str], Tuple[TableSchema, List[str]]] = {}
+            for image_hash, table_name, table_schema, object_ids in table_meta:
+                existing = merged.get((image_hash, table_name))
+                if existing:
+                    object_ids = existing[1] + list(object_ids)
+                merged[(image_hash, table_name)] = (table_schema, list(object_ids))
+            self._copy_and_merge(
+                "sg_tmp_tables",
+                [
+                    ("namespace", "varchar"),
+                    ("repository", "varchar"),
+                    ("image_hash", "varchar"),
+                    ("table_name", "varchar"),
+                    ("table_schema", "jsonb"),
+                    ("object_ids", "varchar[]"),
+                ],
+                (
+                    (repository.namespace, repository.repository, image_hash, table_name) + meta
+                    for (image_hash, table_name), meta in merged.items()
+                ),
+                "bulk_add_tables",
+            )
+            return
+
         table_meta = [
             (repository.namespace, repository.repository, o[0], o[1], Json(o[2]), o[3])
             for o in table_meta
@@ -124,6 +300,16 @@ class MetadataManager:
 
         :param object_locations: List of (object_id, location, protocol).
         """
+        if self._use_copy(object_locations):
+            deduped = {o[0]: o for o in object_locations}
+            self._copy_and_merge(
+                "sg_tmp_object_locations",
+                [("object_id", "varchar"), ("location", "varchar"), ("protocol", "varchar")],
+                deduped.values(),
+                "bulk_add_object_locations",
+            )
+            return
+
         self.metadata_engine.run_sql_batch(
             SQL("SELECT {}.add_object_location(%s,%s,%s)").format(
                 Identifier(SPLITGRAPH_API_SCHEMA)
@@ -131,6 +317,36 @@ class MetadataManager:
             object_locations,
         )
 
+    def _use_copy(self, rows: Sequence[Any]) -> bool:
+        # The registry only lets clients call SQL API functions with arguments, so
+        # it can't use the COPY path.
+        return not self.metadata_engine.registry and len(rows) >= COPY_MIN_ROWS
+
+    def _copy_and_merge(
+        self,
+        staging_table: str,
+        columns: List[Tuple[str, str]],
+        rows: Iterable[Sequence[Any]],
+        api_call: str,
+    ) -> None:
+        """
+        Load metadata rows into a temporary staging table with COPY and merge them into
+        splitgraph_meta with a single set-based API call. This is much faster than
+        sending one API call per row for large batches (e.g. when pulling a repository
+        with lots of objects).
+
+        :param staging_table: Name of the temporary table that the API call reads from
+        :param columns: List of (column name, PG type) of the staged rows
+        :param rows: Rows to register
+        :param api_call: Name of the function in splitgraph_api that merges the staging table
+        """
+        engine = self.metadata_engine
+        engine.copy_to_temporary_table(staging_table, columns, rows)
+        engine.run_sql(
+            SQL("SELECT {}.{}()").format(Identifier(SPLITGRAPH_API_SCHEMA), Identifier(api_call))
+        )
+        engine.run_sql(SQL("DROP TABLE pg_temp.{}").format(Identifier(staging_table)))
+
     def get_all_objects(self) -> List[str]:
         """
         Gets all objects currently in the Splitgraph tree.
@@ -184,7 +400,8 @@ class MetadataManager:
 
     def get_object_meta(self, objects: List[str]) -> Dict[str, Object]:
         """
-        Get metadata for multiple Splitgraph objects from the tree
+        Get metadata for multiple Splitgraph objects from the tree. Metadata is cached
+        in the process (see ObjectMetaCache), so returned objects mustn't be modified.
 
         :param objects: List of objects to get metadata for.
         :return: Dictionary of object_id -> Object
@@ -192,18 +409,24 @@ class MetadataManager:
         if not objects:
             return {}
 
-        metadata = self.metadata_engine.run_chunked_sql(
-            select(
-                "get_object_meta",
-                ",".join(OBJECT_COLS),
-                schema=SPLITGRAPH_API_SCHEMA,
-                table_args="(%s)",
-            ),
-            (list(objects),),
-            chunk_position=0,
-        )
-        result = [Object(*m) for m in metadata]
-        return {o.object_id: o for o in result}
+        engine_key = self._engine_key
+        result = self.object_meta_cache.get_many(engine_key, objects)
+        missing = [o for o in objects if o not in result]
+        if missing:
+            metadata = self.metadata_engine.run_chunked_sql(
+                select(
+                    "get_object_meta",
+                    ",".join(OBJECT_COLS),
+                    schema=SPLITGRAPH_API_SCHEMA,
+                    table_args="(%s)",
+                ),
+                (list(set(missing)),),
+                chunk_position=0,
+            )
+            fetched = [Object(*m) for m in metadata]
+            self.object_meta_cache.put_many(engine_key, fetched)
+            result.update({o.object_id: o for o in fetched})
+        return result
 
     def get_objects_for_repository(
         self, repository: "Repository", image_hash: Optional[str] = None
@@ -231,6 +454,7 @@ class MetadataManager:
 
         :param object_ids: Object IDs to delete
         """
+        self._invalidate_object_meta(object_ids)
         for table_name in ["object_locations", "objects"]:
             self.metadata_engine.run_chunked_sql(
                 SQL("DELETE FROM {}.{} WHERE object_id = ANY(%s)").format(
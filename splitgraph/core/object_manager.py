@@ -1,12 +1,15 @@
 """Functions related to creating, deleting and keeping track of physical Splitgraph objects."""
+import inspect
 import itertools
 import logging
-import math
+import warnings
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import datetime as dt
 from typing import (
     Any,
+    Callable,
     Dict,
     Iterator,
     List,
@@ -17,11 +20,19 @@ from typing import (
     cast,
     DefaultDict,
     Sequence,
+    TypeVar,
 )
 
 from psycopg2.sql import SQL, Identifier
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG, get_singleton
+from splitgraph.core.eviction import (
+    CacheEntry,
+    CacheEvictor,
+    TraceEntry,
+    get_eviction_policy,
+    write_trace,
+)
 from splitgraph.core.fragment_manager import FragmentManager
 from splitgraph.core.types import Quals
 from splitgraph.engine import ResultShape, switch_engine
@@ -40,6 +51,11 @@ if TYPE_CHECKING:
     from splitgraph.core.table import Table
     from splitgraph.engine.postgres.engine import PsycopgEngine, PostgresEngine
 
+# Key of the advisory lock that serializes object cache eviction
+_CACHE_LOCK_ID = 0x7367636163686531
+
+T = TypeVar("T")
+
 
 class ObjectManager(FragmentManager):
     """Brings the multiple manager classes together and manages the object cache (downloading and uploading
@@ -75,6 +91,14 @@ class ObjectManager(FragmentManager):
         # of more possible cache misses.
         self.eviction_min_fraction = float(get_singleton(CONFIG, "SG_EVICTION_MIN_FRACTION"))
 
+        # Policy that scores eviction candidates (see splitgraph.core.eviction)
+        self.eviction_policy = get_eviction_policy(
+            decay_constant=self.eviction_decay_constant, floor=self.eviction_floor
+        )
+
+        # File to record object cache accesses to (to replay them with the eviction simulator)
+        self.trace_path = get_singleton(CONFIG, "SG_OBJECT_CACHE_TRACE") or None
+
     def get_downloaded_objects(self, limit_to: Optional[List[str]] = None) -> List[str]:
         """
         Gets a list of objects currently in the Splitgraph cache (i.e. not only existing externally.)
@@ -196,6 +220,8 @@ class ObjectManager(FragmentManager):
 
         self._claim_objects(required_objects)
         tracer.log("claim_objects")
+        if self.trace_path:
+            self._record_accesses(required_objects)
 
         try:
             to_fetch = self._prepare_fetch_list(required_objects)
@@ -327,6 +353,173 @@ class ObjectManager(FragmentManager):
 
         return CallbackList([_f])
 
+    def ensure_objects_ahead(
+        self,
+        table: Optional["Table"],
+        batches: List[List[str]],
+        release_callback: CallbackList,
+        tracer: Optional[Tracer] = None,
+    ) -> Iterator[List[str]]:
+        """
+        Make sure batches of objects are in the local cache, one batch at a time. Unlike
+        `ensure_objects`, this gives every batch back to the caller as soon as it's been
+        downloaded and downloads the next batch in the background whilst the caller is
+        using the current one.
+
+        :param table: Table the objects belong to (used to find the upstream repository
+            to download the objects from)
+        :param batches: Batches of object IDs, in the order the caller needs them in
+        :param release_callback: The caller must call this when it doesn't need the objects
+            anymore. Release callbacks for every batch are added to it as they're claimed,
+            including for the batch that's being downloaded in the background.
+        :param tracer: Tracer
+        :return: Generator of batches of object IDs that are in the cache.
+        """
+        if not batches:
+            return
+
+        background = self._make_background_manager() if len(batches) > 1 else None
+        executor = ThreadPoolExecutor(max_workers=1) if background else None
+        tracer = tracer or Tracer()
+
+        def _ensure(manager: "ObjectManager", batch: List[str]) -> CallbackList:
+            with manager.ensure_objects(
+                table, objects=batch, defer_release=True, tracer=tracer
+            ) as eo_result:
+                return cast(Tuple[List[str], CallbackList], eo_result)[1]
+
+        def _release_when_claimed(future: "Future[CallbackList]", batch: List[str]):
+            def _f(**kwargs):
+                try:
+                    future.result()
+                except Exception:
+                    # ensure_objects has already released the objects if it failed.
+                    return
+                # Release the objects using this manager's engines rather than the background
+                # manager's, since those get closed when the batches run out.
+                self._make_release_callback(batch, table, tracer)(**kwargs)
+
+            return _f
+
+        future: Optional["Future[CallbackList]"] = None
+        try:
+            for i, batch in enumerate(batches):
+                if future:
+                    # Raises the exception if the background download failed.
+                    future.result()
+                else:
+                    release_callback.append(_ensure(self, batch))
+                future = None
+                if executor and background and i + 1 < len(batches):
+                    future = executor.submit(_ensure, background, batches[i + 1])
+                    release_callback.append(_release_when_claimed(future, batches[i + 1]))
+                yield batch
+        finally:
+            if executor and background:
+                # If the caller stopped early, cancel the download of the next batch or wait
+                # for it to finish (its objects get released by the release callback) so that
+                # we can close the background manager's connections.
+                if future and not future.cancel():
+                    try:
+                        future.result()
+                    except Exception:
+                        logging.debug("Background download failed", exc_info=True)
+                executor.shutdown(wait=True)
+                background.object_engine.close_pool()
+                if background.metadata_engine is not background.object_engine:
+                    background.metadata_engine.close_pool()
+
+    def _make_background_manager(self) -> Optional["ObjectManager"]:
+        # Background downloads need engines with their own connection pools (see
+        # PsycopgEngine.clone). Engines that were set up with an external connection pool
+        # can't be cloned like that, in which case we download objects in the foreground.
+        try:
+            object_engine = cast("PostgresEngine", self.object_engine.clone(share_pool=False))
+            if self.metadata_engine is self.object_engine:
+                metadata_engine = object_engine
+            else:
+                metadata_engine = cast(
+                    "PostgresEngine", self.metadata_engine.clone(share_pool=False)
+                )
+        except (ValueError, AttributeError):
+            return None
+        manager = type(self)(object_engine, metadata_engine)
+        # Carry over cache settings that might have been changed on this manager.
+        manager.cache_size = self.cache_size
+        manager.eviction_min_fraction = self.eviction_min_fraction
+        manager.eviction_policy = self.eviction_policy
+        return manager
+
+    def start_background_eviction(self, **kwargs) -> "CacheEvictor":
+        """
+        Start a thread that keeps the cache occupancy under a low watermark, so that
+        foreground queries rarely need to run eviction. See
+        :class:`splitgraph.core.eviction.CacheEvictor` for the parameters.
+
+        :return: The evictor (call its `stop()` method to stop it).
+        """
+        manager = self._make_background_manager()
+        if not manager:
+            raise ObjectCacheError("Background eviction requires an engine with connection params!")
+        evictor = CacheEvictor(manager, **kwargs)
+        evictor.start()
+        return evictor
+
+    def register_fragment_view(self, schema: str, table: str, object_ids: List[str]) -> None:
+        """
+        Record a view over objects that's been created by
+        :meth:`splitgraph.core.table.Table.create_fragment_view`, so that it can be dropped and
+        its objects released by :meth:`release_fragment_views`.
+
+        :param schema: Schema the view is located in.
+        :param table: Name of the view.
+        :param object_ids: Objects the view reads from (claimed by the caller).
+        """
+        self.object_engine.run_sql(
+            insert("fragment_views", ("schema_name", "table_name", "object_ids")),
+            (schema, table, object_ids),
+        )
+
+    def get_fragment_views(self, schema: str) -> List[str]:
+        """
+        Get names of views over objects in a schema (see :meth:`register_fragment_view`).
+
+        :param schema: Schema the views are located in.
+        """
+        return cast(
+            List[str],
+            self.object_engine.run_sql(
+                select("fragment_views", "table_name", "schema_name = %s"),
+                (schema,),
+                return_shape=ResultShape.MANY_ONE,
+            ),
+        )
+
+    def release_fragment_views(self, schema: str) -> None:
+        """
+        Drop views over objects in a checked-out schema (created by
+        :meth:`splitgraph.core.table.Table.create_fragment_view`) and release the objects
+        they've claimed, so that they can be evicted from the cache. Other views in the
+        schema are left alone.
+
+        :param schema: Schema the views are located in.
+        """
+        views = self.object_engine.run_sql(
+            SQL(
+                "DELETE FROM {}.fragment_views WHERE schema_name = %s "
+                "RETURNING table_name, object_ids"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            (schema,),
+        )
+        for view_name, objects in views:
+            logging.debug("Releasing %s used by %s", pluralise("object", len(objects)), view_name)
+            self._release_objects(objects)
+            self.object_engine.run_sql(
+                SQL("DROP VIEW IF EXISTS {}.{} CASCADE").format(
+                    Identifier(schema), Identifier(view_name)
+                )
+            )
+
     def make_objects_external(
         self, objects: List[str], handler: str, handler_params: Dict[Any, Any]
     ) -> None:
@@ -365,10 +558,7 @@ class ObjectManager(FragmentManager):
         )
 
         # Grab the objects that we're supposed to be uploading.
-        claimed_objects = self.object_engine.run_sql(
-            select("object_cache_status", "object_id", "ready = 'f' FOR UPDATE"),
-            return_shape=ResultShape.MANY_ONE,
-        )
+        claimed_objects = self._get_unready_objects(new_objects, lock=True)
         new_objects = [o for o in new_objects if o in claimed_objects]
 
         # Perform the actual upload
@@ -376,11 +566,15 @@ class ObjectManager(FragmentManager):
 
         partial_failure: Optional[IncompleteObjectUploadError] = None
         try:
-            with switch_engine(self.object_engine):
-                successful = {
-                    o: u
-                    for o, u in external_handler.upload_objects(new_objects, self.metadata_engine)
-                }
+            successful = {
+                o: u
+                for o, u in _call_handler(
+                    external_handler.upload_objects,
+                    self.object_engine,
+                    new_objects,
+                    self.metadata_engine,
+                )
+            }
         except IncompleteObjectUploadError as e:
             partial_failure = e
             successful = {o: u for o, u in zip(e.successful_objects, e.successful_object_urls)}
@@ -409,47 +603,99 @@ class ObjectManager(FragmentManager):
         if excess > 0:
             self.run_eviction(keep_objects=[], required_space=excess)
 
+    @contextmanager
+    def _cache_lock(self) -> Iterator[None]:
+        """
+        Take out a cache-wide lock for the duration of the block. This is only used to
+        serialize cache space accounting and eviction, not object downloads.
+
+        This is a transaction-level advisory lock: the transaction is committed (releasing
+        the lock) when the block exits and rolled back if it raises, so nothing inside the
+        block may commit. Connections get closed when they're returned to the pool, so a
+        session-level lock wouldn't survive a commit either.
+        """
+        self.object_engine.run_sql("SELECT pg_advisory_xact_lock(%s)", (_CACHE_LOCK_ID,))
+        try:
+            yield
+        except Exception:
+            self.object_engine.rollback()
+            raise
+        self.object_engine.commit()
+
+    def _get_unready_objects(self, objects: List[str], lock: bool = False) -> List[str]:
+        """
+        Get objects from a list that have been claimed but not downloaded yet.
+
+        :param objects: List of object IDs
+        :param lock: Lock the objects' cache entries. If another object manager is downloading
+            some of these objects, this blocks until it's done, in which case these objects
+            aren't returned.
+        """
+        if not objects:
+            return []
+        query = (
+            SQL("SELECT object_id FROM {}.object_cache_status WHERE ready = 'f' AND object_id IN (")
+            + SQL(",".join(itertools.repeat("%s", len(objects))))
+            + SQL(")")
+        )
+        if lock:
+            # Lock the entries in a consistent order to avoid deadlocks with other object managers.
+            query += SQL(" ORDER BY object_id FOR UPDATE")
+        return cast(
+            List[str],
+            self.object_engine.run_sql(
+                query.format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                objects,
+                return_shape=ResultShape.MANY_ONE,
+            )
+            or [],
+        )
+
     def _prepare_fetch_list(self, required_objects: List[str]) -> List[str]:
         """
         Calculates the missing objects and ensures there's enough space in the cache
         to download them.
 
+        Missing objects are locked, so that if other object managers need some of them
+        too, they'll wait for this one to finish downloading them (and vice versa). Objects
+        that aren't required by this manager aren't locked.
+
         :param required_objects: Iterable of object IDs that are required to be on the engine.
         :return: Set of objects to fetch
         """
-        to_fetch: List[str] = self.object_engine.run_sql(
-            select("object_cache_status", "object_id", "ready = 'f'"),
-            return_shape=ResultShape.MANY_ONE,
-        )
-        if to_fetch:
-            # If we need to download anything, take out an exclusive lock on the cache since we might
-            # need to run eviction and don't want multiple managers trying to download the same things.
-            # This used to be more granular (allow multiple managers downloading objects) but was resulting
-            # in fun concurrency bugs and deadlocks that I don't have the willpower to investigate further
-            # right now (e.g. two managers trying to download the same objects at the same time after one of them
-            # runs cache eviction and releases some locks -- or two managers trying to free the same amount
-            # of space in the cache for the same set of objects).
-
-            # Since we already hold a row-level lock on some objects in the cache, we have to release it first and
-            # lock the full table then -- but this means someone else might start downloading the objects that
-            # we claimed. So, once we acquire the lock, we recalculate the fetch list again to see what
-            # we're supposed to be fetching.
-            self.object_engine.commit()
-            self.object_engine.lock_table(SPLITGRAPH_META_SCHEMA, "object_cache_status")
-            to_fetch = self.object_engine.run_sql(
-                select("object_cache_status", "object_id", "ready = 'f'"),
-                return_shape=ResultShape.MANY_ONE,
-            )
-            # If someone else downloaded all the objects we need, there's no point in holding the lock.
+        to_fetch = self._get_unready_objects(required_objects)
+        if not to_fetch:
+            return to_fetch
+
+        # Since we already hold row-level locks on the objects we claimed, we have to release them
+        # first: otherwise, we might deadlock with another manager that's waiting on us
+        # whilst holding the cache lock.
+        self.object_engine.commit()
+
+        evicted = False
+        with self._cache_lock():
+            # Make sure there's enough space in the cache for the objects. Objects that other
+            # managers are about to download count towards the occupancy too, since they
+            # haven't been added to it yet.
+            to_fetch = self._get_unready_objects(required_objects)
+            # If someone else downloaded all the objects we need, there's nothing to do.
             # This is tricky to test with a single process.
             if not to_fetch:  # pragma: no cover
-                self.object_engine.commit()
                 return to_fetch
-            required_space = sum(o.size for o in self.get_object_meta(list(to_fetch)).values())
-            current_occupied = self.get_cache_occupancy()
+            pending = set(
+                self.object_engine.run_sql(
+                    select("object_cache_status", "object_id", "ready = 'f'"),
+                    return_shape=ResultShape.MANY_ONE,
+                )
+            ).difference(required_objects)
+
+            object_meta = self.get_object_meta(list(to_fetch) + list(pending))
+            required_space = sum(object_meta[o].size for o in to_fetch if o in object_meta)
+            pending_space = sum(object_meta[o].size for o in pending if o in object_meta)
+            current_occupied = self.get_cache_occupancy() + pending_space
             logging.info(
                 "Need to download %s (%s), cache occupancy: %s/%s",
-                pluralise("object", len(required_objects)),
+                pluralise("object", len(to_fetch)),
                 pretty_size(required_space),
                 pretty_size(current_occupied),
                 pretty_size(self.cache_size),
@@ -463,14 +709,18 @@ class ObjectManager(FragmentManager):
             if required_space > self.cache_size - current_occupied:
                 to_free = required_space + current_occupied - self.cache_size
                 logging.info("Need to free %s", pretty_size(to_free))
-                self.run_eviction(required_objects, to_free)
-            self.object_engine.commit()
-            # Finally, after we're done with eviction, relock the objects that we're supposed to be downloading.
-            to_fetch = self.object_engine.run_sql(
-                select("object_cache_status", "object_id", "ready = 'f' FOR UPDATE"),
-                return_shape=ResultShape.MANY_ONE,
-            )
-        return to_fetch
+                evicted = bool(self._run_eviction(required_objects, to_free)[0])
+
+        # Evicted objects' files are deleted after the cache lock has been released,
+        # so that other managers don't wait for us to do it.
+        if evicted:
+            self.object_engine.purge_discarded_objects()
+
+        # Finally, lock the objects that we're supposed to be downloading. They're still marked
+        # as not ready, so managers that run eviction after us see them as pending. If someone
+        # else is downloading some of these objects, this waits for them to finish and drops
+        # those objects from the list.
+        return self._get_unready_objects(required_objects, lock=True)
 
     def _claim_objects(self, objects: List[str]) -> None:
         """Increases refcounts and bumps the last used timestamp to now for cached objects.
@@ -484,10 +734,14 @@ class ObjectManager(FragmentManager):
         # So, we first try to update cache entries to bump their refcount, see which ones we updated,
         # subtract objects that we have locally and insert the remaining entries as new cache entries.
 
+        # Also count the access and record the cache's inflation value, for eviction
+        # policies that use access frequencies and dynamic aging.
         claimed = self.object_engine.run_sql(
             SQL(
-                "UPDATE {}.object_cache_status SET refcount = refcount + 1, "
-                "last_used = %s WHERE object_id IN ("
+                "UPDATE {0}.object_cache_status SET refcount = refcount + 1, "
+                "last_used = %s, access_count = access_count + 1, "
+                "inflation = (SELECT inflation FROM {0}.object_cache_occupancy) "
+                "WHERE object_id IN ("
             ).format(Identifier(SPLITGRAPH_META_SCHEMA))
             + SQL(",".join(itertools.repeat("%s", len(objects))))
             + SQL(") RETURNING object_id"),
@@ -502,17 +756,37 @@ class ObjectManager(FragmentManager):
         # with another object manager instance. Hence, we sort the list of objects so that we claim them
         # in a consistent order between all instances.
         remaining = sorted(remaining)
+        if not remaining:
+            return
+        inflation = self.object_engine.run_sql(
+            select("object_cache_occupancy", "inflation"), return_shape=ResultShape.ONE_ONE
+        )
 
         # Remaining: objects that are new to the cache and that we'll need to download. However, between us
         # running the first query and now, somebody else might have started downloading them. Hence, when
         # we try to insert them, we'll be blocked until the other engine finishes its download and commits
         # the transaction -- then get an integrity error. So here, we do an update on conflict (again).
         self.object_engine.run_sql_batch(
-            insert("object_cache_status", ("object_id", "ready", "refcount", "last_used"))
+            insert(
+                "object_cache_status",
+                ("object_id", "ready", "refcount", "last_used", "access_count", "inflation"),
+            )
             + SQL(
-                "ON CONFLICT (object_id) DO UPDATE SET refcount = EXCLUDED.refcount + 1, last_used = %s"
-            ),
-            [(object_id, False, 1, now, now) for object_id in remaining],
+                "ON CONFLICT (object_id) DO UPDATE SET refcount = EXCLUDED.refcount + 1, last_used = %s, "
+                "access_count = {}.object_cache_status.access_count + 1, "
+                "inflation = EXCLUDED.inflation"
+            ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+            [(object_id, False, 1, now, 1, inflation, now) for object_id in remaining],
+        )
+
+    def _record_accesses(self, objects: List[str]) -> None:
+        """Append object accesses to the trace file (see SG_OBJECT_CACHE_TRACE)."""
+        assert self.trace_path
+        now = dt.utcnow()
+        object_meta = self.get_object_meta(objects)
+        write_trace(
+            self.trace_path,
+            (TraceEntry(o, object_meta[o].size, now) for o in objects if o in object_meta),
         )
 
     def _set_ready_flags(self, objects: List[str], is_ready: bool = True) -> None:
@@ -559,7 +833,12 @@ class ObjectManager(FragmentManager):
             (size_freed,),
         )
 
-    def run_eviction(self, keep_objects: List[str], required_space: Optional[int] = None) -> None:
+    def run_eviction(
+        self,
+        keep_objects: List[str],
+        required_space: Optional[int] = None,
+        best_effort: bool = False,
+    ) -> int:
         """
         Delete enough objects with zero reference count (only those, since we guarantee that whilst refcount is >0,
         the object stays alive) to free at least `required_space` in the cache.
@@ -567,15 +846,45 @@ class ObjectManager(FragmentManager):
         :param keep_objects: List of objects (besides those with nonzero refcount) that can't be deleted.
         :param required_space: Space, in bytes, to free. If the routine can't free at least this much space,
             it shall raise an exception. If None, removes all eligible objects.
+        :param best_effort: If True, free as much space as possible (up to `required_space`)
+            instead of raising an exception if there isn't enough space to free.
+        :return: Space freed, in bytes.
         """
+        with self._cache_lock():
+            to_delete, freed_space = self._run_eviction(keep_objects, required_space, best_effort)
+
+        # Deleting files can take a while, so it's done after the cache lock is released.
+        if to_delete:
+            self.object_engine.purge_discarded_objects()
+            self.object_engine.commit()
+        return freed_space
 
+    def _run_eviction(
+        self,
+        keep_objects: List[str],
+        required_space: Optional[int] = None,
+        best_effort: bool = False,
+    ) -> Tuple[List[str], int]:
+        """
+        Pick objects to evict and delete them from the cache, discarding their files. Must be
+        run whilst holding the cache lock, which has to be released before the files can be
+        deleted with `object_engine.purge_discarded_objects()`.
+
+        :return: List of evicted objects and the space freed, in bytes.
+        """
         logging.info("Performing eviction...")
         # Find deletion candidates: objects that we have locally, with refcount 0, that aren't in the whitelist.
+        # Lock them so that other managers can't claim them until we're done (and skip objects that
+        # are being claimed right now).
 
         candidates = [
             o
             for o in self.object_engine.run_sql(
-                select("object_cache_status", "object_id,last_used", "refcount=0"),
+                select(
+                    "object_cache_status",
+                    "object_id,last_used,access_count,inflation",
+                    "refcount=0 FOR UPDATE SKIP LOCKED",
+                ),
                 return_shape=ResultShape.MANY_MANY,
             )
             if o[0] not in keep_objects
@@ -595,6 +904,7 @@ class ObjectManager(FragmentManager):
                 orphaned_objects,
             )
 
+        inflation: Optional[float] = None
         if required_space is None:
             # Just delete everything with refcount 0.
             to_delete = [o[0] for o in candidates]
@@ -605,73 +915,82 @@ class ObjectManager(FragmentManager):
                 pretty_size(freed_space),
             )
         else:
-            if required_space > sum(object_sizes.values()) + sum(orphaned_object_sizes.values()):
-                raise ObjectCacheError("Not enough space will be reclaimed after eviction!")
-
-            to_delete, freed_space = self._prepare_eviction_candidates(
-                candidates, object_sizes, orphaned_object_sizes, orphaned_objects, required_space
+            available_space = sum(object_sizes.values()) + sum(orphaned_object_sizes.values())
+            if required_space > available_space:
+                if not best_effort:
+                    raise ObjectCacheError("Not enough space will be reclaimed after eviction!")
+                required_space = available_space
+
+            entries = [
+                CacheEntry(o[0], object_sizes[o[0]], o[1], o[2], o[3])
+                for o in candidates
+                if o[0] in object_sizes
+            ]
+            to_delete, freed_space, inflation = self._prepare_eviction_candidates(
+                entries, orphaned_object_sizes, required_space
             )
 
         if to_delete:
-            # NB delete_objects commits as well, releasing the lock. Make sure to do all bookkeeping first so that
-            # other object managers in this function think that the objects have been deleted and don't try to delete
-            # them again.
             self._delete_cache_entries(to_delete)
             self._decrease_cache_occupancy(freed_space)
-            self.delete_objects(to_delete)
+            if inflation is not None:
+                self.object_engine.run_sql(
+                    SQL(
+                        "UPDATE {}.object_cache_occupancy SET inflation = GREATEST(inflation, %s)"
+                    ).format(Identifier(SPLITGRAPH_META_SCHEMA)),
+                    (inflation,),
+                )
+            # Only unmount the objects and move their files out of the way here: they get
+            # deleted after this transaction commits and releases the cache lock.
+            self.delete_objects(to_delete, discard=True)
             logging.info(
                 "Eviction done. Cache occupancy: %s", pretty_size(self.get_cache_occupancy())
             )
-
-    def _eviction_score(self, now, object_size, last_used):
-        # We want to evict objects in order to minimize
-        # P(object is requested again) * (cost of redownloading the object).
-        # To approximate the probability, we use an exponential decay function (1 if last_used = now, dropping down
-        # to 0 as time since the object's last usage time passes).
-        # To approximate the cost, we use the object's size, floored to a constant (so if the object has
-        # size <= floor, we'd use the floor value -- this is to simulate the latency of re-fetching the object,
-        # as opposed to the bandwidth)
-        time_since_used = (now - last_used).total_seconds()
-        time_factor = math.exp(-self.eviction_decay_constant * time_since_used)
-        size_factor = object_size if object_size > self.eviction_floor else self.eviction_floor
-        return time_factor * size_factor
+        return to_delete, freed_space
 
     def _prepare_eviction_candidates(
-        self, candidates, object_sizes, orphaned_object_sizes, orphaned_objects, required_space
-    ):
-        now = dt.utcnow()
-
+        self,
+        entries: List[CacheEntry],
+        orphaned_object_sizes: Dict[str, int],
+        required_space: int,
+    ) -> Tuple[List[str], int, Optional[float]]:
         # Since we can free the minimum required amount of space, see if we can free even more as
         # per our settings (if we can't, we'll just delete as much as we can instead of failing).
         required_space = max(required_space, int(self.eviction_min_fraction * self.cache_size))
 
         # Delete all orphaned objects first
-        to_delete = orphaned_objects
-        last_useds = [o[1] for o in candidates if o[0] in orphaned_objects]
+        to_delete = list(orphaned_object_sizes)
         freed_space = sum(orphaned_object_sizes.values())
 
-        # Sort candidates by deletion priority (lowest is smallest expected retrieval cost -- more likely to delete)
-        candidates = sorted(
-            [o for o in candidates if o[0] not in orphaned_objects],
-            key=lambda o: self._eviction_score(now, object_sizes[o[0]], o[1]),
+        # Keep picking objects with the lowest score (smallest expected retrieval cost -- more
+        # likely to delete) until we've freed enough space.
+        victims, max_score = self.eviction_policy.select_victims(
+            entries, required_space - freed_space
         )
+        to_delete.extend(v.object_id for v in victims)
+        freed_space += sum(v.size for v in victims)
 
-        # Keep adding deletion candidates until we've freed enough space.
-        for object_id, last_used in candidates:
-            if freed_space >= required_space:
-                break
-            last_useds.append(last_used)
-            to_delete.append(object_id)
-            freed_space += object_sizes[object_id]
-        logging.info(
-            "Will delete %s last used between %s and %s, total size %s: %s",
-            pluralise("object", len(to_delete)),
-            min(last_useds).isoformat(),
-            max(last_useds).isoformat(),
-            pretty_size(freed_space),
-            to_delete,
-        )
-        return to_delete, freed_space
+        if victims:
+            logging.info(
+                "Will delete %s last used between %s and %s, total size %s: %s",
+                pluralise("object", len(to_delete)),
+                min(v.last_used for v in victims).isoformat(),
+                max(v.last_used for v in victims).isoformat(),
+                pretty_size(freed_space),
+                to_delete,
+            )
+        else:
+            logging.info(
+                "Will delete %s, total size %s: %s",
+                pluralise("object", len(to_delete)),
+                pretty_size(freed_space),
+                to_delete,
+            )
+
+        # For policies with dynamic aging, objects accessed from now on are scored on top of
+        # the score of the objects we evicted.
+        inflation = max_score if victims and self.eviction_policy.aging else None
+        return to_delete, freed_space, inflation
 
     def _delete_cache_entries(self, to_delete: List[str]) -> None:
         if not to_delete:
@@ -775,8 +1094,12 @@ class ObjectManager(FragmentManager):
 
         external_handler = get_external_object_handler(handler, handler_params)
 
-        with switch_engine(self.object_engine):
-            return external_handler.upload_objects(objects_to_push, target.metadata_engine)
+        return _call_handler(
+            external_handler.upload_objects,
+            self.object_engine,
+            objects_to_push,
+            target.metadata_engine,
+        )
 
     def cleanup(self) -> List[str]:
         """
@@ -809,6 +1132,18 @@ class ObjectManager(FragmentManager):
             t for t in tables_in_meta if t not in registered_objects or t in deleted_objects
         ]
         self.delete_objects(to_delete)
+        # Delete files of objects that were evicted but not purged (e.g. if the process
+        # that evicted them crashed). Objects that are still in the cache are being evicted
+        # by a transaction that hasn't finished yet and might get restored.
+        discarded = self.object_engine.get_discarded_objects()
+        if discarded:
+            cached = set(
+                self.object_engine.run_sql(
+                    select("object_cache_status", "object_id"),
+                    return_shape=ResultShape.MANY_ONE,
+                )
+            )
+            self.object_engine.purge_discarded_objects([o for o in discarded if o not in cached])
 
         # Recalculate the object cache occupancy
         self.object_engine.run_sql(
@@ -836,7 +1171,33 @@ def _fetch_external_objects(
     if non_remote_objects:
         for method, objects in non_remote_by_method.items():
             handler = get_external_object_handler(method, handler_params)
-            # In case we're calling this from inside the FDW
-            with switch_engine(engine):
-                successful.extend(handler.download_objects(objects, source_engine))
+            # Pass the engine explicitly rather than making it the current engine, since
+            # this can run in a background thread (see ObjectManager.ensure_objects_ahead)
+            # or inside the FDW.
+            successful.extend(
+                _call_handler(handler.download_objects, engine, objects, source_engine)
+            )
     return successful
+
+
+def _call_handler(method: Callable[..., T], local_engine: "PostgresEngine", *args: Any) -> T:
+    """
+    Call a method of an external object handler, passing it the engine that the objects
+    are on as `local_engine`. Handlers whose methods don't accept that argument get
+    the engine as the current engine instead (this isn't safe to do in background threads).
+    """
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        parameters = []
+    if any(p.name == "local_engine" or p.kind == p.VAR_KEYWORD for p in parameters):
+        return method(*args, local_engine=local_engine)
+
+    warnings.warn(
+        "%s doesn't accept the local_engine argument. Support for external object "
+        "handlers without it will be removed in a future version."
+        % getattr(method, "__qualname__", method),
+        DeprecationWarning,
+    )
+    with switch_engine(local_engine):
+        return method(*args)
@@ -9,7 +9,20 @@ from contextlib import contextmanager
 from datetime import datetime
 from io import TextIOWrapper
 from random import getrandbits
-from typing import Any, Dict, Iterator, List, Optional, Tuple, Union, Set, Sequence, cast
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    Set,
+    Sequence,
+    cast,
+)
 
 from psycopg2.sql import Composed
 from psycopg2.sql import SQL, Identifier
@@ -21,7 +34,12 @@ from splitgraph.config import (
     get_singleton,
     CONFIG,
 )
-from splitgraph.core.fragment_manager import get_temporary_table_id, ExtraIndexInfo
+from splitgraph.core.fragment_manager import (
+    get_temporary_table_id,
+    ExtraIndexInfo,
+    FragmentManager,
+    DeferredFragmentManager,
+)
 from splitgraph.core.image import Image
 from splitgraph.core.image_manager import ImageManager
 from splitgraph.core.sql import validate_import_sql, select, insert
@@ -39,10 +57,10 @@ from .common import (
     set_head,
     manage_audit,
     aggregate_changes,
-    slow_diff,
     gather_sync_metadata,
     set_tags_batch,
 )
+from .diff import diff_table
 from .output import pluralise
 from .engine import lookup_repository, get_engine
 from .object_manager import ObjectManager
@@ -196,6 +214,7 @@ class Repository:
         # be applied/recorded if a new repository with the same name appears.
         if uncheckout and not self.object_engine.registry:
             self.object_engine.discard_pending_changes(self.to_schema())
+            self.objects.release_fragment_views(self.to_schema())
 
             # Dispose of the foreign servers (LQ FDW, other FDWs) for this schema if it exists
             # (otherwise its connection won't be recycled and we can get deadlocked).
@@ -401,6 +420,8 @@ class Repository:
         extra_indexes: Optional[Dict[str, ExtraIndexInfo]] = None,
         in_fragment_order: Optional[Dict[str, List[str]]] = None,
         overwrite: bool = False,
+        workers: int = 1,
+        table_workers: int = 1,
     ) -> Image:
         """
         Commits all pending changes to a given repository, creating a new image.
@@ -423,6 +444,12 @@ class Repository:
         :param in_fragment_order: Dictionary of {table: list of columns}. If specified, will
         sort the data inside each chunk by this/these key(s) for each table.
         :param overwrite: If an object already exists, will force recreate it.
+        :param workers: Number of connections to use to split tables stored as snapshots into
+            chunks in parallel.
+        :param table_workers: If greater than 1, store tables in parallel using up to this many
+            extra connections (each table being stored on one connection). New objects are
+            registered and the image is created in one transaction at the end, so
+            the commit is still atomic. Each table is chunked serially in that case.
 
         :return: The newly created Image object.
         """
@@ -449,6 +476,8 @@ class Repository:
             extra_indexes=extra_indexes,
             in_fragment_order=in_fragment_order,
             overwrite=overwrite,
+            workers=workers,
+            table_workers=table_workers,
         )
 
         set_head(self, image_hash)
@@ -467,6 +496,8 @@ class Repository:
         extra_indexes: Optional[Dict[str, ExtraIndexInfo]] = None,
         in_fragment_order: Optional[Dict[str, List[str]]] = None,
         overwrite: bool = False,
+        workers: int = 1,
+        table_workers: int = 1,
     ) -> None:
         """
         Reads the recorded pending changes to all tables in a given checked-out image,
@@ -483,8 +514,19 @@ class Repository:
 
         changed_tables = self.object_engine.get_changed_tables(schema)
         tracked_tables = self.object_engine.get_tracked_tables()
+        fragment_views = self.objects.get_fragment_views(schema)
 
+        # Tables that need new objects: (table name, HEAD table if stored as a patch, new schema)
+        to_record: List[Tuple[str, Optional[Table], TableSchema]] = []
         for table in self.object_engine.get_all_tables(schema):
+            if table in fragment_views and head:
+                # Tables checked out as views over their fragments (see
+                # Table.create_fragment_view) are read-only, so they're the same as in HEAD.
+                table_info = head.get_table(table)
+                self.objects.register_tables(
+                    self, [(image_hash, table, table_info.table_schema, table_info.objects)]
+                )
+                continue
             if self.object_engine.get_table_type(schema, table) == "VIEW":
                 logging.warning(
                     "Table %s.%s is a view. Splitgraph currently doesn't "
@@ -509,7 +551,28 @@ class Repository:
                 or not _schema_compatible(table_info.table_schema, new_schema)
                 or (schema, table) not in tracked_tables
             ):
-                self.objects.record_table_as_base(
+                to_record.append((table, None, new_schema))
+                continue
+
+            # If the table has changed, look at the audit log and store it as a delta.
+            if table in changed_tables:
+                to_record.append((table, table_info, new_schema))
+                continue
+
+            # If the table wasn't changed, point the image to the old table
+            self.objects.register_tables(
+                self, [(image_hash, table, new_schema, table_info.objects)]
+            )
+
+        def _record_table(
+            objects: FragmentManager,
+            table: str,
+            table_info: Optional[Table],
+            new_schema: TableSchema,
+            chunk_workers: int,
+        ) -> None:
+            if not table_info:
+                objects.record_table_as_base(
                     self,
                     table,
                     image_hash,
@@ -518,12 +581,10 @@ class Repository:
                     extra_indexes=extra_indexes.get(table),
                     in_fragment_order=in_fragment_order.get(table),
                     overwrite=overwrite,
+                    workers=chunk_workers,
                 )
-                continue
-
-            # If the table has changed, look at the audit log and store it as a delta.
-            if table in changed_tables:
-                self.objects.record_table_as_patch(
+            else:
+                objects.record_table_as_patch(
                     table_info,
                     schema,
                     image_hash,
@@ -533,18 +594,85 @@ class Repository:
                     in_fragment_order=in_fragment_order.get(table),
                     overwrite=overwrite,
                 )
-                continue
 
-            # If the table wasn't changed, point the image to the old table
-            self.objects.register_tables(
-                self, [(image_hash, table, new_schema, table_info.objects)]
-            )
+        # Leave one connection in the pool for the main thread.
+        table_workers = min(
+            table_workers, int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1, len(to_record)
+        )
+        if table_workers > 1:
+            failed = self._record_tables_parallel(to_record, _record_table, table_workers)
+        else:
+            failed = to_record
+
+        for table, table_info, new_schema in failed:
+            _record_table(self.objects, table, table_info, new_schema, workers)
 
         # Make sure that all pending changes have been discarded by this point (e.g. if we created just a snapshot for
         # some tables and didn't consume the audit log).
         # NB if we allow partial commits, this will have to be changed (only discard for committed tables).
         self.object_engine.discard_pending_changes(schema)
 
+    def _record_tables_parallel(
+        self,
+        to_record: List[Tuple[str, Optional[Table], TableSchema]],
+        record_table: Callable[[FragmentManager, str, Optional[Table], TableSchema, int], None],
+        table_workers: int,
+    ) -> List[Tuple[str, Optional[Table], TableSchema]]:
+        # Store every table on its own connection from the engine's pool and in its own
+        # transaction. Objects are committed by the workers, but they're registered and
+        # linked to the new image in the main transaction at the end (as are the pending
+        # changes discarded), so the commit is still atomic from the point of view of the
+        # metadata. Tables that failed to be stored (e.g. if two tables tried to create
+        # the same object at the same time) are returned to be stored serially.
+        object_engine = self.objects.object_engine
+        metadata_engine = self.objects.metadata_engine
+
+        def _store_table(
+            table_spec: Tuple[str, Optional[Table], TableSchema],
+        ) -> Optional[DeferredFragmentManager]:
+            worker_object_engine = object_engine.clone()
+            worker_metadata_engine = (
+                worker_object_engine
+                if metadata_engine is object_engine
+                else metadata_engine.clone()
+            )
+            objects = DeferredFragmentManager(worker_object_engine, worker_metadata_engine)
+            try:
+                record_table(objects, *table_spec, 1)
+                worker_object_engine.commit()
+                if worker_metadata_engine is not worker_object_engine:
+                    worker_metadata_engine.commit()
+                # Delete the new objects if the main transaction doesn't get committed.
+                object_engine.add_uncommitted_objects(
+                    [o.object_id for batch, _ in objects.deferred_objects for o in batch]
+                )
+                return objects
+            except Exception:
+                logging.warning(
+                    "Error storing table %s, will retry serially", table_spec[0], exc_info=True
+                )
+                worker_object_engine.rollback()
+                if worker_metadata_engine is not worker_object_engine:
+                    worker_metadata_engine.rollback()
+                return None
+
+        logging.info("Storing %d table(s) using %d workers", len(to_record), table_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=table_workers) as tpe:
+                results = list(tpe.map(_store_table, to_record))
+        finally:
+            object_engine.close_others()
+            if metadata_engine is not object_engine:
+                metadata_engine.close_others()
+
+        failed = []
+        for table_spec, objects in zip(to_record, results):
+            if objects is not None:
+                objects.register_deferred(self.objects)
+            else:
+                failed.append(table_spec)
+        return failed
+
     def has_pending_changes(self) -> bool:
         """
         Detects if the repository has any pending changes (schema changes, table additions/deletions, content changes).
@@ -1009,8 +1137,9 @@ class Repository:
         aggregate: bool = False,
     ) -> Union[bool, Tuple[int, int, int], List[Tuple[bool, Tuple]], None]:
         """
-        Compares the state of a table in different images by materializing both tables into a temporary space
-        and comparing them row-to-row.
+        Compares the state of a table in different images. Rows are compared on the engine and
+        if both images store the table as fragments, only fragments that aren't shared by the
+        two images are compared (see :mod:`splitgraph.core.diff`).
 
         :param table_name: Name of the table.
         :param image_1: First image hash / object. If None, uses the state of the current staging area.
@@ -1065,9 +1194,7 @@ class Repository:
             ):
                 return [] if not aggregate else (0, 0, 0)
 
-        # Materialize both tables and compare them side-by-side.
-        # TODO we can aggregate chunks in a similar way that LQ does it.
-        return slow_diff(self, table_name, _hash(image_1), _hash(image_2), aggregate)
+        return diff_table(self, table_name, _hash(image_1), _hash(image_2), aggregate)
 
 
 def import_table_from_remote(
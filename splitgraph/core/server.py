@@ -5,17 +5,56 @@ When inside of an LQFDW shim, these are called directly by the Splitgraph core c
 to avoid a redundant connection to the engine.
 """
 
+import logging
 import os.path
-from typing import List, Tuple
+import threading
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar, TYPE_CHECKING
 from urllib.parse import urlparse
 
 from splitgraph.config import CONFIG
 
+if TYPE_CHECKING:
+    import requests
+
 SG_ENGINE_OBJECT_PATH = str(CONFIG["SG_ENGINE_OBJECT_PATH"])
 
 # An object consists of three files: CStore file, CStore footer and the JSON schema spec.
 # We have to download them separately.
 ObjectUrls = Tuple[str, str, str]
+_OBJECT_SUFFIXES = ("", ".footer", ".schema")
+
+# Files are downloaded under this suffix and renamed when the whole object is downloaded.
+_TMP_SUFFIX = ".tmp"
+# Files of evicted objects are renamed to this suffix and deleted later on.
+_DISCARDED_SUFFIX = ".discarded"
+
+# Files bigger than this are downloaded in ranges of this size in parallel.
+_PART_SIZE = int(CONFIG["SG_S3_PART_SIZE"])
+_DOWNLOAD_THREADS = int(CONFIG["SG_S3_DOWNLOAD_THREADS"])
+_RETRIES = int(CONFIG["SG_S3_RETRIES"])
+_BACKOFF = 0.5
+_MAX_BACKOFF = 30.0
+_CHUNK_SIZE = 1024 * 1024
+# Connect/read timeout for transfers (not the timeout for the whole transfer)
+_TIMEOUT = 60
+
+T = TypeVar("T")
+
+# HTTP sessions are kept between transfers so that connections to S3 get reused
+# instead of paying for a new TLS handshake for every file. Every worker in sgr
+# has its own engine connection (and so its own backend process), but when we're
+# inside of an LQFDW shim, workers call these routines directly from different threads.
+_SESSIONS = threading.local()
+
+
+def _get_session() -> "requests.Session":
+    session = getattr(_SESSIONS, "session", None)
+    if session is None:
+        import requests
+
+        session = requests.Session()
+        _SESSIONS.session = session
+    return session
 
 
 def verify(url: str):
@@ -36,27 +75,193 @@ def _remove(path: str):
         pass
 
 
-def upload_object(object_id: str, urls: ObjectUrls):
+class _ShortRead(Exception):
+    """Raised when a download ends before all requested bytes have been received."""
+
+
+def _is_transient(error: Exception) -> bool:
+    # Errors after which retrying the request might succeed. Other errors (e.g. a 403
+    # because a pre-signed URL has expired) are raised straight away.
     import requests
 
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and (
+            error.response.status_code >= 500 or error.response.status_code == 429
+        )
+    return isinstance(
+        error,
+        (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+            _ShortRead,
+        ),
+    )
+
+
+def _with_retries(func: Callable[..., T], *args) -> T:
+    import time
+
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except Exception as e:
+            if attempt >= _RETRIES or not _is_transient(e):
+                raise
+            delay = min(_BACKOFF * 2 ** attempt, _MAX_BACKOFF)
+            logging.warning("Transfer error (%s), retrying in %.1fs", e, delay)
+            time.sleep(delay)
+            attempt += 1
+
+
+def _upload_file(session: "requests.Session", url: str, path: str) -> int:
+    def _put() -> int:
+        # Reopen the file on every attempt so that a retry sends it from the start.
+        # Passing a file object makes requests stream it in chunks instead of
+        # loading it into memory.
+        with open(path, "rb") as f:
+            response = session.put(url, data=f, verify=verify(url), timeout=_TIMEOUT)
+            response.raise_for_status()
+            return os.fstat(f.fileno()).st_size
+
+    return _with_retries(_put)
+
+
+def upload_object(object_id: str, urls: ObjectUrls) -> Dict[str, float]:
+    """
+    Upload an object's files from the engine's storage.
+
+    :param object_id: Object ID
+    :param urls: Pre-signed PUT URLs for the object file, its footer and its schema
+    :return: Dictionary with the number of uploaded bytes and the time the upload took.
+    """
+    import time
+
     object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
 
-    for suffix, url in zip(("", ".footer", ".schema"), urls):
-        with open(object_path + suffix, "rb") as f:
-            response = requests.put(url, data=f, verify=verify(url))
+    start = time.time()
+    total = 0
+    session = _get_session()
+    for suffix, url in zip(_OBJECT_SUFFIXES, urls):
+        total += _upload_file(session, url, object_path + suffix)
+    return {"bytes": total, "seconds": time.time() - start}
+
+
+def _download_range(
+    session: "requests.Session", url: str, path: str, start: int, end: Optional[int]
+) -> Optional[int]:
+    """
+    Download a byte range of a file into the same range of a local file, resuming
+    from the last received byte after transient errors.
+
+    :param start: First byte of the range
+    :param end: Last byte of the range (inclusive). If None, download until the end of
+        the file.
+    :return: Size of the whole remote file or None if the server sent the whole file back
+        instead of the range.
+    """
+    position = start
+
+    def _get() -> Optional[int]:
+        nonlocal position
+        range_header = "bytes=%d-%s" % (position, "" if end is None else end)
+        with session.get(
+            url, headers={"Range": range_header}, stream=True, verify=verify(url), timeout=_TIMEOUT
+        ) as response:
+            if response.status_code == 416 and position == 0:
+                # Range requests for empty files can't be satisfied.
+                return 0
             response.raise_for_status()
 
+            if response.status_code == 206:
+                # Content-Range: bytes <first>-<last>/<size>
+                size = int(response.headers["Content-Range"].split("/")[-1])
+            elif start == 0:
+                position = 0
+                size = None
+            else:
+                raise ValueError("Server doesn't support range requests for %s" % url)
+
+            with open(path, "r+b") as f:
+                f.seek(position)
+                for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+                    f.write(chunk)
+                    position += len(chunk)
+                if size is None:
+                    # Whole file sent back: truncate anything from a previous attempt.
+                    f.truncate()
+                    return None
 
-def download_object(object_id: str, urls: ObjectUrls):
-    import shutil
+        expected_end = size - 1 if end is None else min(end, size - 1)
+        if position <= expected_end:
+            raise _ShortRead(
+                "Received %d bytes out of %d" % (position - start, expected_end - start + 1)
+            )
+        return size
+
+    return _with_retries(_get)
+
+
+def _download_file(session: "requests.Session", url: str, path: str) -> int:
+    # Create or truncate the file, then fetch its first part: the response tells us
+    # how big the whole file is.
+    with open(path, "wb"):
+        pass
+
+    size = _download_range(session, url, path, 0, _PART_SIZE - 1)
+    if size is None or size <= _PART_SIZE:
+        return os.path.getsize(path)
+
+    # Fetch the rest of the file in parallel ranges, writing each one into its
+    # place in the file.
+    from concurrent.futures import ThreadPoolExecutor
     import requests
 
+    ranges = [(s, min(s + _PART_SIZE, size) - 1) for s in range(_PART_SIZE, size, _PART_SIZE)]
+    workers = max(min(_DOWNLOAD_THREADS, len(ranges)), 1)
+
+    def _download_ranges(worker_ranges: List[Tuple[int, int]]) -> None:
+        # Sessions aren't thread-safe, so every worker downloads its ranges with its own.
+        with requests.Session() as worker_session:
+            for range_start, range_end in worker_ranges:
+                _download_range(worker_session, url, path, range_start, range_end)
+
+    with ThreadPoolExecutor(max_workers=workers) as tpe:
+        list(tpe.map(_download_ranges, [ranges[i::workers] for i in range(workers)]))
+    return size
+
+
+def download_object(object_id: str, urls: ObjectUrls) -> Dict[str, float]:
+    """
+    Download an object's files into the engine's storage.
+
+    The files are downloaded into temporary files first and only renamed into place
+    when all of them have been downloaded, so that :func:`list_objects` and
+    :func:`object_exists` never see an object that's been partially written.
+
+    :param object_id: Object ID
+    :param urls: Pre-signed GET URLs for the object file, its footer and its schema
+    :return: Dictionary with the number of downloaded bytes and the time the download took.
+    """
+    import time
+
     object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
-    for suffix, url in zip(("", ".footer", ".schema"), urls):
-        with requests.get(url, stream=True, verify=verify(url)) as response:
-            response.raise_for_status()
-            with open(object_path + suffix, "wb") as f:
-                shutil.copyfileobj(response.raw, f)
+    paths = [object_path + suffix for suffix in _OBJECT_SUFFIXES]
+
+    start = time.time()
+    total = 0
+    try:
+        session = _get_session()
+        for path, url in zip(paths, urls):
+            total += _download_file(session, url, path + _TMP_SUFFIX)
+        # Move the schema last since it's what makes the object visible to list_objects.
+        for path in paths:
+            os.replace(path + _TMP_SUFFIX, path)
+    finally:
+        for path in paths:
+            _remove(path + _TMP_SUFFIX)
+    return {"bytes": total, "seconds": time.time() - start}
 
 
 def set_object_schema(object_id: str, schema: str):
@@ -76,6 +281,66 @@ def delete_object_files(object_id: str):
     _remove(object_path + ".schema")
 
 
+def discard_object_files(object_id: str):
+    """
+    Move an object's files out of the way without deleting them. Renaming is cheap, so this
+    can be done whilst holding the cache lock. The object stops being visible to
+    :func:`list_objects` and :func:`object_exists` straight away. Its files are deleted
+    by :func:`purge_discarded_files` once the transaction that discarded it has committed
+    or moved back by :func:`restore_discarded_files` if it's been rolled back.
+    """
+    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+    # Move the schema first since it's what makes the object visible to list_objects.
+    for suffix in reversed(_OBJECT_SUFFIXES):
+        try:
+            os.replace(object_path + suffix, object_path + suffix + _DISCARDED_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+
+def restore_discarded_files(object_id: str):
+    """
+    Move files of an object discarded by :func:`discard_object_files` back in place.
+    """
+    object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+    # Move the schema last so that the object only becomes visible when it's complete.
+    for suffix in _OBJECT_SUFFIXES:
+        try:
+            os.replace(object_path + suffix + _DISCARDED_SUFFIX, object_path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def list_discarded_objects() -> List[str]:
+    """
+    List objects that have files discarded by :func:`discard_object_files`.
+    """
+    return sorted(
+        {
+            f.split(".")[0]
+            for f in os.listdir(SG_ENGINE_OBJECT_PATH)
+            if f.endswith(_DISCARDED_SUFFIX)
+        }
+    )
+
+
+def purge_discarded_files(object_ids: List[str]) -> int:
+    """
+    Delete files of objects discarded by :func:`discard_object_files`.
+
+    :param object_ids: Objects to delete the discarded files of.
+    :return: Number of deleted files.
+    """
+    deleted = 0
+    for object_id in object_ids:
+        object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
+        for suffix in _OBJECT_SUFFIXES:
+            if os.path.exists(object_path + suffix + _DISCARDED_SUFFIX):
+                _remove(object_path + suffix + _DISCARDED_SUFFIX)
+                deleted += 1
+    return deleted
+
+
 def get_object_size(object_id: str) -> int:
     object_path = os.path.join(SG_ENGINE_OBJECT_PATH, object_id)
     return (
@@ -94,6 +359,8 @@ def list_objects() -> List[str]:
     # Make sure to only return objects that have been fully downloaded.
     objects = defaultdict(list)
     for f in files:
+        if f.endswith(_TMP_SUFFIX) or f.endswith(_DISCARDED_SUFFIX):
+            continue
         objects[f.replace(".schema", "").replace(".footer", "")].append(f)
 
     return [f for f, fs in objects.items() if len(fs) == 3]
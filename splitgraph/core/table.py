@@ -1,14 +1,23 @@
 """Table metadata-related classes."""
 import itertools
+import json
 import logging
+import os
+import tempfile
 import threading
-from contextlib import contextmanager
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from copy import deepcopy
+from hashlib import sha256
 from math import ceil
 from typing import (
     Any,
     Callable,
     Iterator,
     List,
+    NamedTuple,
     Optional,
     Tuple,
     TYPE_CHECKING,
@@ -20,8 +29,20 @@ from typing import (
 from psycopg2.sql import SQL, Identifier, Composable
 from tqdm import tqdm
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
-from splitgraph.core.common import Tracer
+from splitgraph.config import (
+    CONFIG,
+    SPLITGRAPH_META_SCHEMA,
+    SPLITGRAPH_API_SCHEMA,
+    SG_CMD_ASCII,
+    get_singleton,
+)
+from splitgraph.core.common import Tracer, CallbackList
+from splitgraph.core.diff import (
+    drop_fragment_keys,
+    filter_overlapping_fragments,
+    fragment_rows_query,
+    load_fragment_keys,
+)
 from splitgraph.core.output import pluralise, truncate_list
 from splitgraph.core.fragment_manager import (
     get_temporary_table_id,
@@ -32,7 +53,8 @@ from splitgraph.core.indexing.range import quals_to_sql
 from splitgraph.core.sql import select
 from splitgraph.core.types import TableSchema, Quals
 from splitgraph.engine import ResultShape
-from splitgraph.exceptions import ObjectIndexingError
+from splitgraph.engine.postgres.engine import SG_UD_FLAG, chunk
+from splitgraph.exceptions import ObjectIndexingError, SplitGraphError
 
 if TYPE_CHECKING:
     from splitgraph.core.image import Image
@@ -44,6 +66,18 @@ if TYPE_CHECKING:
 # of initializing a batch of object applications and not reporting anything at all
 _PROGRESS_EVERY = 5 * 1024 * 1024
 
+# Types whose values survive being stored in the JSON range index without losing precision,
+# so that the index's min/max can be used as exact bounds on a fragment's PK.
+_EXACT_RANGE_TYPES = (
+    "smallint",
+    "integer",
+    "bigint",
+    "text",
+    "character varying",
+    "date",
+    "timestamp without time zone",
+)
+
 
 def _generate_select_query(
     engine: "PostgresEngine",
@@ -97,6 +131,20 @@ def _delete_temporary_table(engine: "PostgresEngine", schema: str, table: str) -
         conn.close()
 
 
+def _get_prefetch_batches(objects: List[str], max_batch: int) -> List[List[str]]:
+    # Start with a single object so that the first rows are available as soon as it's been
+    # downloaded, then keep doubling the batch size (up to max_batch) so that we don't pay
+    # the overhead of claiming objects in the cache for every single object.
+    batches = []
+    position = 0
+    size = 1
+    while position < len(objects):
+        batches.append(objects[position : position + size])
+        position += size
+        size = min(size * 2, max(max_batch, 1))
+    return batches
+
+
 def _empty_callback(**kwargs) -> None:
     pass
 
@@ -123,13 +171,208 @@ def create_foreign_table(
     return query, args
 
 
+def _normalize_quals(quals: Optional[Quals]) -> Optional[Tuple[Tuple[Tuple[str, str, Any]]]]:
+    """
+    Convert qualifiers in CNF into a canonical form: clauses inside every OR and the ORs
+    themselves are deduplicated and sorted, so that equivalent qualifiers are equal.
+    """
+    if not quals:
+        return None
+
+    def _freeze(value):
+        return tuple(_freeze(v) for v in value) if isinstance(value, list) else value
+
+    clauses = {}
+    for or_quals in quals:
+        clause = {repr(q): q for q in ((q[0], q[1], _freeze(q[2])) for q in or_quals)}
+        clauses[repr(sorted(clause))] = tuple(clause[k] for k in sorted(clause))
+    return cast(Tuple[Tuple[Tuple[str, str, Any]]], tuple(clauses[k] for k in sorted(clauses)))
+
+
+# Version of the cached plan format. It's a part of the plan key, so it has to be bumped
+# whenever the plan gets new fields, otherwise plans that older versions of Splitgraph
+# stored in the cache directory will be picked up.
+_PLAN_FORMAT_VERSION = 2
+
+
+class QueryPlanCache:
+    """
+    Size-bounded LRU cache of query plans (fragments that a query has to scan and
+    how they're grouped).
+
+    A plan only depends on the fragments a table consists of, the table's schema and the
+    qualifiers. Fragments are immutable and their indexes are derived from their contents,
+    so a cached plan stays valid for as long as its fragments exist and can be shared
+    between images, processes and engines.
+
+    Plans are kept in memory and, if `cache_dir` is set, also stored in that directory so that
+    other processes (e.g. new engine backends running the layered querying FDW) can use them.
+    The cache is thread-safe and is shared by all tables in the process.
+    """
+
+    def __init__(self, capacity: int, cache_dir: Optional[str] = None) -> None:
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(
+        engine_key: str,
+        object_ids: Sequence[str],
+        table_schema: TableSchema,
+        quals: Optional[Quals],
+    ) -> str:
+        """
+        :param engine_key: Key of the engine the metadata is stored on
+        :param object_ids: Fragments that the table consists of
+        :param table_schema: Schema of the table
+        :param quals: Qualifiers in CNF form
+        :return: Hex digest that identifies the plan.
+        """
+        return sha256(
+            repr(
+                (
+                    _PLAN_FORMAT_VERSION,
+                    engine_key,
+                    tuple(object_ids),
+                    tuple((c.name, c.pg_type, c.is_pk) for c in table_schema),
+                    _normalize_quals(quals),
+                )
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(cast(str, self.cache_dir), key + ".json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached plan.
+
+        :param key: Plan key (see `get_key`)
+        :return: Dictionary with the plan or None if it's not in the cache.
+        """
+        if self.capacity <= 0:
+            return None
+        with self._lock:
+            plan = self._cache.get(key)
+            if plan is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return plan
+
+        if self.cache_dir:
+            try:
+                path = self._get_path(key)
+                with open(path) as f:
+                    plan = json.load(f)
+                # Mark the plan as recently used.
+                os.utime(path)
+            except (OSError, ValueError):
+                plan = None
+
+        with self._lock:
+            if plan is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._put(key, plan)
+        return plan
+
+    def put(self, key: str, plan: Dict[str, Any]) -> None:
+        """
+        Add a plan to the cache.
+
+        :param key: Plan key (see `get_key`)
+        :param plan: JSON-serializable dictionary with the plan
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._put(key, plan)
+
+        if self.cache_dir:
+            try:
+                self._store(key, plan)
+            except OSError:
+                logging.warning(
+                    "Failed to store the query plan in %s", self.cache_dir, exc_info=True
+                )
+
+    def _put(self, key: str, plan: Dict[str, Any]) -> None:
+        self._cache[key] = plan
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.capacity:
+            self._cache.popitem(last=False)
+
+    def _store(self, key: str, plan: Dict[str, Any]) -> None:
+        cache_dir = cast(str, self.cache_dir)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # Write the plan into a temporary file and rename it so that other processes
+        # never see partially written plans.
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(plan, f)
+            os.replace(tmp_path, self._get_path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # Delete least recently stored plans if there are too many of them.
+        paths = [os.path.join(cache_dir, p) for p in os.listdir(cache_dir) if p.endswith(".json")]
+        if len(paths) > self.capacity:
+            paths.sort(key=lambda p: os.stat(p).st_mtime)
+            for path in paths[: len(paths) - self.capacity]:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def clear(self) -> None:
+        """Drop all plans cached in memory and reset the counters."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        :return: Dictionary with the number of cache hits, misses, the number of
+            plans cached in memory and the cache capacity.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._cache),
+                "capacity": self.capacity,
+            }
+
+
 class QueryPlan:
     """
     Represents the initial query plan (fragments to query) for given columns and
     qualifiers.
     """
 
-    def __init__(self, table: "Table", quals: Optional[Quals], columns: Sequence[str]) -> None:
+    def __init__(
+        self,
+        table: "Table",
+        quals: Optional[Quals],
+        columns: Sequence[str],
+        plan_cache: Optional[QueryPlanCache] = None,
+    ) -> None:
+        """
+        :param table: Table to query
+        :param quals: Qualifiers in CNF form
+        :param columns: List of columns
+        :param plan_cache: If specified, reuse the fragments to query from this cache
+            (and add them to it if they're not there).
+        """
         self.table = table
         self.quals = quals
         self.columns = columns
@@ -139,8 +382,55 @@ class QueryPlan:
 
         self.required_objects = table.objects
         self.tracer.log("resolve_objects")
+
+        cache_key = None
+        cached_plan = None
+        if plan_cache:
+            cache_key = plan_cache.get_key(
+                repr(self.object_manager.metadata_engine),
+                self.required_objects,
+                table.table_schema,
+                quals,
+            )
+            cached_plan = plan_cache.get(cache_key)
+
+        if cached_plan:
+            self.filtered_objects = list(cached_plan["filtered_objects"])
+            self.estimated_rows = cached_plan["estimated_rows"]
+            self.tracer.log("filter_objects")
+            self.non_singletons = list(cached_plan["non_singletons"])
+            self.singletons = list(cached_plan["singletons"])
+            self.non_singleton_groups = [list(g) for g in cached_plan["non_singleton_groups"]]
+            self.tracer.log("group_fragments")
+        else:
+            self._plan_fragments()
+            if plan_cache:
+                plan_cache.put(
+                    cast(str, cache_key),
+                    {
+                        "filtered_objects": self.filtered_objects,
+                        "estimated_rows": self.estimated_rows,
+                        "non_singletons": self.non_singletons,
+                        "singletons": self.singletons,
+                        "non_singleton_groups": self.non_singleton_groups,
+                    },
+                )
+
+        self.sql_quals, self.sql_qual_vals = quals_to_sql(
+            quals, column_types={c.name: c.pg_type for c in self.table.table_schema}
+        )
+
+        if self.singletons:
+            self.singleton_queries = _generate_table_names(
+                self.object_manager.object_engine, SPLITGRAPH_META_SCHEMA, self.singletons
+            )
+        else:
+            self.singleton_queries = []
+        self.tracer.log("generate_singleton_queries")
+
+    def _plan_fragments(self) -> None:
         self.filtered_objects = self.object_manager.filter_fragments(
-            self.required_objects, table, quals
+            self.required_objects, self.table, self.quals
         )
         # Estimate the number of rows in the filtered objects
         self.estimated_rows = sum(
@@ -164,7 +454,11 @@ class QueryPlan:
         # manager and release the objects that we don't need so that they can be garbage
         # collected. The tradeoff is that we perform more calls to apply_fragments (hence
         # more roundtrips).
-        self.non_singletons, self.singletons = self._extract_singleton_fragments()
+        (
+            self.non_singletons,
+            self.singletons,
+            self.non_singleton_groups,
+        ) = self._extract_singleton_fragments()
 
         logging.info(
             "Fragment grouping: %d singletons, %d non-singletons",
@@ -173,19 +467,7 @@ class QueryPlan:
         )
         self.tracer.log("group_fragments")
 
-        self.sql_quals, self.sql_qual_vals = quals_to_sql(
-            quals, column_types={c.name: c.pg_type for c in self.table.table_schema}
-        )
-
-        if self.singletons:
-            self.singleton_queries = _generate_table_names(
-                self.object_manager.object_engine, SPLITGRAPH_META_SCHEMA, self.singletons
-            )
-        else:
-            self.singleton_queries = []
-        self.tracer.log("generate_singleton_queries")
-
-    def _extract_singleton_fragments(self) -> Tuple[List[str], List[str]]:
+    def _extract_singleton_fragments(self) -> Tuple[List[str], List[str], List[List[str]]]:
         # Get fragment boundaries (min-max PKs of every fragment).
         table_pk = [(t[1], t[2]) for t in self.table.table_schema if t[3]]
         if not table_pk:
@@ -200,28 +482,22 @@ class QueryPlan:
         )
         singletons: List[str] = []
         non_singletons: List[str] = []
+        non_singleton_groups: List[List[str]] = []
         for group in object_groups:
             if len(group) == 1:
                 singletons.append(group[0][0])
             else:
-                non_singletons.extend(object_id for object_id, _, _ in group)
-        return non_singletons, singletons
+                non_singleton_groups.append([object_id for object_id, _, _ in group])
+                non_singletons.extend(non_singleton_groups[-1])
+        return non_singletons, singletons, non_singleton_groups
 
 
 QueryPlanCacheKey = Tuple[Optional[Tuple[Tuple[Tuple[str, str, Any]]]], Tuple[str]]
 
 
 def _get_plan_cache_key(quals: Optional[Quals], columns: Sequence[str]) -> QueryPlanCacheKey:
-    quals = (
-        cast(
-            Tuple[Tuple[Tuple[str, str, Any]]],
-            tuple(tuple(tuple(q) for q in qual) for qual in quals),
-        )
-        if quals
-        else None
-    )
     columns = cast(Tuple[str], tuple(columns))
-    return quals, columns
+    return _normalize_quals(quals), columns
 
 
 def merge_index_data(current_index: Dict[str, Any], new_index: Dict[str, Any]):
@@ -235,10 +511,250 @@ def merge_index_data(current_index: Dict[str, Any], new_index: Dict[str, Any]):
             current_index[index_type][col_name] = col_index_data
 
 
+def _get_fragment_groups(
+    repository: "Repository", table_schema: TableSchema, objects: List[str]
+) -> Optional[List[List[str]]]:
+    """
+    Split fragments of a table into groups that don't overlap each other using their
+    PK ranges (see :func:`splitgraph.core.fragment_manager.get_chunk_groups`).
+
+    :return: List of groups of object IDs or None if the fragments' PK ranges couldn't
+        be read from their indexes or compared.
+    """
+    table_pk = [(c.name, c.pg_type) for c in table_schema if c.is_pk]
+    if not table_pk:
+        table_pk = [(c.name, c.pg_type) for c in table_schema]
+    try:
+        object_pks = repository.objects.get_min_max_pks(objects, table_pk)
+        groups = get_chunk_groups(
+            [(o, min_max[0], min_max[1]) for o, min_max in zip(objects, object_pks)]
+        )
+    except (SplitGraphError, TypeError):
+        return None
+    return [[o for o, _, _ in g] for g in groups]
+
+
+def _without_pk(table_schema: TableSchema) -> TableSchema:
+    return [c._replace(is_pk=False) for c in table_schema]
+
+
+def _finish_bulk_load(
+    engine: "PostgresEngine", schema: str, table: str, table_schema: TableSchema
+) -> None:
+    """
+    Add the primary key to a table that was bulk loaded without one and
+    gather planner statistics for it.
+    """
+    pk_cols = [c.name for c in sorted(table_schema) if c.is_pk]
+    if pk_cols:
+        index_workers = int(get_singleton(CONFIG, "SG_INDEX_BUILD_WORKERS"))
+        previous_workers = None
+        if index_workers > 0:
+            previous_workers = engine.run_sql(
+                "SELECT current_setting('max_parallel_maintenance_workers')",
+                return_shape=ResultShape.ONE_ONE,
+            )
+            engine.run_sql("SET LOCAL max_parallel_maintenance_workers = %s", (index_workers,))
+        engine.run_sql(
+            SQL("ALTER TABLE {}.{} ADD PRIMARY KEY (").format(Identifier(schema), Identifier(table))
+            + SQL(",").join(Identifier(c) for c in pk_cols)
+            + SQL(")")
+        )
+        # Restore the setting so that it doesn't affect the rest of the transaction.
+        if previous_workers is not None:
+            engine.run_sql(
+                "SELECT set_config('max_parallel_maintenance_workers', %s, true)",
+                (previous_workers,),
+            )
+    # Unlogged tables aren't picked up by autovacuum, so the planner would have no statistics
+    # for the table otherwise.
+    engine.run_sql(SQL("ANALYZE {}.{}").format(Identifier(schema), Identifier(table)))
+
+
+class _MaterializationJob(NamedTuple):
+    destination_schema: str
+    destination: str
+    table_schema: TableSchema
+    objects: List[str]
+    # If True, none of the objects overlap with any other fragment of the table,
+    # so their rows can be inserted directly.
+    plain_insert: bool
+    # Estimated number of rows in the objects
+    rows: int
+
+
+class ParallelMaterializer:
+    """
+    Materializes tables using multiple connections from the engine's connection pool.
+
+    Fragments of every table are split into groups that don't overlap each other (see
+    :func:`splitgraph.core.fragment_manager.get_chunk_groups`). Groups consisting of a single
+    fragment are loaded with plain ``INSERT ... SELECT`` statements, since no other fragment
+    can change their rows. Fragments in other groups are applied in order with `apply_fragments`.
+    Groups of all tables are loaded concurrently, each on a separate connection and in
+    its own transaction.
+
+    Tables that only consist of singleton groups are bulk loaded: they're created without
+    a primary key, which is added once all fragments have been loaded.
+
+    Since the tables have to be created and committed before the workers can load them,
+    materialization isn't atomic.
+    """
+
+    def __init__(self, repository: "Repository", workers: int) -> None:
+        """
+        :param repository: Repository the tables belong to
+        :param workers: Number of connections to use. Capped by the size of the engine's
+            connection pool (SG_ENGINE_POOL), leaving one connection for the main thread.
+        """
+        self.repository = repository
+        self.workers = max(min(workers, int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1), 1)
+        # Number of rows loaded and seconds spent by every worker
+        self.stats: Dict[str, Tuple[int, float]] = {}
+        self._lock = threading.Lock()
+
+    def materialize(
+        self, tables: Sequence[Tuple["Table", str]], destination_schema: Optional[str] = None
+    ) -> None:
+        """
+        Materialize multiple tables.
+
+        :param tables: List of (Table, name of the destination table).
+        :param destination_schema: Name of the destination schema.
+        """
+        destination_schema = destination_schema or self.repository.to_schema()
+        engine = self.repository.object_engine
+
+        with ExitStack() as stack:
+            jobs: List[_MaterializationJob] = []
+            bulk_loaded: List[Tuple[str, TableSchema]] = []
+            for table, destination in tables:
+                required_objects = cast(
+                    List[str],
+                    stack.enter_context(
+                        self.repository.objects.ensure_objects(table=table, objects=table.objects)
+                    ),
+                )
+                table_jobs = self._plan(table, required_objects, destination_schema, destination)
+                bulk_load = bool(table_jobs) and all(j.plain_insert for j in table_jobs)
+                engine.delete_table(destination_schema, destination)
+                engine.create_table(
+                    schema=destination_schema,
+                    table=destination,
+                    schema_spec=(
+                        _without_pk(table.table_schema) if bulk_load else table.table_schema
+                    ),
+                    include_comments=True,
+                    unlogged=True,
+                )
+                if bulk_load:
+                    bulk_loaded.append((destination, table.table_schema))
+                jobs.extend(table_jobs)
+
+            # Workers can only see the tables once they've been committed.
+            engine.commit()
+            if not jobs:
+                return
+
+            # Start with the largest jobs to spread the load between workers evenly.
+            jobs = sorted(jobs, key=lambda j: j.rows, reverse=True)
+            logging.info(
+                "Materializing %s using %d workers (%s)",
+                pluralise("table", len(tables)),
+                self.workers,
+                pluralise("job", len(jobs)),
+            )
+            try:
+                with ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="sg_materialize"
+                ) as tpe:
+                    list(tpe.map(self._run_job, jobs))
+            finally:
+                engine.close_others()
+
+            for destination, table_schema in bulk_loaded:
+                _finish_bulk_load(engine, destination_schema, destination, table_schema)
+
+        for worker, (rows, elapsed) in sorted(self.stats.items()):
+            logging.info(
+                "%s: %d rows in %.2fs (%.0f rows/s)",
+                worker,
+                rows,
+                elapsed,
+                rows / elapsed if elapsed else 0,
+            )
+
+    def _plan(
+        self, table: "Table", objects: List[str], destination_schema: str, destination: str
+    ) -> List[_MaterializationJob]:
+        if not objects:
+            return []
+        object_manager = self.repository.objects
+        rows = {o: m.rows_inserted for o, m in object_manager.get_object_meta(objects).items()}
+
+        def _job(group: List[str], plain_insert: bool) -> _MaterializationJob:
+            return _MaterializationJob(
+                destination_schema,
+                destination,
+                table.table_schema,
+                group,
+                plain_insert,
+                sum(rows.get(o, 0) for o in group),
+            )
+
+        groups = _get_fragment_groups(self.repository, table.table_schema, objects)
+        if groups is None:
+            # No index or PK ranges that can't be compared: apply all fragments in order.
+            logging.warning("Can't group fragments of %s, applying them serially", table.table_name)
+            return [_job(objects, False)]
+
+        singletons = [g[0] for g in groups if len(g) == 1]
+        jobs = [_job(g, False) for g in groups if len(g) > 1]
+        if singletons:
+            # Split singletons into batches so that all workers can load them.
+            batch_size = int(ceil(len(singletons) / float(self.workers)))
+            jobs.extend(_job(b, True) for b in chunk(singletons, chunk_size=batch_size))
+        logging.debug(
+            "%s: %d singleton fragment(s), %d overlapping group(s)",
+            table.table_name,
+            len(singletons),
+            len(groups) - len(singletons),
+        )
+        return jobs
+
+    def _run_job(self, job: _MaterializationJob) -> None:
+        engine = self.repository.object_engine.clone()
+        started = time.time()
+        try:
+            engine.apply_fragments(
+                [(SPLITGRAPH_META_SCHEMA, o) for o in job.objects],
+                job.destination_schema,
+                job.destination,
+                schema_spec=job.table_schema,
+                insert_only=job.plain_insert,
+            )
+            engine.commit()
+        except Exception:
+            engine.rollback()
+            raise
+        elapsed = time.time() - started
+
+        worker = threading.current_thread().name
+        with self._lock:
+            rows, total_elapsed = self.stats.get(worker, (0, 0.0))
+            self.stats[worker] = (rows + job.rows, total_elapsed + elapsed)
+
+
 class Table:
     """Represents a Splitgraph table in a given image. Shouldn't be created directly, use Table-loading
     methods in the :class:`splitgraph.core.image.Image` class instead."""
 
+    # Process-wide cache of query plans (see QueryPlanCache)
+    query_plan_cache = QueryPlanCache(
+        int(get_singleton(CONFIG, "SG_QUERY_PLAN_CACHE_SIZE")),
+        get_singleton(CONFIG, "SG_QUERY_PLAN_CACHE_DIR") or None,
+    )
+
     def __init__(
         self,
         repository: "Repository",
@@ -270,6 +786,8 @@ class Table:
         :param quals: Qualifiers in CNF form
         :param columns: List of columns
         :param use_cache: If True, will fetch the plan from the cache for the same qualifiers and columns.
+            Equivalent qualifiers (e.g. with clauses in a different order) use the same plan.
+            Plans are also shared between tables with the same fragments, see `QueryPlanCache`.
         :return: QueryPlan
         """
         key = _get_plan_cache_key(quals, columns)
@@ -286,7 +804,9 @@ class Table:
             plan.tracer.log("generate_singleton_queries")
             return plan
 
-        plan = QueryPlan(self, quals, columns)
+        plan = QueryPlan(
+            self, quals, columns, plan_cache=self.query_plan_cache if use_cache else None
+        )
         self._query_plans[key] = plan
         return plan
 
@@ -314,10 +834,19 @@ class Table:
             with object_manager.ensure_objects(
                 table=self, objects=self.objects
             ) as required_objects:
+                # If none of the fragments overlap, their rows can be inserted into a table
+                # without a primary key, which is then built in one go at the end.
+                groups = (
+                    _get_fragment_groups(self.repository, self.table_schema, required_objects)
+                    if required_objects
+                    else None
+                )
+                bulk_load = groups is not None and all(len(g) == 1 for g in groups)
+
                 engine.create_table(
                     schema=destination_schema,
                     table=destination,
-                    schema_spec=self.table_schema,
+                    schema_spec=_without_pk(self.table_schema) if bulk_load else self.table_schema,
                     include_comments=True,
                     unlogged=True,
                 )
@@ -338,8 +867,14 @@ class Table:
                         [(SPLITGRAPH_META_SCHEMA, d) for d in cast(List[str], required_objects)],
                         destination_schema,
                         destination,
+                        schema_spec=self.table_schema,
                         progress_every=progress_every,
+                        insert_only=bulk_load,
                     )
+                    if bulk_load:
+                        _finish_bulk_load(
+                            engine, destination_schema, destination, self.table_schema
+                        )
         else:
             query, args = create_foreign_table(
                 destination_schema, lq_server, self.table_name, self.table_schema
@@ -347,8 +882,222 @@ class Table:
 
             engine.run_sql(query, args)
 
+    def create_fragment_view(
+        self, destination: str, destination_schema: Optional[str] = None
+    ) -> bool:
+        """
+        Create a view that reads this table's fragments directly from their tables in
+        splitgraph_meta, letting Postgres plan queries against them itself instead of
+        going through the layered querying FDW.
+
+        This only works if none of the fragments overlap, since the view is a ``UNION ALL``
+        of their rows. If the table has a single-column PK, every branch of the view is
+        also bounded by its fragment's PK range, so that with ``constraint_exclusion = on``,
+        Postgres skips fragments that can't match a query. Text ranges are compared with
+        ``COLLATE "C"``, like in the range index, so only queries that use that collation
+        can skip fragments by a text PK.
+
+        The fragments are downloaded and stay claimed (can't be evicted from the cache) until
+        the view is dropped (see `ObjectManager.release_fragment_views`). The view is read-only
+        (PostgreSQL can't write into a ``UNION ALL`` view), so it doesn't get audit triggers and
+        commits link the table to the same fragments.
+
+        :param destination: Name of the view.
+        :param destination_schema: Name of the destination schema.
+        :return: True if the view was created, False if the fragments overlap or couldn't be
+            downloaded and the table has to be queried through the FDW.
+        """
+        destination_schema = destination_schema or self.repository.to_schema()
+        engine = self.repository.object_engine
+        object_manager = self.repository.objects
+
+        if not self.objects:
+            return False
+        if len(self.objects) > 1:
+            groups = _get_fragment_groups(self.repository, self.table_schema, self.objects)
+            if groups is None or any(len(g) > 1 for g in groups):
+                return False
+
+        try:
+            with object_manager.ensure_objects(
+                table=self, objects=self.objects, defer_release=True
+            ) as (required_objects, release_callback):
+                pass
+        except SplitGraphError as e:
+            logging.warning(
+                "Couldn't download fragments of %s, using layered querying instead: %s",
+                self.table_name,
+                e,
+            )
+            return False
+
+        table_schema = sorted(self.table_schema)
+        pk = [c for c in table_schema if c.is_pk]
+        bound_column = pk[0] if len(pk) == 1 and pk[0].pg_type in _EXACT_RANGE_TYPES else None
+        object_meta = object_manager.get_object_meta(required_objects) if bound_column else {}
+
+        columns = SQL(",").join(Identifier(c.name) for c in table_schema)
+        branches = []
+        args: List[Any] = []
+        for object_id in required_objects:
+            branch = (
+                SQL("SELECT ")
+                + columns
+                + SQL(" FROM {}.{} WHERE {} = true").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA),
+                    Identifier(object_id),
+                    Identifier(SG_UD_FLAG),
+                )
+            )
+            if bound_column and object_id in object_meta:
+                pk_range = (
+                    (object_meta[object_id].object_index or {})
+                    .get("range", {})
+                    .get(bound_column.name)
+                )
+                if pk_range and pk_range[0] is not None and pk_range[1] is not None:
+                    bound = SQL("{}").format(Identifier(bound_column.name))
+                    # The range index computes text ranges in the C collation (see
+                    # splitgraph.core.indexing.range), which can differ from the
+                    # engine's default one.
+                    if bound_column.pg_type in ("text", "character varying"):
+                        bound += SQL(' COLLATE "C"')
+                    cast_to = SQL("::" + bound_column.pg_type)
+                    branch += SQL(" AND ") + bound + SQL(" >= %s") + cast_to
+                    branch += SQL(" AND ") + bound + SQL(" <= %s") + cast_to
+                    args.extend(pk_range)
+            branches.append(branch)
+        if len(branches) == 1:
+            # A view over a single table would be automatically updatable, letting writes
+            # through to the fragment. Views with UNION ALL aren't, and PostgreSQL removes
+            # this branch when planning queries.
+            branches.append(
+                SQL("SELECT ")
+                + SQL(",").join(SQL("NULL::" + c.pg_type) for c in table_schema)
+                + SQL(" WHERE false")
+            )
+
+        query = SQL("CREATE VIEW {}.{} AS ").format(
+            Identifier(destination_schema), Identifier(destination)
+        ) + SQL(" UNION ALL ").join(branches)
+        for column in table_schema:
+            if column.comment:
+                query += SQL(";COMMENT ON COLUMN {}.{}.{} IS %s").format(
+                    Identifier(destination_schema), Identifier(destination), Identifier(column.name)
+                )
+                args.append(column.comment)
+
+        try:
+            engine.run_sql(query, args)
+            object_manager.register_fragment_view(destination_schema, destination, required_objects)
+        except Exception:
+            engine.rollback()
+            release_callback()
+            raise
+        return True
+
+    def materialize_from(
+        self, old_table: "Table", destination: str, destination_schema: Optional[str] = None
+    ) -> bool:
+        """
+        Turn a materialized copy of another version of this table into this version by only
+        applying the fragments that differ between the two versions.
+
+        This works if the list of fragments of this table extends the old table's list or if
+        the two lists share a prefix that's longer than the part of the old list after it.
+        In the latter case, rows whose PKs are mentioned by the old table's fragments after
+        the prefix are reconstructed from the shared fragments first.
+
+        :param old_table: Version of the table that the destination table was materialized from.
+            The destination table mustn't have been changed since.
+        :param destination: Name of the destination table.
+        :param destination_schema: Name of the destination schema.
+        :return: True if the table was updated, False if it has to be materialized from scratch.
+        """
+        destination_schema = destination_schema or self.repository.to_schema()
+        engine = self.repository.object_engine
+
+        if (
+            old_table.table_schema != self.table_schema
+            or engine.get_table_type(destination_schema, destination) != "BASE TABLE"
+            or [(c.name, c.pg_type, c.is_pk) for c in self.table_schema]
+            != [
+                (c.name, c.pg_type, c.is_pk)
+                for c in engine.get_full_table_schema(destination_schema, destination)
+            ]
+        ):
+            return False
+
+        prefix = 0
+        for old_object, new_object in zip(old_table.objects, self.objects):
+            if old_object != new_object:
+                break
+            prefix += 1
+        to_revert = old_table.objects[prefix:]
+        to_apply = self.objects[prefix:]
+        if to_revert and (
+            not prefix or len(to_revert) > prefix or not any(c.is_pk for c in self.table_schema)
+        ):
+            return False
+
+        # Don't record the changes we're about to make as pending changes.
+        engine.untrack_tables([(destination_schema, destination)])
+        if not to_revert and not to_apply:
+            return True
+
+        to_rebuild = filter_overlapping_fragments(
+            self.repository, self, self.objects[:prefix], to_revert
+        )
+        logging.info(
+            "Updating %s: reverting %s and applying %s",
+            destination,
+            pluralise("fragment", len(to_revert)),
+            pluralise("fragment", len(to_apply)),
+        )
+        with self.repository.objects.ensure_objects(
+            table=self, objects=list(dict.fromkeys(to_revert + to_rebuild + to_apply))
+        ):
+            if to_revert:
+                # Delete rows that the old fragments mention and rebuild them
+                # from the fragments that come before them.
+                pks = [c.name for c in self.table_schema if c.is_pk]
+                keys_table = load_fragment_keys(engine, to_revert, self.table_schema)
+                try:
+                    engine.run_sql(
+                        SQL("DELETE FROM {}.{} WHERE (").format(
+                            Identifier(destination_schema), Identifier(destination)
+                        )
+                        + SQL(",").join(Identifier(c) for c in pks)
+                        + SQL(") IN (SELECT ")
+                        + SQL(",").join(Identifier(c) for c in pks)
+                        + SQL(" FROM pg_temp.{})").format(Identifier(keys_table))
+                    )
+                    engine.run_sql(
+                        SQL("INSERT INTO {}.{} (").format(
+                            Identifier(destination_schema), Identifier(destination)
+                        )
+                        + SQL(",").join(Identifier(c.name) for c in self.table_schema)
+                        + SQL(") ")
+                        + fragment_rows_query(
+                            to_rebuild, self.table_schema, keys_table, for_comparison=False
+                        )
+                    )
+                finally:
+                    drop_fragment_keys(engine, keys_table)
+            engine.apply_fragments(
+                [(SPLITGRAPH_META_SCHEMA, o) for o in to_apply],
+                destination_schema,
+                destination,
+                schema_spec=self.table_schema,
+            )
+        return True
+
     def query_indirect(
-        self, columns: List[str], quals: Optional[Quals]
+        self,
+        columns: List[str],
+        quals: Optional[Quals],
+        incremental: bool = False,
+        prefetch: bool = False,
     ) -> Tuple[Iterator[bytes], Callable, QueryPlan]:
         """
         Run a read-only query against this table without materializing it. Instead of
@@ -365,6 +1114,16 @@ class Table:
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param incremental: If True, materialize delta-compressed fragments one group of
+            overlapping fragments at a time, reusing the same staging table, instead of
+            materializing all of them at once. This bounds the size of the staging table and
+            the time until the first materialized rows are available, but the caller has to
+            be done reading from the returned table (and not hold any locks on it) before
+            getting the next query from the generator.
+        :param prefetch: If True, instead of waiting until all required objects have been
+            downloaded, start returning queries to singleton fragments as soon as they're
+            in the cache and download the rest of the objects in the background, in the
+            order they're queried in (in batches of up to `SG_LQ_PREFETCH_BATCH` objects).
         :return: Generator of queries (bytes), a callback and a query plan object (containing stats
             that are fully populated after the callback has been called to end the query).
         """
@@ -379,25 +1138,16 @@ class Table:
             return cast(Iterator[bytes], []), cast(Callable, _empty_callback), plan
 
         object_manager = self.repository.objects
-        if not plan.non_singletons:
+        if not plan.non_singletons and not prefetch:
             with object_manager.ensure_objects(
                 self, objects=required_objects, defer_release=True, tracer=plan.tracer
             ) as eo_result:
                 _, release_callback = cast(Tuple, eo_result)
                 return iter(plan.singleton_queries), cast(Callable, release_callback), plan
 
-        def _generate_nonsingleton_query():
-            # If we have fragments that need applying to a staging area, we don't want to
-            # do it immediately: the caller might be satisfied with the data they got from
-            # the queries to singleton fragments. So here we have a callback that, when called,
-            # actually materializes the chunks into a temporary table and then changes
-            # the table's release callback to also delete that temporary table.
-
-            # There's a slight issue: we can't use temporary tables if we're returning
-            # pointers to tables since the caller might be in a different session.
-            staging_table = self._create_staging_table()
-            engine = self.repository.object_engine
+        engine = self.repository.object_engine
 
+        def _make_staging_table_callback(staging_table):
             def _f(from_fdw=False):
                 # This is very horrible but the way we share responsibilities between ourselves
                 # and Multicorn leaves us no other choice. In LQ, this is supposed to be called
@@ -426,13 +1176,13 @@ class Table:
                 else:
                     engine.delete_table(SPLITGRAPH_META_SCHEMA, staging_table)
 
-            nonlocal release_callback
-            release_callback.append(_f)
+            return _f
 
+        def _apply_fragments(objects, staging_table):
             # Apply the fragments (just the parts that match the qualifiers) to the staging area
             if quals:
                 engine.apply_fragments(
-                    [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singletons],
+                    [(SPLITGRAPH_META_SCHEMA, o) for o in objects],
                     SPLITGRAPH_META_SCHEMA,
                     staging_table,
                     extra_quals=plan.sql_quals,
@@ -441,15 +1191,108 @@ class Table:
                 )
             else:
                 engine.apply_fragments(
-                    [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singletons],
+                    [(SPLITGRAPH_META_SCHEMA, o) for o in objects],
                     SPLITGRAPH_META_SCHEMA,
                     staging_table,
                     schema_spec=self.table_schema,
                 )
             engine.commit()
+
+        def _generate_nonsingleton_query():
+            # If we have fragments that need applying to a staging area, we don't want to
+            # do it immediately: the caller might be satisfied with the data they got from
+            # the queries to singleton fragments. So here we have a callback that, when called,
+            # actually materializes the chunks into a temporary table and then changes
+            # the table's release callback to also delete that temporary table.
+
+            # There's a slight issue: we can't use temporary tables if we're returning
+            # pointers to tables since the caller might be in a different session.
+            staging_table = self._create_staging_table()
+
+            nonlocal release_callback
+            release_callback.append(_make_staging_table_callback(staging_table))
+
+            _apply_fragments(plan.non_singletons, staging_table)
             table_name = _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, [staging_table])[0]
             yield table_name
 
+        def _generate_incremental_nonsingleton_queries():
+            # Same as above, but materialize one group of overlapping fragments at a time,
+            # reusing the staging table. Groups don't overlap each other, so every row
+            # only comes from one group. Since we only get here once the caller has consumed
+            # the previous query, we can clear the staging table and release the previous
+            # group's objects back to the cache.
+            staging_table = self._create_staging_table()
+
+            nonlocal release_callback
+            release_callback.append(_make_staging_table_callback(staging_table))
+
+            table_name = _generate_table_names(engine, SPLITGRAPH_META_SCHEMA, [staging_table])[0]
+            for i, group in enumerate(plan.non_singleton_groups):
+                with object_manager.ensure_objects(self, objects=group, tracer=plan.tracer):
+                    if i > 0:
+                        engine.run_sql(
+                            SQL("TRUNCATE TABLE {}.{}").format(
+                                Identifier(SPLITGRAPH_META_SCHEMA), Identifier(staging_table)
+                            )
+                        )
+                    _apply_fragments(group, staging_table)
+                logging.info(
+                    "Materialized fragment group %d/%d (%s)",
+                    i + 1,
+                    len(plan.non_singleton_groups),
+                    pluralise("fragment", len(group)),
+                )
+                yield table_name
+
+        def _generate_prefetched_queries():
+            # Claim singletons in batches in the order we query them in. Non-singletons
+            # get claimed in the last batch, unless they're materialized incrementally
+            # (then every group is claimed right before it's materialized).
+            batches = _get_prefetch_batches(
+                plan.singletons, int(get_singleton(CONFIG, "SG_LQ_PREFETCH_BATCH"))
+            )
+            singleton_batches = len(batches)
+            if plan.non_singletons and not incremental:
+                batches.append(plan.non_singletons)
+
+            position = 0
+            for i, batch in enumerate(
+                object_manager.ensure_objects_ahead(
+                    self, batches, release_callback, tracer=plan.tracer
+                )
+            ):
+                if i < singleton_batches:
+                    yield from plan.singleton_queries[position : position + len(batch)]
+                    position += len(batch)
+                else:
+                    yield from _generate_nonsingleton_query()
+            if plan.non_singletons and incremental:
+                yield from _generate_incremental_nonsingleton_queries()
+
+        if prefetch:
+            release_callback = CallbackList()
+            return (
+                _generate_prefetched_queries(),
+                cast(Callable, release_callback),
+                plan,
+            )
+
+        if incremental:
+            # Only claim singletons upfront: every group of non-singletons is claimed (and
+            # downloaded, if needed) right before it's materialized.
+            with object_manager.ensure_objects(
+                self, objects=plan.singletons, defer_release=True, tracer=plan.tracer
+            ) as eo_result:
+                _, release_callback = cast(Tuple, eo_result)
+                return (
+                    itertools.chain(
+                        plan.singleton_queries, _generate_incremental_nonsingleton_queries()
+                    ),
+                    cast(Callable, release_callback),
+                    plan,
+                )
+
         with object_manager.ensure_objects(
             self, objects=required_objects, defer_release=True, tracer=plan.tracer
         ) as eo_result:
@@ -461,17 +1304,25 @@ class Table:
             )
 
     @contextmanager
-    def query_lazy(self, columns: List[str], quals: Quals) -> Iterator[Iterator[Dict[str, Any]]]:
+    def query_lazy(
+        self, columns: List[str], quals: Quals, incremental: bool = False, prefetch: bool = False
+    ) -> Iterator[Iterator[Dict[str, Any]]]:
         """
         Run a read-only query against this table without materializing it.
 
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param incremental: Materialize delta-compressed fragments one group at a time
+            (see `query_indirect`).
+        :param prefetch: Start returning results before all objects have been downloaded
+            (see `query_indirect`).
         :return: Generator of dictionaries of results.
         """
 
-        table_gen, release_callback, plan = self.query_indirect(columns, quals)
+        table_gen, release_callback, plan = self.query_indirect(
+            columns, quals, incremental, prefetch
+        )
         engine = self.repository.object_engine
 
         def _generate_results():
@@ -489,7 +1340,9 @@ class Table:
         finally:
             release_callback()
 
-    def query(self, columns: List[str], quals: Quals):
+    def query(
+        self, columns: List[str], quals: Quals, incremental: bool = False, prefetch: bool = False
+    ):
         """
         Run a read-only query against this table without materializing it.
 
@@ -499,9 +1352,13 @@ class Table:
         :param columns: List of columns from this table to fetch
         :param quals: List of qualifiers in conjunctive normal form. See the documentation for
             FragmentManager.filter_fragments for the actual format.
+        :param incremental: Materialize delta-compressed fragments one group at a time
+            (see `query_indirect`).
+        :param prefetch: Download objects in the background whilst querying the ones that
+            have already been downloaded (see `query_indirect`).
         :return: List of dictionaries of results
         """
-        with self.query_lazy(columns, quals) as result:
+        with self.query_lazy(columns, quals, incremental, prefetch) as result:
             return list(result)
 
     def get_size(self) -> int:
@@ -588,14 +1445,18 @@ class Table:
         # Download the objects to reindex them
         with object_manager.ensure_objects(self, objects=list(valid_objects)):
             for object_id in tqdm(valid_objects, unit="objs", ascii=SG_CMD_ASCII):
-                current_index = valid_objects[object_id].object_index
+                # Copy the index since the object metadata is shared with the metadata cache.
+                current_index = deepcopy(valid_objects[object_id].object_index)
 
                 index_struct = object_manager.generate_object_index(
                     object_id, self.table_schema, changeset=None, extra_indexes=extra_indexes
                 )
 
-                # Update the index in-place and overwrite it
+                # Update the index and overwrite it
                 merge_index_data(current_index, index_struct)
+                valid_objects[object_id] = valid_objects[object_id]._replace(
+                    object_index=current_index
+                )
 
         object_manager.register_objects(list(valid_objects.values()))
         return list(valid_objects)
@@ -435,11 +435,13 @@ class ChangeEngine(SQLEngine, ABC):
         """
         raise NotImplementedError()
 
-    def track_tables(self, tables):
+    def track_tables(self, tables, statement_level=False):
         """
         Start engine-specific change tracking on a list of tables.
 
         :param tables: List of (table_schema, table_name) to start tracking
+        :param statement_level: Track changes with statement-level triggers (that log all
+            rows changed by a statement in bulk) instead of row-level ones.
         """
         raise NotImplementedError()
 
@@ -478,6 +480,17 @@ class ChangeEngine(SQLEngine, ABC):
         """
         raise NotImplementedError()
 
+    def get_conflated_changes(self, schema, table, batch_size=10000):
+        """
+        Return pending changes for a given tracked table, conflated on the engine
+
+        :param schema: Schema the table belongs to
+        :param table: Table to return changes for
+        :param batch_size: Number of changes to fetch from the engine at a time
+        :return: Iterator of lists of `(pk, upserted, old_row, new_row)`
+        """
+        raise NotImplementedError()
+
     def get_changed_tables(self, schema):
         """
         List tracked tables that have pending changes
@@ -521,6 +534,25 @@ class ObjectEngine:
         :param object_ids: IDs of objects to delete
         """
 
+    def discard_objects(self, object_ids):
+        """
+        Make one or more objects unavailable without deleting their data straight away.
+        The data is deleted by `purge_discarded_objects` after the transaction commits, so
+        that this can be done later on, e.g. outside of a critical section. If the transaction
+        is rolled back, the objects are restored.
+
+        :param object_ids: IDs of objects to discard
+        """
+
+    def purge_discarded_objects(self, object_ids=None):
+        """
+        Delete the data of objects that were discarded with `discard_objects`.
+
+        :param object_ids: IDs of objects to purge. By default, purges objects discarded
+            by this engine in transactions that have since been committed.
+        :return: Number of deleted files
+        """
+
     def store_fragment(self, inserted, deleted, schema, table, source_schema, source_table):
         """
         Store a fragment of a changed table in another table
@@ -543,6 +575,7 @@ class ObjectEngine:
         extra_qual_args=None,
         schema_spec=None,
         progress_every: Optional[int] = None,
+        insert_only: bool = False,
     ):
         """
         Apply multiple fragments to a target table as a single-query batch operation.
@@ -557,6 +590,9 @@ class ObjectEngine:
             If not specified, uses the schema of target_table.
         :param progress_every: If set, will report the materialization progress via
             tqdm every `progress_every` objects.
+        :param insert_only: Only insert new rows from the fragments without deleting the rows
+            they replace. Only valid if the fragments don't overlap with each other or with
+            the rows in the target table.
         """
         raise NotImplementedError()
 
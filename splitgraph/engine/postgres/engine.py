@@ -4,15 +4,18 @@ to track changes, as well as the Postgres FDW interface to upload/download objec
 import itertools
 import json
 import logging
+import os
 import sys
 import time
-from contextlib import contextmanager
-from io import BytesIO
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from io import TextIOWrapper
 from pathlib import PurePosixPath
-from threading import get_ident
+from threading import Thread, get_ident, enumerate as enumerate_threads
 from typing import (
     Any,
+    BinaryIO,
+    Callable,
     Dict,
     Iterator,
     List,
@@ -32,26 +35,33 @@ from psycopg2 import DatabaseError
 from psycopg2.errors import InvalidSchemaName, UndefinedTable
 from psycopg2.extras import execute_batch, Json
 from psycopg2.pool import ThreadedConnectionPool, AbstractConnectionPool
-from psycopg2.sql import Composed, SQL
+from psycopg2.sql import Composable, Composed, Literal, SQL
 from psycopg2.sql import Identifier
 from tqdm import tqdm
 
 from splitgraph.__version__ import __version__
-from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG, SPLITGRAPH_API_SCHEMA, SG_CMD_ASCII
+from splitgraph.config import (
+    SPLITGRAPH_META_SCHEMA,
+    CONFIG,
+    SPLITGRAPH_API_SCHEMA,
+    SG_CMD_ASCII,
+    get_singleton,
+)
 from splitgraph.core import server
 from splitgraph.core.common import ensure_metadata_schema, META_TABLES, get_data_safe
+from splitgraph.core.output import pretty_size
 from splitgraph.core.sql import select
 from splitgraph.core.types import TableColumn, TableSchema
-from splitgraph.engine import ResultShape, ObjectEngine, ChangeEngine, SQLEngine, switch_engine
+from splitgraph.engine import ResultShape, ObjectEngine, ChangeEngine, SQLEngine
 from splitgraph.exceptions import (
     EngineInitializationError,
     ObjectNotFoundError,
     AuthAPIError,
     IncompleteObjectDownloadError,
+    IncompleteObjectUploadError,
     APICompatibilityError,
     ObjectMountingError,
 )
-from splitgraph.hooks.mount_handlers import mount_postgres
 
 if TYPE_CHECKING:
     # Import the connection object under a different name as it shadows
@@ -60,14 +70,22 @@ if TYPE_CHECKING:
 
 _AUDIT_SCHEMA = "splitgraph_audit"
 _AUDIT_TRIGGER = "resources/static/audit_trigger.sql"
+_AUDIT_TRIGGER_TRANSITION = "resources/static/audit_trigger_transition.sql"
 _PUSH_PULL = "resources/static/splitgraph_api.sql"
 _CSTORE = "resources/static/cstore.sql"
+_LTHASH = "resources/static/lthash.sql"
 CSTORE_SERVER = "cstore_server"
 _PACKAGE = "splitgraph"
 ROW_TRIGGER_NAME = "audit_trigger_row"
 STM_TRIGGER_NAME = "audit_trigger_stm"
-REMOTE_TMP_SCHEMA = "tmp_remote_data"
+TRANSITION_TRIGGER_NAMES = (
+    "audit_trigger_transition_insert",
+    "audit_trigger_transition_update",
+    "audit_trigger_transition_delete",
+)
 SG_UD_FLAG = "sg_ud_flag"
+# Temporary table that PKs of changed rows are loaded into when storing fragments
+_PK_TABLE = "sg_tmp_pks"
 
 # Retry policy for connection errors
 RETRY_DELAY = 5
@@ -197,7 +215,8 @@ class PsycopgEngine(SQLEngine):
         :param name: Name of the engine
         :param conn_params: Optional, dictionary of connection params as stored in the config.
         :param pool: If specified, a Psycopg connection pool to use in this engine. By default, parameters
-            in conn_params are used so one of them must be specified.
+            in conn_params are used so one of them must be specified. If both are specified, the pool
+            is used and conn_params are only kept for reference (e.g. to find the object storage path).
         :param autocommit: If True, the engine will not use transactions for its operation.
         """
         super().__init__()
@@ -211,10 +230,18 @@ class PsycopgEngine(SQLEngine):
         self.check_version = check_version
         self.registry = registry
         self.in_fdw = in_fdw
+        # Callbacks to run when the current transaction ends (see on_transaction_end)
+        self._transaction_end_callbacks: List[Callable[[], None]] = []
+        # Whether the engine owns a connection pool for a background thread (see clone)
+        self._private_pool = False
 
         if conn_params:
             self.conn_params = conn_params
 
+        if pool:
+            self._pool = pool
+        else:
+            assert conn_params
             # Connection pool used by the engine, keyed by the thread ID (so one connection gets
             # claimed per thread). Usually, only one connection is used (for e.g. metadata management
             # or performing checkouts/commits). Multiple connections are used when downloading/uploading
@@ -237,8 +264,6 @@ class PsycopgEngine(SQLEngine):
                 dbname=dbname,
                 application_name="sgr " + __version__,
             )
-        else:
-            self._pool = pool
 
     def __repr__(self) -> str:
         try:
@@ -253,11 +278,54 @@ class PsycopgEngine(SQLEngine):
 
         return "PostgresEngine " + ((self.name + " ") if self.name else "") + conn_summary
 
+    def clone(self, share_pool: bool = True) -> "PsycopgEngine":
+        """
+        Create an engine that shares this engine's connection pool and connection parameters
+        but has its own transaction state. Since pool connections are keyed by the thread ID,
+        this lets worker threads run and commit their own transactions (with their own savepoints)
+        without interfering with this engine's connection.
+
+        :param share_pool: If False, the new engine uses its own connection pool instead
+            (this engine must have connection parameters). This is for background workers
+            that run code which closes other connections in its engine's pool (like object
+            download handlers do when they're done). The caller has to close the pool with
+            `close_pool` when it's done with the engine.
+        """
+        engine = type(self)(
+            name=self.name,
+            conn_params=getattr(self, "conn_params", None),
+            pool=self._pool if share_pool else None,
+            autocommit=self.autocommit,
+            registry=self.registry,
+            in_fdw=self.in_fdw,
+            check_version=False,
+        )
+        engine._private_pool = not share_pool
+        return engine
+
+    def on_transaction_end(self, callback: Callable[[], None]) -> None:
+        """
+        Run a callback when the engine's current transaction is committed or rolled back.
+        This is used to invalidate in-process caches of data that the transaction has
+        changed. On a rollback to a savepoint, the callback runs but stays registered.
+
+        :param callback: Function with no arguments
+        """
+        self._transaction_end_callbacks.append(callback)
+
+    def _run_transaction_end_callbacks(self, keep: bool = False) -> None:
+        callbacks = self._transaction_end_callbacks
+        if not keep:
+            self._transaction_end_callbacks = []
+        for callback in callbacks:
+            callback()
+
     def commit(self) -> None:
         if self.connected:
             conn = self.connection
             conn.commit()
             self._pool.putconn(conn)
+        self._run_transaction_end_callbacks()
 
     def close_others(self) -> None:
         """
@@ -268,20 +336,39 @@ class PsycopgEngine(SQLEngine):
         # We also can't release the connection back into the pool because that causes the
         # pool to reset it, clearing all state that we might need. Hence this has to be
         # called after the TPE has finished.
-
         if self.connected:
-            us = get_ident()
-            other_conns = [v for k, v in self._pool._used.items() if k != us]
+            if self._private_pool:
+                # Engines with a background pool (see clone) only close connections of threads
+                # that have finished, since the engine is used from a background thread that
+                # can be running alongside other threads. The rest of the pool is closed
+                # with close_pool.
+                alive = {t.ident for t in enumerate_threads()}
+                other_conns = [v for k, v in self._pool._used.items() if k not in alive]
+            else:
+                us = get_ident()
+                other_conns = [v for k, v in self._pool._used.items() if k != us]
             for c in other_conns:
                 self._pool.putconn(c, close=True)
 
+    def close_pool(self) -> None:
+        """
+        Close all connections in the engine's connection pool. The engine can't be used
+        after this. This is for engines with their own pool (see clone) that are
+        disposed of by background threads.
+        """
+        self._pool.closeall()
+        self.connected = False
+        self._run_transaction_end_callbacks()
+
     def close(self) -> None:
         if self.connected:
             conn = self.connection
             conn.close()
             self._pool.putconn(conn)
+        self._run_transaction_end_callbacks()
 
     def rollback(self) -> None:
+        savepoint = bool(self._savepoint_stack)
         if self.connected:
             if self._savepoint_stack:
                 self.run_sql(SQL("ROLLBACK TO ") + Identifier(self._savepoint_stack.pop()))
@@ -289,6 +376,7 @@ class PsycopgEngine(SQLEngine):
                 conn = self.connection
                 conn.rollback()
                 self._pool.putconn(conn)
+        self._run_transaction_end_callbacks(keep=savepoint)
 
     def lock_table(self, schema: str, table: str) -> None:
         # Allow SELECTs but not writes to a given table.
@@ -554,6 +642,41 @@ class PsycopgEngine(SQLEngine):
                 self.rollback()
                 raise
 
+    def copy_to_temporary_table(
+        self, table: str, columns: Sequence[Tuple[str, str]], rows: Iterable[Sequence[Any]]
+    ) -> None:
+        """
+        Create a temporary table and load rows into it with COPY. This is much faster
+        than passing the rows as query arguments (e.g. in a VALUES list), since the rows
+        don't have to be turned into a huge query that the engine then has to parse.
+
+        All columns in the table have type `text`: the caller has to cast them to
+        the actual column types, same as with query arguments. The table isn't
+        dropped automatically.
+
+        :param table: Name of the temporary table
+        :param columns: List of (column name, PG type) that the values in rows are formatted as
+        :param rows: Rows to load
+        """
+        pg_types = [t for _, t in columns]
+        with self.connection.cursor() as cur:
+            try:
+                cur.execute(
+                    SQL("CREATE TEMPORARY TABLE {} (").format(Identifier(table))
+                    + SQL(",").join(SQL("{} text").format(Identifier(c)) for c, _ in columns)
+                    + SQL(")")
+                )
+                cur.copy_expert(
+                    SQL("COPY pg_temp.{} FROM STDIN").format(Identifier(table)),
+                    _CopyTextReader(
+                        "\t".join([_to_copy_text(v, t) for v, t in zip(row, pg_types)]) + "\n"
+                        for row in rows
+                    ),
+                )
+            except DatabaseError:
+                self.rollback()
+                raise
+
     def run_api_call(self, call: str, *args, schema: str = SPLITGRAPH_API_SCHEMA) -> Any:
         # When we're inside of a foreign data wrapper on the engine itself,
         # we get to avoid having to go through PostgreSQL to manage objects in
@@ -718,9 +841,20 @@ class PsycopgEngine(SQLEngine):
             else:
                 logging.info("Skipping the audit trigger as it's already installed.")
 
+            # Install the statement-level audit triggers (these are replaced if they exist,
+            # so that engines that already have the audit trigger get them too).
+            logging.info("Installing the statement-level audit triggers...")
+            audit_trigger_transition = get_data_safe(_PACKAGE, _AUDIT_TRIGGER_TRANSITION)
+            self.run_sql(audit_trigger_transition.decode("utf-8"))
+
             # Start up the pgcrypto extension (required for hashing fragments)
             self.run_sql("CREATE EXTENSION IF NOT EXISTS pgcrypto")
 
+            # Install the function used to hash fragments on the engine
+            logging.info("Installing fragment hashing functions...")
+            lthash = get_data_safe(_PACKAGE, _LTHASH)
+            self.run_sql(lthash.decode("utf-8"))
+
     def delete_database(self, database: str) -> None:
         """
         Helper function to drop a database using the admin connection
@@ -736,19 +870,24 @@ class PsycopgEngine(SQLEngine):
 class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
     """Change tracking based on an audit trigger stored procedure"""
 
+    # Names of all triggers that this engine can install on tracked tables
+    _trigger_names: Tuple[str, ...] = (ROW_TRIGGER_NAME, STM_TRIGGER_NAME)
+
     def get_tracked_tables(self) -> List[Tuple[str, str]]:
         """Return a list of tables that the audit trigger is working on."""
         return cast(
             List[Tuple[str, str]],
             self.run_sql(
                 "SELECT DISTINCT event_object_schema, event_object_table "
-                "FROM information_schema.triggers WHERE trigger_name IN (%s, %s)",
-                (ROW_TRIGGER_NAME, STM_TRIGGER_NAME),
+                "FROM information_schema.triggers WHERE trigger_name = ANY(%s)",
+                (list(self._trigger_names),),
             ),
         )
 
-    def track_tables(self, tables: List[Tuple[str, str]]) -> None:
+    def track_tables(self, tables: List[Tuple[str, str]], statement_level: bool = False) -> None:
         """Install the audit trigger on the required tables"""
+        if statement_level:
+            raise NotImplementedError("This engine only supports row-level audit triggers!")
         self.run_sql(
             SQL(";").join(
                 SQL("SELECT {}.audit_table('{}.{}')").format(
@@ -760,7 +899,7 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
 
     def untrack_tables(self, tables: List[Tuple[str, str]]) -> None:
         """Remove triggers from tables and delete their pending changes"""
-        for trigger in (ROW_TRIGGER_NAME, STM_TRIGGER_NAME):
+        for trigger in self._trigger_names:
             self.run_sql(
                 SQL(";").join(
                     SQL("DROP TRIGGER IF EXISTS {} ON {}.{}").format(
@@ -838,13 +977,92 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
         for action, row_data, changed_fields in self.run_sql(
             SQL(
                 "SELECT action, row_data, changed_fields FROM {}.{} "
-                "WHERE schema_name = %s AND table_name = %s"
+                "WHERE schema_name = %s AND table_name = %s ORDER BY event_id"
             ).format(Identifier(_AUDIT_SCHEMA), Identifier("logged_actions")),
             (schema, table),
         ):
             result.extend(_convert_audit_change(action, row_data, changed_fields, ri_cols))
         return result
 
+    def get_conflated_changes(
+        self, schema: str, table: str, batch_size: int = 10000
+    ) -> Iterator[List[Tuple[Tuple[Any, ...], bool, Dict[str, Any], Dict[str, Any]]]]:
+        """
+        Return pending changes for a given tracked table, conflated on the engine.
+
+        Unlike `get_pending_changes`, this doesn't send the whole audit log to the client:
+        the engine finds the first old value and the last new value of every replica
+        identity using window functions over `event_id` and drops changes that cancel
+        each other out. The result is streamed from a server-side cursor.
+
+        The changes still have to be passed through
+        :func:`splitgraph.core.fragment_manager._conflate_changes`: for primary keys
+        whose changes cancel out midway, all of their changes are returned in order.
+
+        :param schema: Schema the table belongs to
+        :param table: Table to return changes for
+        :param batch_size: Number of changes to fetch from the engine at a time
+        :return: Iterator of lists of (primary_key, upserted, old_row, new_row)
+        """
+        ri_cols = [c for c, _ in self.get_change_key(schema, table)]
+
+        def _ri_tuple(row_data: Composable) -> Composable:
+            return (
+                SQL("jsonb_build_array(")
+                + SQL(",").join(row_data + SQL(" -> {}").format(Literal(c)) for c in ri_cols)
+                + SQL(")")
+            )
+
+        # Same as _convert_audit_change: every audit log entry is turned into a change
+        # (pk, upserted, old row, new row), except for updates that change the PK: these
+        # become a deletion of the old PK and an insertion of the new one.
+        query = (
+            SQL(
+                "WITH changes AS (SELECT la.event_id, c.sub, c.pk, c.upserted, c.old_row, "
+                "c.new_row FROM {}.{} la, "
+                "LATERAL (SELECT la.row_data || coalesce(la.changed_fields - %(ri_cols)s, '{{}}') "
+                "AS new_row, la.action = 'U' AND la.changed_fields ?| %(ri_cols)s "
+                "AS pk_changed) r, LATERAL (SELECT 0 AS sub, "
+            ).format(Identifier(_AUDIT_SCHEMA), Identifier("logged_actions"))
+            + _ri_tuple(SQL("la.row_data"))
+            + SQL(
+                " AS pk, la.action <> 'D' AND NOT r.pk_changed AS upserted, "
+                "CASE WHEN la.action = 'I' THEN '{}' ELSE la.row_data END AS old_row, "
+                "CASE WHEN la.action = 'D' THEN '{}' ELSE r.new_row END "
+                "AS new_row UNION ALL SELECT 1, "
+            )
+            + _ri_tuple(SQL("(la.row_data || la.changed_fields)"))
+            + SQL(
+                ", true, '{}', r.new_row WHERE r.pk_changed) c "
+                "WHERE la.schema_name = %(schema)s AND la.table_name = %(table)s "
+                # Skip updates that didn't change anything
+                "AND (la.action <> 'U' OR la.changed_fields <> '{}')) "
+                # Conflate changes to every PK: the result is the first old row and the last new
+                # row unless they're the same, in which case the changes cancel each other out.
+                # If some change in the middle cancels out the changes before it, the new value
+                # after it is compared with the next change's old row instead, so in that rare
+                # case we return all changes to the PK for the client to conflate.
+                "SELECT pk, upserted, CASE WHEN replay THEN old_row ELSE first_old END, new_row "
+                "FROM (SELECT *, bool_or(rn > 1 AND rn < n AND new_row = first_old) "
+                "OVER (PARTITION BY pk) AS replay FROM "
+                "(SELECT pk, upserted, old_row, new_row, first_value(old_row) OVER w AS first_old, "
+                "row_number() OVER w AS rn, count(*) OVER (PARTITION BY pk) AS n "
+                "FROM changes WINDOW w AS (PARTITION BY pk ORDER BY event_id, sub)) r) c "
+                "WHERE replay OR (rn = n AND (n = 1 OR first_old <> new_row)) ORDER BY pk, rn"
+            )
+        )
+
+        # Cursor names have to be unique in the transaction and callers can read the changes
+        # of several tables at the same time.
+        with self.connection.cursor(name="sg_conflated_changes_" + uuid.uuid4().hex) as cur:
+            cur.itersize = batch_size
+            cur.execute(query, {"ri_cols": ri_cols, "schema": schema, "table": table})
+            while True:
+                batch = cur.fetchmany(batch_size)
+                if not batch:
+                    break
+                yield [(tuple(pk), upserted, old, new) for pk, upserted, old, new in batch]
+
     def get_changed_tables(self, schema: str) -> List[str]:
         """Get list of tables that have changed content"""
         return cast(
@@ -860,9 +1078,115 @@ class AuditTriggerChangeEngine(PsycopgEngine, ChangeEngine):
         )
 
 
-class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
+class TransitionTableChangeEngine(AuditTriggerChangeEngine):
+    """
+    Change tracking that can also use statement-level triggers. Instead of running
+    a trigger for every changed row, these run once per statement and log all rows
+    that it changed in bulk from its transition tables, which is much faster for
+    statements that change many rows.
+
+    Changes are logged in the same format as the row-level audit trigger uses, so the
+    rest of change tracking (getting, conflating and committing changes) is the same.
+    """
+
+    _trigger_names = AuditTriggerChangeEngine._trigger_names + TRANSITION_TRIGGER_NAMES
+
+    def track_tables(self, tables: List[Tuple[str, str]], statement_level: bool = False) -> None:
+        """
+        Install audit triggers on the required tables
+
+        :param tables: List of (table_schema, table_name) to start tracking
+        :param statement_level: Use statement-level triggers instead of row-level ones.
+        """
+        if not statement_level:
+            super().track_tables(tables)
+            return
+
+        self.run_sql(
+            SQL(";").join(
+                SQL("SELECT {}.audit_table_transition('{}.{}')").format(
+                    Identifier(_AUDIT_SCHEMA), Identifier(s), Identifier(t)
+                )
+                for s, t in tables
+            )
+        )
+
+
+class PostgresEngine(TransitionTableChangeEngine, ObjectEngine):
     """An implementation of the Postgres engine for Splitgraph"""
 
+    _lthash_sum = False
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # Objects that other connections have written and committed on behalf of this engine's
+        # transaction. They get deleted if that transaction is rolled back.
+        self._uncommitted_objects: List[str] = []
+        # Objects discarded by the current transaction (see discard_objects) and by
+        # transactions that have committed but haven't had their files purged yet.
+        self._discarded_objects: List[str] = []
+        self._committed_discarded_objects: List[str] = []
+
+    def commit(self) -> None:
+        super().commit()
+        self._uncommitted_objects = []
+        self._committed_discarded_objects.extend(self._discarded_objects)
+        self._discarded_objects = []
+
+    def rollback(self) -> None:
+        full_rollback = not self._savepoint_stack
+        super().rollback()
+        if full_rollback and self._discarded_objects:
+            self._restore_discarded_objects()
+        if full_rollback and self._uncommitted_objects:
+            self._delete_uncommitted_objects()
+
+    def add_uncommitted_objects(self, object_ids: List[str]) -> None:
+        """
+        Record objects that have been written and committed by a different connection (for
+        example, a worker using an engine from :meth:`clone`) but that only get referenced by
+        this engine's current transaction. If the transaction is rolled back, the objects
+        that still aren't registered in the object tree will be deleted.
+
+        This is safe to call from other threads.
+
+        :param object_ids: List of object IDs
+        """
+        self._uncommitted_objects.extend(object_ids)
+
+    def _delete_uncommitted_objects(self) -> None:
+        object_ids, self._uncommitted_objects = self._uncommitted_objects, []
+        try:
+            # Someone else could have registered the same objects in the meantime.
+            registered = self.run_sql(
+                SQL("SELECT object_id FROM {}.objects WHERE object_id = ANY(%s)").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA)
+                ),
+                (object_ids,),
+                return_shape=ResultShape.MANY_ONE,
+            )
+            to_delete = [o for o in object_ids if o not in registered]
+            if to_delete:
+                logging.info("Deleting %d object(s) left over by the rollback", len(to_delete))
+                self.delete_objects(to_delete)
+            super().commit()
+        except Exception:
+            # Unregistered objects are also deleted by sgr cleanup, so don't hide
+            # the original error.
+            logging.warning("Error deleting objects %s", object_ids, exc_info=True)
+            super().rollback()
+
+    def _restore_discarded_objects(self) -> None:
+        # The objects are mounted again by the rollback but their files were
+        # renamed outside of the transaction.
+        object_ids, self._discarded_objects = self._discarded_objects, []
+        try:
+            self.run_api_call_batch("restore_discarded_files", [(o,) for o in object_ids])
+            super().commit()
+        except Exception:
+            logging.warning("Error restoring discarded objects %s", object_ids, exc_info=True)
+            super().rollback()
+
     def get_object_schema(self, object_id: str) -> "TableSchema":
         result: "TableSchema" = []
 
@@ -964,10 +1288,46 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
     def get_object_size(self, object_id: str) -> int:
         return int(self.run_api_call("get_object_size", object_id))
 
+    def has_lthash_sum(self) -> bool:
+        """Check whether the engine can sum up row digests itself (using `splitgraph_api.lthash_sum`).
+        Engines initialized by older versions of Splitgraph don't have this function installed."""
+        # Only remember the positive result: the function can get installed by
+        # a reinitialization whilst this engine object is alive.
+        if not self._lthash_sum:
+            self._lthash_sum = (
+                self.run_sql(
+                    "SELECT 1 FROM pg_proc p JOIN pg_namespace n ON p.pronamespace = n.oid "
+                    "WHERE n.nspname = %s AND p.proname = 'lthash_sum'",
+                    (SPLITGRAPH_API_SCHEMA,),
+                    return_shape=ResultShape.ONE_ONE,
+                )
+                is not None
+            )
+        return self._lthash_sum
+
     def delete_objects(self, object_ids: List[str]) -> None:
         self.unmount_objects(object_ids)
         self.run_api_call_batch("delete_object_files", [(o,) for o in object_ids])
 
+    def discard_objects(self, object_ids: List[str]) -> None:
+        self.unmount_objects(object_ids)
+        self.run_api_call_batch("discard_object_files", [(o,) for o in object_ids])
+        self._discarded_objects.extend(object_ids)
+
+    def purge_discarded_objects(self, object_ids: Optional[List[str]] = None) -> int:
+        if object_ids is None:
+            object_ids, self._committed_discarded_objects = self._committed_discarded_objects, []
+        if not object_ids:
+            return 0
+        return cast(int, self.run_api_call("purge_discarded_files", object_ids))
+
+    def get_discarded_objects(self) -> List[str]:
+        """
+        Get IDs of objects that have been discarded (see `discard_objects`) but whose files
+        haven't been purged yet.
+        """
+        return cast(List[str], self.run_api_call("list_discarded_objects"))
+
     def unmount_objects(self, object_ids: List[str]) -> None:
         """Unmount objects from splitgraph_meta (this doesn't delete the physical files."""
         unmount_query = SQL(";").join(
@@ -1020,6 +1380,25 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
                 "using an extension (e.g. PostGIS) that's not installed on this engine."
             ) from e
 
+    def download_object_from_urls(self, object_id: str, urls: Sequence[str]) -> Dict[str, float]:
+        """
+        Download an object from pre-signed URLs into the engine's storage and mount it.
+
+        :param object_id: ID of the object
+        :param urls: URLs of the object file, its footer and its schema
+        :return: Dictionary with the number of downloaded bytes and the time it took.
+        """
+        if self.in_fdw:
+            # Inside of the LQFDW shim, run the download in this process.
+            result = server.download_object(object_id, cast(server.ObjectUrls, tuple(urls)))
+            self.mount_object(object_id)
+            return result
+        result = self.run_api_call("download_object", object_id, list(urls))
+        # The engine also returns the object's schema, so we don't need to get it to mount it.
+        schema_spec = [TableColumn(*c) for c in result.pop("schema")]
+        self.mount_object(object_id, schema_spec=schema_spec)
+        return cast(Dict[str, float], result)
+
     def store_fragment(
         self,
         inserted: Any,
@@ -1045,35 +1424,27 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
             schema, table, schema_spec=add_ud_flag_column(schema_spec), temporary=temporary,
         )
 
+        # Load the PKs of upserted and deleted rows into temporary tables with COPY
+        # and then store them with set-based INSERT ... SELECT queries. Passing PKs
+        # in a VALUES list instead makes the query huge for large changesets.
         # Store upserts
         # INSERT INTO target_table (sg_ud_flag, col1, col2...)
         #   (SELECT true, t.col1, t.col2, ...
-        #    FROM VALUES ((pk1_1, pk1_2), (pk2_1, pk2_2)...)) v JOIN source_table t
+        #    FROM pg_temp.sg_tmp_pks v JOIN source_table t
         #    ON v.pk1 = t.pk1::pk1_type AND v.pk2::pk2_type = t.pk2...
         #    -- the cast is required since the audit trigger gives us strings for values of updated columns
         #    -- and we're intending to join those with the PKs in the original table.
         if inserted:
+            self.copy_to_temporary_table(_PK_TABLE, change_key, inserted)
             if non_ri_cols:
                 query = (
                     SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
                     + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + all_cols)
                     + SQL(")")
-                    + SQL("(SELECT %s, ")
+                    + SQL("(SELECT true, ")
                     + SQL(",").join(SQL("t.") + Identifier(c) for c in all_cols)
-                    + SQL(
-                        " FROM (VALUES "
-                        + ",".join(
-                            itertools.repeat(
-                                "(" + ",".join(itertools.repeat("%s", len(inserted[0]))) + ")",
-                                len(inserted),
-                            )
-                        )
-                        + ")"
-                    )
-                    + SQL(" AS v (")
-                    + SQL(",").join(Identifier(c) for c in ri_cols)
-                    + SQL(")")
-                    + SQL("JOIN {}.{} t").format(
+                    + SQL(" FROM pg_temp.{} v").format(Identifier(_PK_TABLE))
+                    + SQL(" JOIN {}.{} t").format(
                         Identifier(source_schema), Identifier(source_table)
                     )
                     + SQL(" ON ")
@@ -1083,46 +1454,18 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
                     )
                     + SQL(")")
                 )
-                # Flatten the args
-                args = [True] + [p for pk in inserted for p in pk]
             else:
                 # If the whole tuple is the PK, there's no point joining on the actual source table
-                query = (
-                    SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
-                    + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + ri_cols)
-                    + SQL(")")
-                    + SQL(
-                        "VALUES "
-                        + ",".join(
-                            itertools.repeat(
-                                "(" + ",".join(itertools.repeat("%s", len(inserted[0]) + 1)) + ")",
-                                len(inserted),
-                            )
-                        )
-                    )
-                )
-                args = [p for pk in inserted for p in [True] + list(pk)]
-            self.run_sql(query, args)
+                query = _insert_pks_query(schema, table, change_key, upserted=True)
+            self.run_sql(query)
+            self.run_sql(SQL("DROP TABLE pg_temp.{}").format(Identifier(_PK_TABLE)))
 
         # Store the deletes
         # we don't actually have the old values here so we put NULLs (which should be compressed out).
         if deleted:
-            query = (
-                SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
-                + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + ri_cols)
-                + SQL(")")
-                + SQL(
-                    "VALUES "
-                    + ",".join(
-                        itertools.repeat(
-                            "(" + ",".join(itertools.repeat("%s", len(deleted[0]) + 1)) + ")",
-                            len(deleted),
-                        )
-                    )
-                )
-            )
-            args = [p for pk in deleted for p in [False] + list(pk)]
-            self.run_sql(query, args)
+            self.copy_to_temporary_table(_PK_TABLE, change_key, deleted)
+            self.run_sql(_insert_pks_query(schema, table, change_key, upserted=False))
+            self.run_sql(SQL("DROP TABLE pg_temp.{}").format(Identifier(_PK_TABLE)))
 
     def store_object(
         self,
@@ -1199,24 +1542,29 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         target_table: str,
         cols: Tuple[List[str], List[str]],
         extra_quals: Optional[Composed] = None,
+        insert_only: bool = False,
     ) -> Composed:
         ri_cols, non_ri_cols = cols
         all_cols = ri_cols + non_ri_cols
 
         # First, delete all PKs from staging that are mentioned in the new fragment. This conveniently
-        # covers both deletes and updates.
+        # covers both deletes and updates. If the fragment doesn't overlap with anything that's
+        # already in the table, there's nothing to delete.
 
         # Also, alias tables so that we don't have to send around long strings of object IDs.
-        query = (
-            SQL("DELETE FROM {0}.{2} t USING {1}.{3} s").format(
-                Identifier(target_schema),
-                Identifier(source_schema),
-                Identifier(target_table),
-                Identifier(source_table),
+        query = SQL("")
+        if not insert_only:
+            query += (
+                SQL("DELETE FROM {0}.{2} t USING {1}.{3} s").format(
+                    Identifier(target_schema),
+                    Identifier(source_schema),
+                    Identifier(target_table),
+                    Identifier(source_table),
+                )
+                + SQL(" WHERE ")
+                + _generate_where_clause("t", ri_cols, "s")
+                + SQL(";")
             )
-            + SQL(" WHERE ")
-            + _generate_where_clause("t", ri_cols, "s")
-        )
 
         # At this point, we can insert all rows directly since we won't have any conflicts.
         # We can also apply extra qualifiers to only insert rows that match a certain query,
@@ -1226,7 +1574,7 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         #   (SELECT col1, col2, ...
         #    FROM fragment_table WHERE sg_ud_flag = true (AND optional quals))
         query += (
-            SQL(";INSERT INTO {}.{} (").format(Identifier(target_schema), Identifier(target_table))
+            SQL("INSERT INTO {}.{} (").format(Identifier(target_schema), Identifier(target_table))
             + SQL(",").join(Identifier(c) for c in all_cols)
             + SQL(")")
             + SQL("(SELECT ")
@@ -1249,6 +1597,7 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         extra_qual_args: Optional[Tuple[str]] = None,
         schema_spec: Optional["TableSchema"] = None,
         progress_every: Optional[int] = None,
+        insert_only: bool = False,
     ) -> None:
         if not objects:
             return
@@ -1262,28 +1611,121 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
             with tqdm(total=len(objects), unit="obj") as pbar:
                 for batch in batches:
                     self._apply_batch(
-                        batch, target_schema, target_table, extra_quals, cols, extra_qual_args
+                        batch,
+                        target_schema,
+                        target_table,
+                        extra_quals,
+                        cols,
+                        extra_qual_args,
+                        insert_only,
                     )
                     pbar.update(len(batch))
                     pbar.set_postfix({"object": batch[-1][1][:10] + "..."})
         else:
             self._apply_batch(
-                objects, target_schema, target_table, extra_quals, cols, extra_qual_args
+                objects,
+                target_schema,
+                target_table,
+                extra_quals,
+                cols,
+                extra_qual_args,
+                insert_only,
             )
 
     def _apply_batch(
-        self, objects, target_schema, target_table, extra_quals, cols, extra_qual_args
+        self,
+        objects,
+        target_schema,
+        target_table,
+        extra_quals,
+        cols,
+        extra_qual_args,
+        insert_only=False,
     ):
         query = SQL(";").join(
             self._generate_fragment_application(
-                ss, st, target_schema, target_table, cols, extra_quals
+                ss, st, target_schema, target_table, cols, extra_quals, insert_only
             )
             for ss, st in objects
         )
         self.run_sql(query, (extra_qual_args * len(objects)) if extra_qual_args else None)
 
-    def upload_objects(self, objects: List[str], remote_engine: "PostgresEngine") -> None:
+    def _transfer_objects(
+        self,
+        objects: List[str],
+        source: "PostgresEngine",
+        target: "PostgresEngine",
+        get_schema: Callable[[str], Optional["TableSchema"]],
+    ) -> Tuple[List[str], Optional[BaseException]]:
+        """
+        Copy objects from one engine to another, streaming each object from the source
+        into the target on a separate pair of pool connections.
+
+        :param objects: List of object IDs to copy
+        :param source: Engine to copy the objects from
+        :param target: Engine to copy the objects to
+        :param get_schema: Function returning the schema of an object or None
+            if the object doesn't exist on the source engine.
+        :return: A tuple of the list of objects that were copied and the exception
+            that interrupted the transfer, if any.
+        """
+        # By default, take up the whole connection pool with workers
+        # (less one connection for the main thread).
+        worker_threads = max(int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1, 1)
+
+        def _do_transfer(object_id: str) -> Tuple[str, Optional[Tuple[int, float]]]:
+            try:
+                schema_spec = get_schema(object_id)
+                if schema_spec is None:
+                    logging.error("%s not found on the source engine!", object_id)
+                    return object_id, None
+                started = time.time()
+                size = _stream_object(source, target, object_id, schema_spec)
+                elapsed = time.time() - started
+                logging.info(
+                    "Copied %s: %s in %.2fs (%s/s)",
+                    object_id,
+                    pretty_size(size),
+                    elapsed,
+                    pretty_size(size / max(elapsed, 1e-6)),
+                )
+                return object_id, (size, elapsed)
+            except Exception:
+                logging.exception("Error copying object %s", object_id)
+                # Don't use the engines' rollback() since that would roll back
+                # the main thread's savepoints.
+                for engine in (source, target):
+                    try:
+                        engine.connection.rollback()
+                    except psycopg2.Error:
+                        pass
+                return object_id, None
+
+        successful: List[str] = []
+        try:
+            with ThreadPoolExecutor(max_workers=worker_threads) as tpe:
+                pbar = tqdm(
+                    tpe.map(_do_transfer, objects),
+                    total=len(objects),
+                    unit="objs",
+                    ascii=SG_CMD_ASCII,
+                )
+                for object_id, stats in pbar:
+                    if stats:
+                        successful.append(object_id)
+                        size, elapsed = stats
+                        pbar.set_postfix(
+                            object=object_id[:10] + "...",
+                            speed=pretty_size(size / max(elapsed, 1e-6)) + "/s",
+                        )
+            return successful, None
+        except KeyboardInterrupt as e:
+            return successful, e
+        finally:
+            source.close_others()
+            target.close_others()
 
+    def upload_objects(self, objects: List[str], remote_engine: "PostgresEngine") -> None:
         # We don't have direct access to the remote engine's storage and we also
         # can't use the old method of first creating a CStore table remotely and then
         # mounting it via FDW (because this is done on two separate connections, after
@@ -1293,110 +1735,28 @@ class PostgresEngine(AuditTriggerChangeEngine, ObjectEngine):
         # and then piping that binary into the remote engine.
         #
         # Perhaps we should drop direct uploading altogether and require people to use S3 throughout.
-
-        pbar = tqdm(objects, unit="objs", ascii=SG_CMD_ASCII)
-        for object_id in pbar:
-            pbar.set_postfix(object=object_id[:10] + "...")
-            schema_spec = self.get_object_schema(object_id)
-            remote_engine.mount_object(object_id, schema_spec=schema_spec)
-
-            # Truncate the remote object in case it already exists (we'll overwrite it).
-            remote_engine.run_sql(
-                SQL("TRUNCATE TABLE {}.{}").format(
-                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
-                )
-            )
-
-            stream = BytesIO()
-            with self.connection.cursor() as cur:
-                cur.copy_expert(
-                    SQL("COPY {}.{} TO STDOUT WITH (FORMAT 'binary')").format(
-                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
-                    ),
-                    stream,
-                )
-            stream.seek(0)
-            with remote_engine.connection.cursor() as cur:
-                cur.copy_expert(
-                    SQL("COPY {}.{} FROM STDIN WITH (FORMAT 'binary')").format(
-                        Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
-                    ),
-                    stream,
-                )
-            remote_engine._set_object_schema(object_id, schema_spec)
-            remote_engine.commit()
-
-    @contextmanager
-    def _mount_remote_engine(self, remote_engine: "PostgresEngine") -> Iterator[str]:
-        # Switch the global engine to "self" instead of LOCAL since `mount_postgres` uses the global engine
-        # (we can't easily pass args into it as it's also invoked from the command line with its arguments
-        # used to populate --help)
-        user = remote_engine.conn_params["SG_ENGINE_USER"]
-        pwd = remote_engine.conn_params["SG_ENGINE_PWD"]
-        host = remote_engine.conn_params["SG_ENGINE_FDW_HOST"]
-        port = remote_engine.conn_params["SG_ENGINE_FDW_PORT"]
-        dbname = remote_engine.conn_params["SG_ENGINE_DB_NAME"]
-
-        # conn_params might contain Nones for some parameters (host/port for Unix
-        # socket connection, so here we have to validate that they aren't None).
-        assert user is not None
-        assert pwd is not None
-        assert host is not None
-        assert port is not None
-        assert dbname is not None
-
-        logging.info(
-            "Mounting remote schema %s@%s:%s/%s/%s to %s...",
-            user,
-            host,
-            port,
-            dbname,
-            SPLITGRAPH_META_SCHEMA,
-            REMOTE_TMP_SCHEMA,
+        successful, error = self._transfer_objects(
+            objects, self, remote_engine, self.get_object_schema
         )
-        self.delete_schema(REMOTE_TMP_SCHEMA)
-        with switch_engine(self):
-            mount_postgres(
-                mountpoint=REMOTE_TMP_SCHEMA,
-                server=host,
-                port=port,
-                username=user,
-                password=pwd,
-                dbname=dbname,
-                remote_schema=SPLITGRAPH_META_SCHEMA,
+        if error or len(successful) < len(objects):
+            raise IncompleteObjectUploadError(
+                reason=error,
+                successful_objects=successful,
+                successful_object_urls=[None] * len(successful),
             )
-        try:
-            yield REMOTE_TMP_SCHEMA
-        finally:
-            self.delete_schema(REMOTE_TMP_SCHEMA)
 
     def download_objects(self, objects: List[str], remote_engine: "PostgresEngine") -> List[str]:
-        # Instead of connecting and pushing queries to it from the Python client, we just mount the remote mountpoint
-        # into a temporary space (without any checking out) and SELECT the  required data into our local tables.
-
-        with self._mount_remote_engine(remote_engine) as remote_schema:
-            downloaded_objects = []
-            pbar = tqdm(objects, unit="objs", ascii=SG_CMD_ASCII)
-            for object_id in pbar:
-                pbar.set_postfix(object=object_id[:10] + "...")
-                if not self.table_exists(remote_schema, object_id):
-                    logging.error("%s not found on the remote engine!", object_id)
-                    continue
-
-                # Create the CStore table on the engine and copy the contents of the object into it.
-                schema_spec = remote_engine.get_full_table_schema(SPLITGRAPH_META_SCHEMA, object_id)
-                self.mount_object(object_id, schema_spec=schema_spec)
-                self.copy_table(
-                    remote_schema,
-                    object_id,
-                    SPLITGRAPH_META_SCHEMA,
-                    object_id,
-                    with_pk_constraints=False,
-                )
-                self._set_object_schema(object_id, schema_spec=schema_spec)
-                downloaded_objects.append(object_id)
-        if len(downloaded_objects) < len(objects):
-            raise IncompleteObjectDownloadError(reason=None, successful_objects=downloaded_objects)
+        # Stream the objects from the remote engine with COPY (same as uploads).
+        def _get_schema(object_id: str) -> Optional["TableSchema"]:
+            if not remote_engine.table_exists(SPLITGRAPH_META_SCHEMA, object_id):
+                return None
+            return remote_engine.get_full_table_schema(SPLITGRAPH_META_SCHEMA, object_id)
+
+        downloaded_objects, error = self._transfer_objects(
+            objects, remote_engine, self, _get_schema
+        )
+        if error or len(downloaded_objects) < len(objects):
+            raise IncompleteObjectDownloadError(reason=error, successful_objects=downloaded_objects)
         return downloaded_objects
 
     def get_change_key(self, schema: str, table: str) -> List[Tuple[str, str]]:
@@ -1413,6 +1773,79 @@ def get_change_key(schema_spec: TableSchema) -> List[Tuple[str, str]]:
     return [(c.name, c.pg_type) for c in schema_spec if c.pg_type in PG_INDEXABLE_TYPES]
 
 
+class _CountingWriter:
+    """Wrapper around a file that counts the number of bytes written into it."""
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data: bytes) -> int:
+        self.bytes_written += len(data)
+        return self.stream.write(data)
+
+    def close(self) -> None:
+        self.stream.close()
+
+
+def _stream_object(
+    source: "PostgresEngine", target: "PostgresEngine", object_id: str, schema_spec: TableSchema
+) -> int:
+    """
+    Copy an object between two engines, piping the output of COPY TO STDOUT on the source
+    into COPY FROM STDIN on the target, so that the object is never held in memory.
+    Commits on the target engine's connection for the current thread.
+
+    :param source: Engine to copy the object from
+    :param target: Engine to copy the object to
+    :param object_id: Object ID
+    :param schema_spec: Schema of the object
+    :return: Size of the copied data in bytes.
+    """
+    target.mount_object(object_id, schema_spec=schema_spec)
+
+    # Truncate the target object in case it already exists (we'll overwrite it).
+    table = SQL("{}.{}").format(Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id))
+    target.run_sql(SQL("TRUNCATE TABLE ") + table)
+
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, "rb")
+    writer = _CountingWriter(os.fdopen(write_fd, "wb"))
+    source_conn = source.connection
+    source_errors: List[BaseException] = []
+
+    def _copy_out() -> None:
+        try:
+            with source_conn.cursor() as cur:
+                cur.copy_expert(
+                    SQL("COPY {} TO STDOUT WITH (FORMAT 'binary')").format(table), writer
+                )
+        except BaseException as e:
+            source_errors.append(e)
+        finally:
+            writer.close()
+
+    copy_thread = Thread(target=_copy_out, daemon=True)
+    copy_thread.start()
+    try:
+        with target.connection.cursor() as cur:
+            cur.copy_expert(SQL("COPY {} FROM STDIN WITH (FORMAT 'binary')").format(table), reader)
+    finally:
+        # Closing the read end unblocks the source if the target has failed.
+        reader.close()
+        copy_thread.join()
+
+    # The target happily accepts a truncated stream if the source fails
+    # between two rows, so we have to check for errors before committing.
+    if source_errors:
+        raise source_errors[0]
+    source_conn.commit()
+
+    target._set_object_schema(object_id, schema_spec)
+    target.connection.commit()
+    return writer.bytes_written
+
+
 def _split_ri_cols(
     action: str,
     row_data: Dict[str, Any],
@@ -1535,6 +1968,87 @@ def _convert_vals(vals: Any) -> Any:
     return [Json(v) if isinstance(v, dict) else v for v in vals]
 
 
+def _to_pg_text(value: Any, pg_type: str) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (bytes, memoryview)):
+        return "\\x" + bytes(value).hex()
+    if isinstance(value, dict) or (isinstance(value, list) and pg_type in ("json", "jsonb")):
+        # Same as wrapping the value in Json (see _convert_vals)
+        return json.dumps(value)
+    if isinstance(value, list):
+        # Array literal, e.g. {1,NULL,"a b"}
+        element_type = pg_type[:-2] if pg_type.endswith("[]") else pg_type
+        return "{" + ",".join(_to_array_element(v, element_type) for v in value) + "}"
+    return str(value)
+
+
+def _to_array_element(value: Any, pg_type: str) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, list):
+        # Multidimensional arrays
+        return _to_pg_text(value, pg_type + "[]")
+    return '"' + _to_pg_text(value, pg_type).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _to_copy_text(value: Any, pg_type: str) -> str:
+    """Format a value as a field for COPY in text format"""
+    if value is None:
+        return "\\N"
+    value_type = type(value)
+    if value_type is int or value_type is float:
+        return str(value)
+    text = value if value_type is str else _to_pg_text(value, pg_type)
+    if "\\" in text or "\t" in text or "\n" in text or "\r" in text:
+        text = (
+            text.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
+    return text
+
+
+class _CopyTextReader:
+    """File-like object that COPY FROM reads lines of text from, generating them lazily."""
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        self._lines = iter(lines)
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        if size < 0 or length < size:
+            for line in self._lines:
+                chunks.append(line)
+                length += len(line)
+                if 0 <= size <= length:
+                    break
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        result, self._buffer = data[:size], data[size:]
+        return result
+
+
+def _insert_pks_query(
+    schema: str, table: str, change_key: List[Tuple[str, str]], upserted: bool
+) -> Composed:
+    """Query that stores PKs loaded into the temporary PK table in a fragment"""
+    return (
+        SQL("INSERT INTO {}.{} (").format(Identifier(schema), Identifier(table))
+        + SQL(",").join(Identifier(c) for c in [SG_UD_FLAG] + [c for c, _ in change_key])
+        + SQL(") SELECT ")
+        + SQL(",").join(
+            [Literal(upserted)]
+            + [SQL("v.{}::%s" % t).format(Identifier(c)) for c, t in change_key]
+        )
+        + SQL(" FROM pg_temp.{} v").format(Identifier(_PK_TABLE))
+    )
+
+
 def _generate_where_clause(table: str, cols: List[str], table_2: str) -> Composed:
     return SQL(" AND ").join(
         SQL("{}.{} = {}.{}").format(
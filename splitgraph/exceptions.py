@@ -1,7 +1,7 @@
 """
 Exceptions that can be raised by the Splitgraph library.
 """
-from typing import List, Optional
+from typing import List, Optional, Sequence
 
 
 class SplitGraphError(Exception):
@@ -82,7 +82,7 @@ class IncompleteObjectUploadError(SplitGraphError):
         self,
         reason: Optional[BaseException],
         successful_objects: List[str],
-        successful_object_urls: List[str],
+        successful_object_urls: Sequence[Optional[str]],
     ):
         self.reason = reason
         self.successful_objects = successful_objects
@@ -2,7 +2,7 @@
 Hooks for registering handlers to upload/download objects from external locations into Splitgraph's cache.
 """
 from importlib import import_module
-from typing import Any, Dict, Callable, List, Tuple, Sequence, TYPE_CHECKING
+from typing import Any, Dict, Callable, List, Optional, Tuple, Sequence, TYPE_CHECKING
 
 from splitgraph.config import CONFIG
 from splitgraph.config.config import get_from_section
@@ -27,6 +27,10 @@ class ExternalObjectHandler:
 
     The protocol and the URLs returned by this handler are stored in splitgraph_meta.external_objects
     and used to download the objects back into the Splitgraph cache when they are needed.
+
+    Handlers whose `upload_objects`/`download_objects` don't accept the `local_engine`
+    argument are still supported, but deprecated: they're called with the engine set as
+    the current engine (see :func:`splitgraph.engine.get_engine`) instead.
     """
 
     def __init__(self, params: Dict[Any, Any]) -> None:
@@ -40,23 +44,33 @@ class ExternalObjectHandler:
         self.params = params
 
     def upload_objects(
-        self, objects: List[str], remote_engine: "PsycopgEngine"
+        self,
+        objects: List[str],
+        remote_engine: "PsycopgEngine",
+        local_engine: Optional["PsycopgEngine"] = None,
     ) -> Sequence[Tuple[str, str]]:
         """Upload objects from the Splitgraph cache to an external location
 
         :param objects: List of object IDs to upload
         :param remote_engine: An instance of Engine class that the objects will be registered on
+        :param local_engine: Engine the objects are stored on (default: the current engine)
         :return: A list of successfully uploaded object IDs and URLs they can be found at.
         """
 
     def download_objects(
-        self, objects: List[Tuple[str, str]], remote_engine: "PsycopgEngine"
+        self,
+        objects: List[Tuple[str, str]],
+        remote_engine: "PsycopgEngine",
+        local_engine: Optional["PsycopgEngine"] = None,
     ) -> Sequence[str]:
         """Download objects from the external location into the Splitgraph cache.
 
         :param objects: List of tuples `(object_id, object_url)` that this handler had previosly
             uploaded the objects to.
         :param remote_engine: An instance of Engine class that the objects will be registered on
+        :param local_engine: Engine to download the objects into (default: the current engine).
+            This can be called from a background thread, in which case this is an engine
+            with its own connection pool.
         :return: A list of object IDs that have been successfully downloaded.
         """
 
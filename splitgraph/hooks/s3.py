@@ -2,12 +2,25 @@
 Plugin for uploading Splitgraph objects from the cache to an external S3-like object store
 """
 import logging
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Tuple, TYPE_CHECKING
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TYPE_CHECKING,
+)
 
 from tqdm import tqdm
 
 from splitgraph.config import CONFIG, get_singleton, SG_CMD_ASCII
+from splitgraph.core.output import pretty_size
 from splitgraph.engine import get_engine, ResultShape
 from splitgraph.exceptions import IncompleteObjectUploadError, IncompleteObjectDownloadError
 from splitgraph.hooks.external_objects import ExternalObjectHandler
@@ -45,6 +58,58 @@ def get_object_download_urls(remote_engine, remote_object_ids):
     return urls
 
 
+TransferResult = Tuple[Optional[str], Optional[Dict[str, float]]]
+
+
+class _URLRequestError(Exception):
+    """Raised by `_transfer_in_windows` if getting URLs for a window of objects failed."""
+
+    def __init__(self, reason: BaseException) -> None:
+        super().__init__(str(reason))
+        self.reason = reason
+
+
+def _transfer_in_windows(
+    objects: Sequence[Any],
+    get_urls: Callable[[Sequence[Any]], List[List[str]]],
+    worker: Callable[[Tuple[Any, List[str]]], TransferResult],
+    worker_threads: int,
+    window: int,
+) -> Iterator[TransferResult]:
+    """
+    Run the worker on every object and its URLs in a thread pool, yielding the results
+    as they come in.
+
+    Pre-signed URLs expire soon after the registry issues them, so instead of getting
+    URLs for all objects upfront, get them in windows of `window` objects, just before
+    the workers need them. If that fails, transfers that have already started are
+    finished and their results yielded before raising `_URLRequestError`.
+    """
+    pending: Set["Future[TransferResult]"] = set()
+    urls: List[List[str]] = []
+    position = 0
+    error: Optional[Exception] = None
+    with ThreadPoolExecutor(max_workers=worker_threads) as tpe:
+        while (position < len(objects) and not error) or pending:
+            while not error and position < len(objects) and len(pending) < worker_threads:
+                if not urls:
+                    try:
+                        urls = list(get_urls(objects[position : position + window]))
+                    except Exception as e:
+                        logging.error("Error getting URLs for objects: %s", str(e))
+                        error = e
+                        break
+                pending.add(tpe.submit(worker, (objects[position], urls.pop(0))))
+                position += 1
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    if error:
+        raise _URLRequestError(error) from error
+
+
 class S3ExternalObjectHandler(ExternalObjectHandler):
     """Uploads/downloads the objects to/from S3/S3-compatible host using the Minio client.
 
@@ -52,28 +117,76 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
         GET/PUT URLs.
 
         The handler supports a parameter `threads` specifying the number of threads
-        used to upload the objects.
+        used to upload the objects and a parameter `url_window` specifying how many
+        objects to get pre-signed URLs for at a time (by default, twice the number
+        of threads).
+
+        After every upload/download, `transfer_stats` contains the number of objects
+        and bytes that the engine transferred and the time it took.
     """
 
+    def __init__(self, params: Dict[Any, Any]) -> None:
+        super().__init__(params)
+        self.transfer_stats: Dict[str, float] = {"objects": 0, "bytes": 0, "seconds": 0.0}
+
+    def _track_transfers(
+        self,
+        results: Iterator[TransferResult],
+        successful: List[str],
+        total: int,
+        unit: str,
+        verb: str,
+    ) -> None:
+        # Consume (object ID, engine transfer stats) results of workers, showing progress
+        # and throughput and recording the totals in self.transfer_stats.
+        transferred = 0
+        start = time.time()
+        pbar = tqdm(results, total=total, unit=unit, ascii=SG_CMD_ASCII)
+        try:
+            for object_id, stats in pbar:
+                if not object_id:
+                    continue
+                successful.append(object_id)
+                transferred += int(stats["bytes"]) if stats else 0
+                pbar.set_postfix(
+                    object=object_id[:10] + "...",
+                    speed=pretty_size(transferred / max(time.time() - start, 1e-3)) + "/s",
+                )
+        finally:
+            elapsed = time.time() - start
+            self.transfer_stats = {
+                "objects": len(successful),
+                "bytes": transferred,
+                "seconds": elapsed,
+            }
+            logging.info(
+                "%s %d object(s) (%s) in %.2fs",
+                verb,
+                len(successful),
+                pretty_size(transferred),
+                elapsed,
+            )
+
     def upload_objects(
-        self, objects: List[str], remote_engine: "PsycopgEngine"
+        self,
+        objects: List[str],
+        remote_engine: "PsycopgEngine",
+        local_engine: Optional["PsycopgEngine"] = None,
     ) -> List[Tuple[str, str]]:
         """
         Upload objects to Minio
 
         :param remote_engine: Remote Engine class
         :param objects: List of object IDs to upload
+        :param local_engine: Engine the objects are stored on (default: the current engine)
         :return: List of tuples with successfully uploaded objects and their URLs.
         """
         worker_threads = self.params.get(
             "threads", int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1
         )
+        window = self.params.get("url_window", worker_threads * 2)
 
-        # Determine upload URLs
-        logging.info("Getting upload URLs from the registry...")
-        urls = get_object_upload_urls(remote_engine, objects)
-
-        local_engine = get_engine()
+        local_engine = local_engine or get_engine()
 
         def _do_upload(object_url):
             object_id, url = object_url
@@ -81,26 +194,27 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
             # just the first one for logging)
             logging.debug("%s -> %s", object_id, url[0])
             try:
-                local_engine.run_api_call("upload_object", object_id, url)
-                return object_id
+                return object_id, local_engine.run_api_call("upload_object", object_id, url)
             except Exception:
                 logging.exception("Error uploading object %s", object_id)
-                return None
+                return None, None
 
         successful: List[str] = []
         try:
             local_engine.autocommit = True
-            with ThreadPoolExecutor(max_workers=worker_threads) as tpe:
-                pbar = tqdm(
-                    tpe.map(_do_upload, zip(objects, urls)),
-                    total=len(objects),
-                    unit="objs",
-                    ascii=SG_CMD_ASCII,
-                )
-                for object_id in pbar:
-                    if object_id:
-                        successful.append(object_id)
-                        pbar.set_postfix(object=object_id[:10] + "...")
+            self._track_transfers(
+                _transfer_in_windows(
+                    objects,
+                    lambda batch: get_object_upload_urls(remote_engine, batch),
+                    _do_upload,
+                    worker_threads,
+                    window,
+                ),
+                successful,
+                len(objects),
+                "objs",
+                "Uploaded",
+            )
             if len(successful) < len(objects):
                 raise IncompleteObjectUploadError(
                     reason=None, successful_objects=successful, successful_object_urls=successful,
@@ -108,42 +222,45 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
             # The "URL" in this case is the same object ID: we ask the registry
             # for the actual URL by giving it the object ID.
             return [(s, s) for s in successful]
-        except KeyboardInterrupt as e:
+        except (KeyboardInterrupt, _URLRequestError) as e:
             raise IncompleteObjectUploadError(
-                reason=e, successful_objects=successful, successful_object_urls=successful,
+                reason=e.reason if isinstance(e, _URLRequestError) else e,
+                successful_objects=successful,
+                successful_object_urls=successful,
             )
         finally:
             local_engine.autocommit = False
             local_engine.close_others()
 
     def download_objects(
-        self, objects: List[Tuple[str, str]], remote_engine: "PsycopgEngine"
+        self,
+        objects: List[Tuple[str, str]],
+        remote_engine: "PsycopgEngine",
+        local_engine: Optional["PsycopgEngine"] = None,
     ) -> List[str]:
         """
         Download objects from Minio.
 
         :param objects: List of (object ID, object URL (object ID it's stored under))
+        :param remote_engine: Engine to get the object URLs from
+        :param local_engine: Engine to download the objects into (default: the current engine)
         """
         # By default, take up the whole connection pool with downloaders
         # (less one connection for the main thread that handles metadata)
         worker_threads = self.params.get(
             "threads", int(get_singleton(CONFIG, "SG_ENGINE_POOL")) - 1
         )
+        window = self.params.get("url_window", worker_threads * 2)
 
-        logging.info("Getting download URLs from registry %s...", remote_engine)
-        object_ids = [o[0] for o in objects]
-        remote_object_ids = [o[1] for o in objects]
-        urls = get_object_download_urls(remote_engine, remote_object_ids)
-
-        local_engine = get_engine()
+        local_engine = local_engine or get_engine()
 
         def _do_download(object_url):
-            object_id, url = object_url
+            (object_id, _), url = object_url
             logging.debug("%s -> %s", url[0], object_id)
 
             try:
-                local_engine.run_api_call("download_object", object_id, url)
-                local_engine.mount_object(object_id)
+                # This also mounts the object on the engine.
+                stats = local_engine.download_object_from_urls(object_id, url)
             except Exception as e:
                 logging.error("Error downloading object %s: %s", object_id, str(e))
 
@@ -152,9 +269,9 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
                 # we inspect the filesystem to see the list of downloaded objects).
                 # TODO figure out a flow for just remounting objects whose files we already have.
                 local_engine.delete_objects([object_id])
-                return None
+                return None, None
 
-            return object_id
+            return object_id, stats
 
         successful: List[str] = []
 
@@ -165,23 +282,27 @@ class S3ExternalObjectHandler(ExternalObjectHandler):
             # resets the SD and GD dictionaries so it's not possible to cache those modules
             # there either.
             local_engine.autocommit = True
-            with ThreadPoolExecutor(max_workers=worker_threads) as tpe:
-                # Evaluate the results so that exceptions thrown by the downloader get raised
-                pbar = tqdm(
-                    tpe.map(_do_download, zip(object_ids, urls)),
-                    total=len(objects),
-                    unit="obj",
-                    ascii=SG_CMD_ASCII,
-                )
-                for object_id in pbar:
-                    if object_id:
-                        successful.append(object_id)
-                        pbar.set_postfix(object=object_id[:10] + "...")
-            if len(successful) < len(object_ids):
+            # Evaluate the results so that exceptions thrown by the downloader get raised
+            self._track_transfers(
+                _transfer_in_windows(
+                    objects,
+                    lambda batch: get_object_download_urls(remote_engine, [o[1] for o in batch]),
+                    _do_download,
+                    worker_threads,
+                    window,
+                ),
+                successful,
+                len(objects),
+                "obj",
+                "Downloaded",
+            )
+            if len(successful) < len(objects):
                 raise IncompleteObjectDownloadError(reason=None, successful_objects=successful)
             return successful
         except KeyboardInterrupt as e:
             raise IncompleteObjectDownloadError(reason=e, successful_objects=successful)
+        except _URLRequestError as e:
+            raise IncompleteObjectDownloadError(reason=e.reason, successful_objects=successful)
         finally:
             # Flip the engine back and close all but one pool connection.
             local_engine.autocommit = False
@@ -0,0 +1,14 @@
+-- Track how often cached objects are used, for eviction policies based on access frequency.
+--
+-- access_count: number of times the object has been claimed since it was added to the cache.
+-- inflation:    the cache's inflation value at the time the object was last claimed.
+ALTER TABLE splitgraph_meta.object_cache_status
+    ADD COLUMN access_count integer NOT NULL DEFAULT 0;
+
+ALTER TABLE splitgraph_meta.object_cache_status
+    ADD COLUMN inflation double precision NOT NULL DEFAULT 0;
+
+-- Inflation value used for dynamic aging by the eviction policies (raised to the score of
+-- the last evicted object on every eviction).
+ALTER TABLE splitgraph_meta.object_cache_occupancy
+    ADD COLUMN inflation double precision NOT NULL DEFAULT 0;
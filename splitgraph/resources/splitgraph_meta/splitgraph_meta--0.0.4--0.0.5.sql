@@ -0,0 +1,17 @@
+-- Background cache evictors (sgr evict --daemon or threads in long-lived processes)
+-- that keep the object cache occupancy under a low watermark.
+--
+-- evictor_id: hostname, process ID and sequence number of the evictor in the process.
+-- heartbeat:  Timestamp (UTC) of the evictor's last run. Evictors that haven't run for
+--             a few intervals are considered to have stopped.
+-- interval:   Time between the evictor's runs, in seconds.
+CREATE TABLE splitgraph_meta.object_cache_evictor (
+    evictor_id varchar NOT NULL PRIMARY KEY,
+    started timestamp NOT NULL,
+    heartbeat timestamp NOT NULL,
+    interval double precision NOT NULL,
+    runs bigint NOT NULL DEFAULT 0,
+    evictions bigint NOT NULL DEFAULT 0,
+    bytes_freed bigint NOT NULL DEFAULT 0,
+    last_error varchar
+);
@@ -0,0 +1,11 @@
+-- Views over fragments created by layered checkouts (sgr checkout -l -d). The fragments
+-- stay claimed in the object cache until the view is dropped.
+--
+-- schema_name, table_name: Location of the view.
+-- object_ids:               Fragments the view reads from.
+CREATE TABLE splitgraph_meta.fragment_views (
+    schema_name varchar NOT NULL,
+    table_name varchar NOT NULL,
+    object_ids varchar[] NOT NULL,
+    PRIMARY KEY (schema_name, table_name)
+);
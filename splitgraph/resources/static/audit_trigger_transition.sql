@@ -0,0 +1,196 @@
+-- Statement-level change tracking. Instead of running the audit trigger
+-- (audit_trigger.sql) for every changed row, these triggers run once per statement
+-- and log all rows that it changed in bulk, reading them from transition tables.
+--
+-- Changes are logged into splitgraph_audit.logged_actions in the same format as
+-- the row-level audit trigger uses, so they're read and committed the same way.
+-- An UPDATE of a row that keeps its primary key is logged as the old row and
+-- the new values of the changed columns. If the primary key changes or the table
+-- doesn't have one, the UPDATE is logged as a DELETE of the old row and an INSERT
+-- of the new one (old and new rows can't be matched up otherwise).
+CREATE OR REPLACE FUNCTION splitgraph_audit.log_inserts_transition ()
+    RETURNS TRIGGER
+    AS $body$
+BEGIN
+    INSERT INTO splitgraph_audit.logged_actions (schema_name, table_name, action, row_data)
+    SELECT
+        TG_TABLE_SCHEMA::text,
+        TG_TABLE_NAME::text,
+        'I',
+        row_to_json(n)::jsonb
+    FROM
+        new_rows n;
+    RETURN NULL;
+END;
+$body$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = pg_catalog, public;
+
+CREATE OR REPLACE FUNCTION splitgraph_audit.log_deletes_transition ()
+    RETURNS TRIGGER
+    AS $body$
+BEGIN
+    INSERT INTO splitgraph_audit.logged_actions (schema_name, table_name, action, row_data)
+    SELECT
+        TG_TABLE_SCHEMA::text,
+        TG_TABLE_NAME::text,
+        'D',
+        row_to_json(o)::jsonb
+    FROM
+        old_rows o;
+    RETURN NULL;
+END;
+$body$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = pg_catalog, public;
+
+CREATE OR REPLACE FUNCTION splitgraph_audit.log_updates_transition ()
+    RETURNS TRIGGER
+    AS $body$
+DECLARE
+    non_pk_cols text[];
+BEGIN
+    -- Columns that aren't a part of the primary key (NULL if there's no primary key).
+    -- Removing them from a row leaves just the primary key, which we match rows on.
+    SELECT
+        ARRAY (
+            SELECT
+                a.attname::text
+            FROM
+                pg_attribute a
+            WHERE
+                a.attrelid = i.indrelid
+                AND a.attnum > 0
+                AND NOT a.attisdropped
+                AND a.attnum <> ALL (i.indkey)) INTO non_pk_cols
+    FROM
+        pg_index i
+    WHERE
+        i.indrelid = TG_RELID
+        AND i.indisprimary;
+    IF non_pk_cols IS NULL THEN
+        -- Without a primary key, log rows that the statement changed as
+        -- deletions of old rows and insertions of new ones.
+        INSERT INTO splitgraph_audit.logged_actions (schema_name, table_name, action, row_data)
+        SELECT
+            TG_TABLE_SCHEMA::text,
+            TG_TABLE_NAME::text,
+            'D',
+            d.row_data
+        FROM ((
+                SELECT
+                    row_to_json(o)::jsonb AS row_data
+                FROM
+                    old_rows o)
+            EXCEPT ALL (
+                SELECT
+                    row_to_json(n)::jsonb
+                FROM
+                    new_rows n)) d;
+        INSERT INTO splitgraph_audit.logged_actions (schema_name, table_name, action, row_data)
+        SELECT
+            TG_TABLE_SCHEMA::text,
+            TG_TABLE_NAME::text,
+            'I',
+            i.row_data
+        FROM ((
+                SELECT
+                    row_to_json(n)::jsonb AS row_data
+                FROM
+                    new_rows n)
+            EXCEPT ALL (
+                SELECT
+                    row_to_json(o)::jsonb
+                FROM
+                    old_rows o)) i;
+        RETURN NULL;
+    END IF;
+    -- Log deletions first and insertions last, same as the row-level trigger would
+    -- if the primary key of one row was changed to the old primary key of another one.
+    INSERT INTO splitgraph_audit.logged_actions (schema_name, table_name, action, row_data,
+        changed_fields)
+    SELECT
+        TG_TABLE_SCHEMA::text,
+        TG_TABLE_NAME::text,
+        c.action,
+        c.row_data,
+        c.changed_fields
+    FROM (
+        SELECT
+            CASE WHEN n.row_data IS NULL THEN
+                'D'
+            WHEN o.row_data IS NULL THEN
+                'I'
+            ELSE
+                'U'
+            END AS action,
+            coalesce(o.row_data, n.row_data) AS row_data,
+            d.changed_fields
+        FROM (
+            SELECT
+                row_to_json(o)::jsonb AS row_data
+            FROM
+                old_rows o) o
+        FULL OUTER JOIN (
+            SELECT
+                row_to_json(n)::jsonb AS row_data
+            FROM
+                new_rows n) n ON o.row_data - non_pk_cols = n.row_data - non_pk_cols
+        LEFT JOIN LATERAL (
+            -- Same as in the row-level trigger
+            SELECT
+                jsonb_object_agg(tmp_new_row.key, tmp_new_row.value) AS changed_fields
+            FROM
+                jsonb_each_text(n.row_data) AS tmp_new_row
+                JOIN jsonb_each_text(o.row_data) AS tmp_old_row ON (tmp_new_row.key =
+                    tmp_old_row.key
+                        AND tmp_new_row.value IS DISTINCT FROM tmp_old_row.value)) d ON TRUE) c
+    WHERE
+        c.action <> 'U'
+        OR c.changed_fields IS NOT NULL
+    ORDER BY
+        CASE c.action
+        WHEN 'D' THEN
+            0
+        WHEN 'U' THEN
+            1
+        ELSE
+            2
+        END;
+    RETURN NULL;
+END;
+$body$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = pg_catalog, public;
+
+CREATE OR REPLACE FUNCTION splitgraph_audit.audit_table_transition (
+    target_table regclass
+)
+    RETURNS void
+    AS $body$
+BEGIN
+    EXECUTE 'DROP TRIGGER IF EXISTS audit_trigger_row ON ' || target_table;
+    EXECUTE 'DROP TRIGGER IF EXISTS audit_trigger_transition_insert ON ' || target_table;
+    EXECUTE 'DROP TRIGGER IF EXISTS audit_trigger_transition_update ON ' || target_table;
+    EXECUTE 'DROP TRIGGER IF EXISTS audit_trigger_transition_delete ON ' || target_table;
+    -- Transition tables can't be used by triggers that fire on multiple events,
+    -- so we need a trigger for every event.
+    EXECUTE 'CREATE TRIGGER audit_trigger_transition_insert AFTER INSERT ON '
+        || target_table || ' REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT '
+        || 'EXECUTE PROCEDURE splitgraph_audit.log_inserts_transition()';
+    EXECUTE 'CREATE TRIGGER audit_trigger_transition_update AFTER UPDATE ON '
+        || target_table || ' REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows '
+        || 'FOR EACH STATEMENT EXECUTE PROCEDURE splitgraph_audit.log_updates_transition()';
+    EXECUTE 'CREATE TRIGGER audit_trigger_transition_delete AFTER DELETE ON '
+        || target_table || ' REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT '
+        || 'EXECUTE PROCEDURE splitgraph_audit.log_deletes_transition()';
+END;
+$body$
+LANGUAGE 'plpgsql';
+
+COMMENT ON FUNCTION splitgraph_audit.audit_table_transition (regclass) IS $body$
+Add statement-level auditing support to a table.
+
+Arguments:
+   target_table:     Table name, schema qualified if not on search_path
+$body$;
@@ -14,27 +14,40 @@ $$
 LANGUAGE plpython3u
 SECURITY INVOKER;
 
+-- Drop the function first in case it's been installed by an older version
+-- that didn't return transfer statistics.
+DROP FUNCTION IF EXISTS splitgraph_api.upload_object (varchar, varchar[]);
+
 CREATE OR REPLACE FUNCTION splitgraph_api.upload_object (
     object_id varchar,
     urls varchar[]
 )
-    RETURNS void
+    RETURNS json
     AS $BODY$
+    import json
     from splitgraph.core.server import upload_object
-    upload_object(object_id, urls)
+    return json.dumps(upload_object(object_id, urls))
 
 $BODY$
 LANGUAGE plpython3u
 VOLATILE;
 
+DROP FUNCTION IF EXISTS splitgraph_api.download_object (varchar, varchar[]);
+DROP FUNCTION IF EXISTS splitgraph_api.download_object (varchar, varchar[], varchar);
+
+-- Also return the object's schema (saves a roundtrip to the engine when
+-- mounting every downloaded object).
 CREATE OR REPLACE FUNCTION splitgraph_api.download_object (
     object_id varchar,
     urls varchar[]
 )
-    RETURNS void
+    RETURNS json
     AS $BODY$
-    from splitgraph.core.server import download_object
-    download_object(object_id, urls)
+    import json
+    from splitgraph.core.server import download_object, get_object_schema
+    result = download_object(object_id, urls)
+    result["schema"] = json.loads(get_object_schema(object_id))
+    return json.dumps(result)
 
 $BODY$
 LANGUAGE plpython3u
@@ -74,6 +87,49 @@ $BODY$
 LANGUAGE plpython3u
 VOLATILE;
 
+CREATE OR REPLACE FUNCTION splitgraph_api.discard_object_files (
+    object_id varchar
+)
+    RETURNS void
+    AS $BODY$
+    from splitgraph.core.server import discard_object_files
+    discard_object_files(object_id)
+$BODY$
+LANGUAGE plpython3u
+VOLATILE;
+
+CREATE OR REPLACE FUNCTION splitgraph_api.restore_discarded_files (
+    object_id varchar
+)
+    RETURNS void
+    AS $BODY$
+    from splitgraph.core.server import restore_discarded_files
+    restore_discarded_files(object_id)
+$BODY$
+LANGUAGE plpython3u
+VOLATILE;
+
+CREATE OR REPLACE FUNCTION splitgraph_api.list_discarded_objects ()
+    RETURNS varchar[]
+    AS $BODY$
+    from splitgraph.core.server import list_discarded_objects
+    return list_discarded_objects()
+$BODY$
+LANGUAGE plpython3u
+VOLATILE;
+
+DROP FUNCTION IF EXISTS splitgraph_api.purge_discarded_files ();
+CREATE OR REPLACE FUNCTION splitgraph_api.purge_discarded_files (
+    object_ids varchar[]
+)
+    RETURNS int
+    AS $BODY$
+    from splitgraph.core.server import purge_discarded_files
+    return purge_discarded_files(object_ids)
+$BODY$
+LANGUAGE plpython3u
+VOLATILE;
+
 CREATE OR REPLACE FUNCTION splitgraph_api.get_object_size (
     object_id varchar
 )
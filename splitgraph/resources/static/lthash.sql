@@ -0,0 +1,40 @@
+-- Engine-side homomorphic (LtHash-like) hashing of table fragments. Mirrors
+-- splitgraph.core.fragment_manager.Digest: every row digest is a vector of 16
+-- big-endian unsigned shorts and the hash of a set of rows is the component-wise
+-- sum of the row digests with 16-bit wraparound.
+-- Summing on the engine means that hashing a fragment returns a single row
+-- instead of shipping one 32-byte digest per row to the client.
+CREATE SCHEMA IF NOT EXISTS splitgraph_api;
+
+-- lthash_sum(digest_query): run a query that returns one sha256 digest (bytea) per row
+-- and return the sum of these digests as a 64-character hex string together with
+-- the number of rows.
+-- The components are summed up with builtin aggregates (which is much faster than a
+-- custom aggregate with an SQL/plpgsql transition function and can run in parallel)
+-- and only wrapped around at the end: overflowing a bigint requires more than 10^14 rows.
+CREATE OR REPLACE FUNCTION splitgraph_api.lthash_sum (
+    digest_query text
+)
+    RETURNS TABLE (
+            content_hash varchar,
+            row_count bigint
+        )
+        AS $$
+DECLARE
+    sums bigint[];
+BEGIN
+    -- OFFSET 0 stops the planner from inlining the subquery and recomputing
+    -- the digest for every component.
+    EXECUTE 'SELECT count(d), ARRAY[' || (
+        SELECT string_agg(format('sum(get_byte(d, %s) * 256 + get_byte(d, %s))',
+		    2 * i, 2 * i + 1), ',' ORDER BY i)
+        FROM generate_series(0, 15) i) || '] FROM (' || digest_query || ' OFFSET 0) digests(d)'
+    INTO row_count, sums;
+    content_hash = (
+        SELECT string_agg(lpad(to_hex(coalesce(sums[i], 0) % 65536), 4, '0'), '' ORDER BY i)
+        FROM generate_series(1, 16) i);
+    RETURN NEXT;
+END
+$$
+LANGUAGE plpgsql
+SECURITY INVOKER;
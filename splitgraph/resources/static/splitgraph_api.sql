@@ -536,6 +536,73 @@ $$
 LANGUAGE plpgsql
 SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
 
+-- bulk_add_objects(): same as add_object, but registers all objects staged in the
+-- pg_temp.sg_tmp_objects table (loaded with COPY, all columns as text) in one statement.
+-- Privileges are checked once for every distinct namespace that's being written to or overwritten.
+CREATE OR REPLACE FUNCTION splitgraph_api.bulk_add_objects ()
+    RETURNS void
+    AS $$
+DECLARE
+    ns varchar;
+BEGIN
+    FOR ns IN
+    SELECT s.namespace
+    FROM pg_temp.sg_tmp_objects s
+    UNION
+    SELECT o.namespace
+    FROM splitgraph_meta.objects o
+        JOIN pg_temp.sg_tmp_objects s ON o.object_id = s.object_id LOOP
+            PERFORM splitgraph_api.check_privilege (ns);
+        END LOOP;
+    INSERT INTO splitgraph_meta.objects (object_id, format, namespace, size,
+	created, insertion_hash, deletion_hash, INDEX, rows_inserted, rows_deleted)
+    SELECT s.object_id,
+        s.format,
+        s.namespace,
+        s.size::bigint,
+        s.created::timestamp,
+        s.insertion_hash,
+        s.deletion_hash,
+        s.index::jsonb,
+        s.rows_inserted::integer,
+        s.rows_deleted::integer
+    FROM pg_temp.sg_tmp_objects s
+    ON CONFLICT (object_id)
+        DO UPDATE SET
+	    format = EXCLUDED.format, namespace = EXCLUDED.namespace, size = EXCLUDED.size,
+		created = EXCLUDED.created, insertion_hash = EXCLUDED.insertion_hash,
+		deletion_hash = EXCLUDED.deletion_hash, INDEX = EXCLUDED.index,
+		rows_inserted = EXCLUDED.rows_inserted, rows_deleted = EXCLUDED.rows_deleted;
+END
+$$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
+
+-- bulk_add_object_locations(): same as add_object_location for all locations staged in
+-- the pg_temp.sg_tmp_object_locations table.
+CREATE OR REPLACE FUNCTION splitgraph_api.bulk_add_object_locations ()
+    RETURNS void
+    AS $$
+DECLARE
+    ns varchar;
+BEGIN
+    FOR ns IN SELECT DISTINCT o.namespace
+    FROM pg_temp.sg_tmp_object_locations s
+        LEFT JOIN splitgraph_meta.objects o ON o.object_id = s.object_id LOOP
+            PERFORM splitgraph_api.check_privilege (ns);
+        END LOOP;
+    INSERT INTO splitgraph_meta.object_locations (object_id, LOCATION, protocol)
+    SELECT s.object_id,
+        s.location,
+        s.protocol
+    FROM pg_temp.sg_tmp_object_locations s
+    ON CONFLICT (object_id)
+        DO UPDATE SET LOCATION = EXCLUDED.location, protocol = EXCLUDED.protocol;
+END
+$$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
+
 --
 -- TABLE API
 --
@@ -623,6 +690,35 @@ $$
 LANGUAGE plpgsql
 SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
 
+-- bulk_add_tables(): same as add_table for all tables staged in the pg_temp.sg_tmp_tables table.
+CREATE OR REPLACE FUNCTION splitgraph_api.bulk_add_tables ()
+    RETURNS void
+    AS $$
+DECLARE
+    ns varchar;
+BEGIN
+    FOR ns IN SELECT DISTINCT s.namespace
+    FROM pg_temp.sg_tmp_tables s LOOP
+        PERFORM splitgraph_api.check_privilege (ns);
+    END LOOP;
+    INSERT INTO splitgraph_meta.tables (namespace, repository, image_hash,
+	table_name, table_schema, object_ids)
+    SELECT s.namespace,
+        s.repository,
+        s.image_hash,
+        s.table_name,
+        s.table_schema::jsonb,
+        s.object_ids::varchar[]
+    FROM pg_temp.sg_tmp_tables s
+    ON CONFLICT (namespace, repository, image_hash, table_name)
+        DO UPDATE SET
+	    object_ids = splitgraph_meta.tables.object_ids ||
+		EXCLUDED.object_ids, table_schema = EXCLUDED.table_schema;
+END
+$$
+LANGUAGE plpgsql
+SECURITY DEFINER SET search_path = splitgraph_meta, pg_temp;
+
 -- get_table_size(namespace, repository, image_hash, table_name): get table size in bytes
 CREATE OR REPLACE FUNCTION splitgraph_api.get_table_size (
     _namespace varchar,
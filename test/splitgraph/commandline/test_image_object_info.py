@@ -29,6 +29,8 @@ def test_commandline_basics(pg_repo_local):
     result = runner.invoke(status_c, [])
     assert """test/pg_mount         2       0  """ in result.output
     assert pg_repo_local.head.image_hash[:8] in result.output
+    assert "Object cache: 0.00 B/" in result.output
+    assert "Background eviction: not running" in result.output
 
     # sgr status with LQ etc
     old_head.checkout(layered=True)
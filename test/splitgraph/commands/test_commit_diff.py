@@ -5,17 +5,20 @@ from functools import reduce
 from unittest import mock
 from unittest.mock import patch
 
+import psycopg2.errors
 import pytest
 from psycopg2.sql import SQL, Identifier
 from test.splitgraph.commands.test_layered_querying import _prepare_fully_remote_repo
 from test.splitgraph.conftest import OUTPUT, PG_DATA, SMALL_OBJECT_SIZE
 
-from splitgraph.config import SPLITGRAPH_META_SCHEMA
-from splitgraph.core.fragment_manager import Digest
+from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG
+from splitgraph.core.diff import drop_fragment_keys, iter_table_diff, load_fragment_keys
+from splitgraph.core.fragment_manager import Digest, FragmentManager, DeferredFragmentManager
 from splitgraph.core.metadata_manager import OBJECT_COLS
 from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import Repository
 from splitgraph.core.sql import select
+from splitgraph.core.table import Table
 from splitgraph.core.types import TableColumn
 from splitgraph.engine import ResultShape
 from splitgraph.engine.postgres.engine import PostgresEngine
@@ -38,7 +41,8 @@ def test_diff_head(pg_repo_local):
 # * SNAP: refragment and store the table as a new object(s)
 # * DIFF: delta-compress the changes and only store those
 # * DIFF_SPLIT: split changes according to fragment boundaries
-_COMMIT_MODES = ["SNAP", "DIFF", "DIFF_SPLIT"]
+# * DIFF_PARALLEL: delta-compress the changes, storing tables in parallel
+_COMMIT_MODES = ["SNAP", "DIFF", "DIFF_SPLIT", "DIFF_PARALLEL"]
 
 
 def _commit(repo, mode, **kwargs):
@@ -48,6 +52,8 @@ def _commit(repo, mode, **kwargs):
         return repo.commit(snap_only=False, split_changeset=False, **kwargs)
     if mode == "DIFF_SPLIT":
         return repo.commit(snap_only=False, split_changeset=True, **kwargs)
+    if mode == "DIFF_PARALLEL":
+        return repo.commit(snap_only=False, split_changeset=False, table_workers=4, **kwargs)
 
 
 @pytest.mark.parametrize("mode", _COMMIT_MODES)
@@ -104,6 +110,101 @@ def test_commit_diff(mode, pg_repo_local):
     assert pg_repo_local.diff("vegetables", image_1=head, image_2=new_head) == []
 
 
+@pytest.mark.parametrize("mode", _COMMIT_MODES)
+def test_commit_diff_statement_level(mode, pg_repo_local):
+    # Check out the repository with statement-level audit triggers
+    schema = pg_repo_local.to_schema()
+    with patch.dict(CONFIG, {"SG_CHANGE_TRACKING_OVERRIDE": schema + ":statement"}):
+        pg_repo_local.uncheckout()
+        pg_repo_local.images["latest"].checkout()
+
+    assert (schema, "fruits") in pg_repo_local.engine.get_tracked_tables()
+    assert pg_repo_local.engine.run_sql(
+        "SELECT trigger_name FROM information_schema.triggers "
+        "WHERE event_object_schema = %s AND event_object_table = 'fruits' "
+        "ORDER BY trigger_name",
+        (schema,),
+        return_shape=ResultShape.MANY_ONE,
+    ) == [
+        "audit_trigger_transition_delete",
+        "audit_trigger_transition_insert",
+        "audit_trigger_transition_update",
+    ]
+
+    pg_repo_local.run_sql(
+        """INSERT INTO fruits VALUES (3, 'mayonnaise'), (4, 'mustard');
+        DELETE FROM fruits WHERE name IN ('apple', 'mustard');
+        UPDATE fruits SET name = 'guitar' WHERE fruit_id = 2;
+        UPDATE fruits SET name = 'guitar' WHERE fruit_id = 2"""
+    )
+
+    # Every statement logs all rows it changed, in the same format as the row-level trigger
+    # (including updates that don't change anything not being logged).
+    assert sorted(pg_repo_local.engine.get_pending_changes(schema, "fruits", aggregate=True)) == [
+        (0, 3),
+        (1, 3),
+    ]
+
+    head = pg_repo_local.head
+    new_head = _commit(pg_repo_local, mode)
+    assert pg_repo_local.diff("fruits", image_1=new_head, image_2=None) == []
+    assert sorted(pg_repo_local.diff("fruits", image_1=head, image_2=new_head)) == [
+        (False, (1, "apple")),
+        (False, (2, "orange")),
+        (True, (2, "guitar")),
+        (True, (3, "mayonnaise")),
+    ]
+
+    # Tables stay tracked with statement-level triggers after the commit
+    assert (schema, "fruits") in pg_repo_local.engine.get_tracked_tables()
+    assert not pg_repo_local.engine.has_pending_changes(schema)
+    pg_repo_local.uncheckout()
+    assert (schema, "fruits") not in pg_repo_local.engine.get_tracked_tables()
+
+
+def test_commit_parallel_failure(pg_repo_local):
+    pg_repo_local.run_sql(
+        """INSERT INTO fruits VALUES (3, 'mayonnaise');
+        INSERT INTO vegetables VALUES (3, 'cucumber')"""
+    )
+    head = pg_repo_local.head
+
+    # Tables that fail to be stored by the workers get stored serially.
+    with patch.object(DeferredFragmentManager, "_store_changesets", side_effect=ValueError):
+        new_head = pg_repo_local.commit(table_workers=2)
+
+    assert pg_repo_local.head == new_head
+    assert pg_repo_local.diff("fruits", image_1=head, image_2=new_head) == [
+        (True, (3, "mayonnaise"))
+    ]
+    assert pg_repo_local.diff("vegetables", image_1=head, image_2=new_head) == [
+        (True, (3, "cucumber"))
+    ]
+
+    # If a table can't be stored at all, the image isn't created and the changes are kept.
+    pg_repo_local.run_sql("DELETE FROM fruits WHERE fruit_id = 3")
+    pg_repo_local.commit_engines()
+    images = pg_repo_local.images()
+    with patch.object(FragmentManager, "_store_changesets", side_effect=ValueError):
+        with pytest.raises(ValueError):
+            pg_repo_local.commit(table_workers=2)
+    pg_repo_local.rollback_engines()
+
+    assert pg_repo_local.images() == images
+    assert pg_repo_local.head == new_head
+    assert pg_repo_local.has_pending_changes()
+
+    # Objects that the workers stored get deleted if the image isn't created.
+    objects = pg_repo_local.objects.get_all_objects()
+    with patch.object(DeferredFragmentManager, "register_deferred", side_effect=ValueError):
+        with pytest.raises(ValueError):
+            pg_repo_local.commit(table_workers=2)
+    pg_repo_local.rollback_engines()
+
+    assert pg_repo_local.images() == images
+    assert sorted(pg_repo_local.objects.get_downloaded_objects()) == sorted(objects)
+
+
 def _compare_object_meta(meta, expected, size_tolerance=150):
     """Check that the object metadata is as expected -- everything
     must be exactly equal apart from size which can vary within `size_tolerance`."""
@@ -231,6 +332,60 @@ def test_commit_chunking_order(local_engine_empty):
         ) == list(range(max_key, min_key - 1, -1))
 
 
+def test_commit_chunking_parallel(local_engine_empty):
+    # Check that chunking a table in parallel (with a composite PK) produces
+    # the same objects as chunking it serially.
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key_1 INTEGER, key_2 VARCHAR, value INTEGER, "
+        "PRIMARY KEY (key_1, key_2))"
+    )
+    for i in range(23):
+        OUTPUT.run_sql(
+            "INSERT INTO test VALUES (%s, %s, %s)", (i // 3, chr(ord("z") - i % 3), i * 2)
+        )
+
+    head = OUTPUT.commit(chunk_size=5, workers=4)
+    objects = head.get_table("test").objects
+    assert len(objects) == 5
+
+    # Make sure the chunks don't overlap and include all rows
+    all_rows = []
+    for obj in objects:
+        all_rows.extend(
+            local_engine_empty.run_sql(
+                SQL("SELECT key_1, key_2 FROM {}.{} ORDER BY key_1, key_2").format(
+                    Identifier(SPLITGRAPH_META_SCHEMA), Identifier(obj)
+                )
+            )
+        )
+    assert all_rows == OUTPUT.run_sql("SELECT key_1, key_2 FROM test ORDER BY key_1, key_2")
+    object_meta = OUTPUT.objects.get_object_meta(objects)
+    assert [object_meta[o].rows_inserted for o in objects] == [5, 5, 5, 5, 3]
+
+    # Same objects are produced by the serial chunking.
+    head_serial = OUTPUT.commit(chunk_size=5, snap_only=True)
+    assert head_serial.get_table("test").objects == objects
+
+
+def test_commit_chunking_parallel_rollback(local_engine_empty):
+    # Objects written by the workers are committed on their own connections: check they're
+    # deleted if the main transaction gets rolled back.
+    OUTPUT.init()
+    OUTPUT.run_sql("CREATE TABLE test (key INTEGER PRIMARY KEY, value INTEGER)")
+    OUTPUT.run_sql("INSERT INTO test SELECT i, i * 2 FROM generate_series(1, 20) i")
+    OUTPUT.commit_engines()
+
+    with patch.object(FragmentManager, "register_objects", side_effect=ValueError("fail")):
+        with pytest.raises(ValueError):
+            OUTPUT.commit(chunk_size=5, workers=4)
+    OUTPUT.rollback_engines()
+
+    assert OUTPUT.objects.get_all_objects() == []
+    assert OUTPUT.objects.get_downloaded_objects() == []
+    assert OUTPUT.run_sql("SELECT COUNT(*) FROM test", return_shape=ResultShape.ONE_ONE) == 20
+
+
 def test_commit_diff_splitting(local_engine_empty):
     # Similar setup to the chunking test
     OUTPUT.init()
@@ -951,6 +1106,78 @@ def test_diff_staging_aggregation(pg_repo_local):
     ]
 
 
+def test_diff_fragment_aware(pg_repo_local):
+    # Diffing two images that share fragments compares only the rows that the fragments
+    # not shared by the two images touch, without materializing the tables.
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    base = pg_repo_local.commit()
+    pg_repo_local.run_sql(
+        """UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 1;
+        INSERT INTO fruits VALUES (3, 'mayonnaise')"""
+    )
+    left = pg_repo_local.commit()
+
+    base.checkout()
+    pg_repo_local.run_sql(
+        """DELETE FROM fruits WHERE fruit_id = 2;
+        INSERT INTO fruits VALUES (3, 'mustard')"""
+    )
+    right = pg_repo_local.commit()
+
+    base_objects = base.get_table("fruits").objects
+    assert left.get_table("fruits").objects[: len(base_objects)] == base_objects
+    assert right.get_table("fruits").objects[: len(base_objects)] == base_objects
+
+    with patch.object(Table, "materialize") as materialize:
+        # Removed rows come first, then added rows, both in PK order.
+        assert pg_repo_local.diff("fruits", left, right) == [
+            (False, (1, "pineapple")),
+            (False, (2, "orange")),
+            (False, (3, "mayonnaise")),
+            (True, (1, "apple")),
+            (True, (3, "mustard")),
+        ]
+
+        # Aggregation only counts the rows on the engine.
+        with patch("splitgraph.core.diff._stream_rows") as stream_rows:
+            assert pg_repo_local.diff("fruits", left, right, aggregate=True) == (2, 3, 0)
+        stream_rows.assert_not_called()
+    materialize.assert_not_called()
+
+    # Same result when the tables have to be materialized
+    assert pg_repo_local.diff("fruits", left, None, aggregate=True) == (2, 3, 0)
+
+
+def test_diff_fragment_aware_cleanup(pg_repo_local):
+    # Keys tables have unique names and errors inside a diff aren't hidden by the cleanup.
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    base = pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 1")
+    left = pg_repo_local.commit()
+    base.checkout()
+    pg_repo_local.run_sql("DELETE FROM fruits WHERE fruit_id = 2")
+    right = pg_repo_local.commit()
+
+    engine = pg_repo_local.object_engine
+    table = left.get_table("fruits")
+    keys_1 = load_fragment_keys(engine, table.objects, table.table_schema)
+    keys_2 = load_fragment_keys(engine, table.objects, table.table_schema)
+    assert keys_1 != keys_2
+    drop_fragment_keys(engine, keys_1)
+    # The keys tables are dropped on commit.
+    engine.commit()
+    assert not engine.run_sql("SELECT 1 FROM pg_tables WHERE tablename = %s", (keys_2,))
+
+    with patch(
+        "splitgraph.core.diff._difference_query",
+        return_value=SQL("SELECT * FROM nonexistent_table"),
+    ):
+        with pytest.raises(psycopg2.errors.UndefinedTable):
+            list(iter_table_diff(pg_repo_local, "fruits", left.image_hash, right.image_hash))
+    pg_repo_local.engine.rollback()
+    assert pg_repo_local.diff("fruits", left, right, aggregate=True) == (1, 2, 0)
+
+
 def test_diff_schema_change(pg_repo_local):
     # Test diff when there's been a schema change and so we stored the table as a full snapshot.
     old_head = pg_repo_local.head.image_hash
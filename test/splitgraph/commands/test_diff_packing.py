@@ -1,7 +1,10 @@
+from unittest.mock import patch
+
 import pytest
 
 # Test cases: ops are a list of operations (with commit after each set);
 #             diffs are expected diffs produced by each operation.
+from splitgraph.config import CONFIG
 from splitgraph.core.fragment_manager import _conflate_changes
 
 CASES = [
@@ -120,6 +123,53 @@ def test_diff_conflation_on_commit(pg_repo_local, test_case):
         assert pg_repo_local.diff("fruits", pg_repo_local.head.parent_id, head) == expected_diff
 
 
+@pytest.mark.parametrize("test_case", CASES)
+def test_diff_conflation_on_engine(pg_repo_local, test_case):
+    engine = pg_repo_local.engine
+    with patch.dict(CONFIG, {"SG_COMMIT_CONFLATE_ON_ENGINE": "true"}):
+        for operation, expected_diff in test_case:
+            pg_repo_local.run_sql(operation)
+            pg_repo_local.commit_engines()
+
+            # Check that conflating changes on the engine has the same result as
+            # conflating the whole audit log in Python.
+            expected_changeset = _conflate_changes(
+                {}, engine.get_pending_changes("test/pg_mount", "fruits")
+            )
+            changeset = {}
+            for batch in engine.get_conflated_changes("test/pg_mount", "fruits", batch_size=1):
+                _conflate_changes(changeset, batch)
+            assert changeset == expected_changeset
+
+            head = pg_repo_local.commit()
+            assert pg_repo_local.diff("fruits", pg_repo_local.head.parent_id, head) == expected_diff
+
+
+def test_diff_conflation_on_engine_several_tables(pg_repo_local):
+    # Check that changes to several tables can be read at the same time.
+    engine = pg_repo_local.engine
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise'), (4, 'mustard')")
+    pg_repo_local.run_sql("INSERT INTO vegetables VALUES (3, 'cucumber'), (4, 'tomato')")
+    pg_repo_local.commit_engines()
+
+    fruits = engine.get_conflated_changes("test/pg_mount", "fruits", batch_size=1)
+    vegetables = engine.get_conflated_changes("test/pg_mount", "vegetables", batch_size=1)
+    fruits_changeset = _conflate_changes({}, next(fruits))
+    vegetables_changeset = _conflate_changes({}, next(vegetables))
+    for batch in fruits:
+        _conflate_changes(fruits_changeset, batch)
+    for batch in vegetables:
+        _conflate_changes(vegetables_changeset, batch)
+
+    assert fruits_changeset == _conflate_changes(
+        {}, engine.get_pending_changes("test/pg_mount", "fruits")
+    )
+    assert vegetables_changeset == _conflate_changes(
+        {}, engine.get_pending_changes("test/pg_mount", "vegetables")
+    )
+    assert len(fruits_changeset) == 2
+
+
 def test_diff_conflation_insert_same(pg_repo_local):
     pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
     pg_repo_local.commit()
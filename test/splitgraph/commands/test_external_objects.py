@@ -1,12 +1,23 @@
-from unittest.mock import patch
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, Set
+from unittest.mock import Mock, patch
 
 import pytest
 from test.splitgraph.conftest import PG_MNT
 
+from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.engine import repository_exists
 from splitgraph.core.repository import clone
+from splitgraph.core.types import TableColumn
 from splitgraph.engine import ResultShape
-from splitgraph.exceptions import IncompleteObjectUploadError, IncompleteObjectDownloadError
+from splitgraph.exceptions import (
+    IncompleteObjectUploadError,
+    IncompleteObjectDownloadError,
+    ObjectMountingError,
+)
 from splitgraph.hooks.s3 import S3ExternalObjectHandler
 from splitgraph.hooks.s3_server import (
     get_object_upload_urls,
@@ -257,3 +268,200 @@ def test_pull_download_error(local_engine_empty, unprivileged_pg_repo, clean_min
         )
         == 2
     )
+
+
+class _FlakyRangeHandler(BaseHTTPRequestHandler):
+    # Serves files from a dictionary, supports Range requests and drops the
+    # connection halfway through the first response for every file.
+    files: Dict[str, bytes] = {}
+    failed: Set[str] = set()
+    uploaded: Dict[str, bytes] = {}
+
+    def do_GET(self):
+        data = self.files[self.path]
+        start, end = 0, len(data) - 1
+        if "Range" in self.headers:
+            first, last = self.headers["Range"][len("bytes=") :].split("-")
+            start, end = int(first), min(int(last) if last else end, end)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if self.path not in self.failed:
+            self.failed.add(self.path)
+            self.wfile.write(data[start : start + (end - start + 1) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(data[start : end + 1])
+
+    def do_PUT(self):
+        self.uploaded[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_server_object_transfers():
+    from splitgraph.core import server
+
+    files = {
+        "/o1": os.urandom(1000),
+        "/o1.footer": os.urandom(100),
+        "/o1.schema": b'[[1, "key", "integer", true], [2, "val ue", "text", false]]',
+    }
+    _FlakyRangeHandler.files = files
+    httpd = HTTPServer(("localhost", 0), _FlakyRangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    base_url = "http://localhost:%d" % httpd.server_port
+    urls = [base_url + f for f in files]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with patch.object(server, "SG_ENGINE_OBJECT_PATH", tmpdir), patch.object(
+            server, "_PART_SIZE", 128
+        ), patch.object(server, "_BACKOFF", 0):
+            # Download the object in ranges: every first request for a file fails
+            # and has to be resumed.
+            stats = server.download_object("o1", urls)
+            assert stats["bytes"] == 1100 + len(files["/o1.schema"])
+            for name, data in files.items():
+                with open(os.path.join(tmpdir, name[1:]), "rb") as f:
+                    assert f.read() == data
+            assert server.list_objects() == ["o1"]
+            assert server.object_exists("o1")
+
+            stats = server.upload_object("o1", [u + ".up" for u in urls])
+            assert stats["bytes"] == 1100 + len(files["/o1.schema"])
+            assert _FlakyRangeHandler.uploaded == {k + ".up": v for k, v in files.items()}
+
+            # Discarded objects disappear straight away and can be restored.
+            server.discard_object_files("o1")
+            assert server.list_objects() == []
+            assert not server.object_exists("o1")
+            assert server.list_discarded_objects() == ["o1"]
+            server.restore_discarded_files("o1")
+            assert server.list_objects() == ["o1"]
+            assert server.list_discarded_objects() == []
+
+            # Only files of the objects that are being purged get deleted.
+            server.discard_object_files("o1")
+            assert len(os.listdir(tmpdir)) == 3
+            assert server.purge_discarded_files(["o2"]) == 0
+            assert server.purge_discarded_files(["o1"]) == 3
+            assert os.listdir(tmpdir) == []
+
+            # Failed downloads don't leave any files behind.
+            server.delete_object_files("o1")
+            with patch.object(server, "_RETRIES", 0):
+                _FlakyRangeHandler.failed = set()
+                with pytest.raises(Exception):
+                    server.download_object("o1", urls)
+            assert os.listdir(tmpdir) == []
+            assert server.list_objects() == []
+    httpd.shutdown()
+
+
+def test_download_object_from_urls_mounting(local_engine_empty):
+    # The engine returns the schema of the object it's downloaded, which is then used to mount it.
+    schema = [[1, "key", "integer", True], [2, "val ue", "text", False]]
+    urls = ["url", "url_footer", "url_schema"]
+    with patch.object(
+        local_engine_empty,
+        "run_api_call",
+        return_value={"bytes": 10, "seconds": 1.0, "schema": schema},
+    ) as run_api_call:
+        stats = local_engine_empty.download_object_from_urls("o1", urls)
+        assert stats == {"bytes": 10, "seconds": 1.0}
+        run_api_call.assert_called_once_with("download_object", "o1", urls)
+    assert local_engine_empty.get_full_table_schema(SPLITGRAPH_META_SCHEMA, "o1") == [
+        TableColumn(1, "key", "integer", False, None),
+        TableColumn(2, "val ue", "text", False, None),
+    ]
+    local_engine_empty.unmount_objects(["o1"])
+
+    # Errors mounting the object are still translated.
+    schema[1][2] = "some_unknown_type"
+    with patch.object(
+        local_engine_empty,
+        "run_api_call",
+        return_value={"bytes": 10, "seconds": 1.0, "schema": schema},
+    ):
+        with pytest.raises(ObjectMountingError):
+            local_engine_empty.download_object_from_urls("o1", urls)
+
+
+def test_s3_transfer_url_windows():
+    from splitgraph.hooks.s3 import _transfer_in_windows
+
+    # URLs are requested for a few objects at a time and every object gets its own URLs
+    url_requests = []
+
+    def get_urls(batch):
+        url_requests.append(list(batch))
+        return [["url_" + o] for o in batch]
+
+    def worker(object_urls):
+        object_id, urls = object_urls
+        assert urls == ["url_" + object_id]
+        return object_id, {"bytes": 1}
+
+    objects = ["o%d" % i for i in range(10)]
+    results = list(_transfer_in_windows(objects, get_urls, worker, worker_threads=2, window=4))
+    assert sorted(r[0] for r in results) == objects
+    assert url_requests == [objects[0:4], objects[4:8], objects[8:10]]
+
+
+def test_s3_transfer_url_window_failure():
+    # If getting URLs for a later window fails, objects from earlier windows are still
+    # reported as downloaded.
+    local_engine = Mock()
+    local_engine.download_object_from_urls.return_value = {"bytes": 1}
+    objects = [("o%d" % i, "o%d" % i) for i in range(6)]
+    error = ValueError("registry unavailable")
+
+    def get_urls(remote_engine, object_ids):
+        if object_ids[0] != "o0":
+            raise error
+        return [["url_" + o] for o in object_ids]
+
+    handler = S3ExternalObjectHandler({"threads": 2, "url_window": 3})
+    with patch("splitgraph.hooks.s3.get_object_download_urls", side_effect=get_urls):
+        with pytest.raises(IncompleteObjectDownloadError) as e:
+            handler.download_objects(objects, Mock(), local_engine=local_engine)
+
+    assert e.value.reason is error
+    assert sorted(e.value.successful_objects) == ["o0", "o1", "o2"]
+    assert local_engine.download_object_from_urls.call_count == 3
+    local_engine.close_others.assert_called_once_with()
+
+
+def test_external_handler_local_engine_compat():
+    from splitgraph.core.object_manager import _call_handler
+    from splitgraph.engine import get_engine
+    from splitgraph.engine.postgres.engine import PostgresEngine
+
+    local_engine = Mock(spec=PostgresEngine)
+
+    class Handler:
+        def download_objects(self, objects, remote_engine, local_engine=None):
+            return objects, local_engine
+
+    class OldHandler:
+        # Handlers written before local_engine was added get it as the current engine.
+        def download_objects(self, objects, remote_engine):
+            return objects, get_engine()
+
+    assert _call_handler(Handler().download_objects, local_engine, ["o1"], None) == (
+        ["o1"],
+        local_engine,
+    )
+    with pytest.warns(DeprecationWarning):
+        assert _call_handler(OldHandler().download_objects, local_engine, ["o1"], None) == (
+            ["o1"],
+            local_engine,
+        )
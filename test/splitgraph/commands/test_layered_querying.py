@@ -5,16 +5,20 @@ from datetime import datetime as dt
 from unittest import mock
 from unittest.mock import call
 
+import psycopg2.errors
 import pytest
+from click.testing import CliRunner
+from psycopg2.sql import SQL, Identifier
 from test.splitgraph.conftest import _assert_cache_occupancy, OUTPUT, prepare_lq_repo
 
+from splitgraph.commandline import status_c
 from splitgraph.config import SPLITGRAPH_META_SCHEMA, CONFIG
 from splitgraph.core.common import META_TABLES
 from splitgraph.core.fragment_manager import get_chunk_groups
 from splitgraph.core.indexing.range import extract_min_max_pks
 from splitgraph.core.object_manager import ObjectManager
 from splitgraph.core.repository import clone, Repository
-from splitgraph.core.table import _generate_select_query
+from splitgraph.core.table import _generate_select_query, Table
 from splitgraph.engine import ResultShape, _prepare_engine_config
 from splitgraph.engine.postgres.engine import PostgresEngine
 from splitgraph.exceptions import ObjectNotFoundError
@@ -147,6 +151,7 @@ class TestLayeredQuerying:
         table = lq_test_repo.head.get_table("fruits")
 
         quals, expected = ([[("fruit_id", "=", "2")]], [{"name": "guitar", "timestamp": _DT}])
+        Table.query_plan_cache.clear()
 
         # Check "query plan" is reused and the table doesn't run qual filtering again
         with mock.patch.object(
@@ -162,6 +167,34 @@ class TestLayeredQuerying:
         assert len(query_plan.required_objects) == 4
         assert len(query_plan.filtered_objects) == 2
 
+    def test_direct_table_lq_query_plan_cache_shared(self, lq_test_repo):
+        Table.query_plan_cache.clear()
+        quals = [[("fruit_id", "=", "2"), ("fruit_id", "=", "3")], [("name", "=", "guitar")]]
+        expected = [{"name": "guitar", "timestamp": _DT}]
+
+        # Check the plan is shared between tables with the same objects and that
+        # equivalent quals (with clauses in a different order) use the same plan.
+        with mock.patch.object(
+            ObjectManager, "filter_fragments", wraps=lq_test_repo.objects.filter_fragments
+        ) as fo:
+            table = lq_test_repo.head.get_table("fruits")
+            _assert_dict_list_equal(
+                table.query(columns=["name", "timestamp"], quals=quals), expected
+            )
+            assert fo.call_count == 1
+
+            table = lq_test_repo.head.get_table("fruits")
+            _assert_dict_list_equal(
+                table.query(
+                    columns=["name", "timestamp"],
+                    quals=[list(reversed(q)) for q in reversed(quals)],
+                ),
+                expected,
+            )
+            assert fo.call_count == 1
+
+        assert Table.query_plan_cache.get_stats()["hits"] == 1
+
 
 def test_layered_querying_against_single_fragment(pg_repo_local):
     # Test the case where the query is satisfied by a single fragment.
@@ -244,6 +277,183 @@ def test_lq_remote(local_engine_empty, pg_repo_remote):
     _test_lazy_lq_checkout(pg_repo_local)
 
 
+def test_lq_remote_prefetch(local_engine_empty, pg_repo_remote):
+    # With prefetching, queries to fragments are returned as soon as these fragments
+    # are downloaded and the rest are downloaded in the background.
+    prepare_lq_repo(pg_repo_remote, commit_after_every=True, include_pk=True)
+    pg_repo_local = clone(pg_repo_remote, download_all=False)
+    fruits = pg_repo_local.images["latest"].get_table("fruits")
+
+    tables, callback, plan = fruits.query_indirect(
+        columns=["fruit_id", "name"], quals=None, prefetch=True
+    )
+    assert len(plan.filtered_objects) > 1
+    assert pg_repo_local.objects.get_downloaded_objects() == []
+
+    next(tables)
+    assert (plan.singletons + plan.non_singletons)[0] in (
+        pg_repo_local.objects.get_downloaded_objects()
+    )
+    list(tables)
+    assert sorted(pg_repo_local.objects.get_downloaded_objects()) == sorted(plan.filtered_objects)
+
+    # All objects are released when the query is done.
+    callback()
+    assert (
+        pg_repo_local.engine.run_sql(
+            "SELECT COUNT(*) FROM splitgraph_meta.object_cache_status WHERE refcount > 0",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 0
+    )
+
+    for incremental in [False, True]:
+        _assert_dict_list_equal(
+            fruits.query(
+                columns=["fruit_id", "name"], quals=None, incremental=incremental, prefetch=True
+            ),
+            fruits.query(columns=["fruit_id", "name"], quals=None),
+        )
+
+
+def test_lq_checkout_prefetch(local_engine_empty, pg_repo_remote):
+    prepare_lq_repo(pg_repo_remote, commit_after_every=False, include_pk=True)
+    pg_repo_local = clone(pg_repo_remote, download_all=False)
+
+    # Download the first fragment of every table (fruits and vegetables) when checking
+    # the image out.
+    pg_repo_local.images["latest"].checkout(layered=True, prefetch=1)
+    assert len(pg_repo_local.objects.get_downloaded_objects()) == 2
+    assert pg_repo_local.run_sql("SELECT * FROM fruits WHERE fruit_id = 2") == [
+        (2, "guitar", 1, _DT)
+    ]
+
+
+def test_lq_checkout_direct(local_engine_empty, pg_repo_remote):
+    # Split vegetables into two fragments that don't overlap and make fruits' fragments overlap.
+    pg_repo_remote.run_sql("ALTER TABLE vegetables ADD PRIMARY KEY (vegetable_id)")
+    pg_repo_remote.run_sql("INSERT INTO vegetables VALUES (3, 'celery'), (4, 'cucumber')")
+    pg_repo_remote.commit(chunk_size=2)
+    pg_repo_remote.run_sql("UPDATE fruits SET name = 'guitar' WHERE fruit_id = 2")
+    pg_repo_remote.commit()
+
+    pg_repo_local = clone(pg_repo_remote, download_all=False)
+    image = pg_repo_local.images["latest"]
+    vegetables = image.get_table("vegetables").objects
+    assert len(vegetables) == 2
+
+    def _refcounts():
+        return pg_repo_local.engine.run_sql(
+            "SELECT refcount FROM splitgraph_meta.object_cache_status "
+            "WHERE object_id IN (%s, %s)",
+            vegetables,
+            return_shape=ResultShape.MANY_ONE,
+        )
+
+    # Vegetables is checked out as a view over its fragments, fruits uses the FDW.
+    image.checkout(layered=True, direct=True)
+    schema = pg_repo_local.to_schema()
+    assert pg_repo_local.engine.get_table_type(schema, "vegetables") == "VIEW"
+    assert pg_repo_local.engine.get_table_type(schema, "fruits") in ("FOREIGN TABLE", "FOREIGN")
+    assert pg_repo_local.run_sql("SELECT * FROM vegetables ORDER BY vegetable_id") == [
+        (1, "potato"),
+        (2, "carrot"),
+        (3, "celery"),
+        (4, "cucumber"),
+    ]
+    assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+        (1, "apple"),
+        (2, "guitar"),
+    ]
+
+    # The view's fragments stay claimed until the image is checked out again.
+    assert _refcounts() == [1, 1]
+    assert pg_repo_local.objects.get_fragment_views(schema) == ["vegetables"]
+
+    # Views that weren't created by the checkout aren't touched.
+    pg_repo_local.engine.run_sql(
+        SQL("CREATE VIEW {}.my_view AS SELECT * FROM {}.{}").format(
+            Identifier(schema), Identifier(SPLITGRAPH_META_SCHEMA), Identifier(vegetables[0])
+        )
+    )
+    pg_repo_local.objects.release_fragment_views(schema)
+    assert _refcounts() == [0, 0]
+    assert pg_repo_local.engine.get_table_type(schema, "my_view") == "VIEW"
+    assert not pg_repo_local.engine.table_exists(schema, "vegetables")
+    assert pg_repo_local.objects.get_fragment_views(schema) == []
+    pg_repo_local.engine.run_sql(SQL("DROP VIEW {}.my_view").format(Identifier(schema)))
+
+    image.checkout(layered=True, direct=True)
+    assert _refcounts() == [1, 1]
+    image.checkout()
+    assert pg_repo_local.engine.get_table_type(schema, "vegetables") == "BASE TABLE"
+    assert _refcounts() == [0, 0]
+
+    image.checkout(layered=True, direct=True)
+    assert _refcounts() == [1, 1]
+    pg_repo_local.uncheckout()
+    assert _refcounts() == [0, 0]
+
+
+def test_lq_checkout_direct_status_commit(local_engine_empty, pg_repo_remote):
+    # Tables checked out as views are read-only, don't get audit triggers and
+    # are committed into new images unchanged.
+    pg_repo_remote.run_sql("ALTER TABLE vegetables ADD PRIMARY KEY (vegetable_id)")
+    pg_repo_remote.commit()
+    pg_repo_local = clone(pg_repo_remote, download_all=False)
+    image = pg_repo_local.images["latest"]
+    vegetables = image.get_table("vegetables")
+
+    image.checkout(layered=True, direct=True)
+    schema = pg_repo_local.to_schema()
+    assert pg_repo_local.engine.get_table_type(schema, "vegetables") == "VIEW"
+    assert (schema, "vegetables") not in pg_repo_local.engine.get_tracked_tables()
+    assert not pg_repo_local.has_pending_changes()
+
+    result = CliRunner().invoke(status_c, [str(pg_repo_local)], catch_exceptions=False)
+    assert result.exit_code == 0
+
+    with pytest.raises(psycopg2.errors.ObjectNotInPrerequisiteState):
+        pg_repo_local.run_sql("INSERT INTO vegetables VALUES (3, 'celery')")
+    pg_repo_local.engine.rollback()
+
+    new_image = pg_repo_local.commit()
+    new_vegetables = new_image.get_table("vegetables")
+    assert new_vegetables.objects == vegetables.objects
+    assert new_vegetables.table_schema == vegetables.table_schema
+    assert pg_repo_local.engine.get_table_type(schema, "vegetables") == "VIEW"
+    assert pg_repo_local.run_sql("SELECT * FROM vegetables ORDER BY vegetable_id") == [
+        (1, "potato"),
+        (2, "carrot"),
+    ]
+
+
+def test_lq_checkout_direct_text_pk(local_engine_empty, pg_repo_remote):
+    # Fragment ranges of text PKs are in the C collation: in en_US, "Zebra" would be
+    # outside of the first fragment's range and the view would lose it.
+    pg_repo_remote.run_sql("CREATE TABLE words (word VARCHAR PRIMARY KEY, n INTEGER)")
+    pg_repo_remote.run_sql("INSERT INTO words VALUES ('Apple', 1), ('Zebra', 2), ('banana', 3)")
+    pg_repo_remote.commit()
+    pg_repo_remote.run_sql("INSERT INTO words VALUES ('Äpfel', 4), ('éclair', 5)")
+    pg_repo_remote.commit()
+
+    pg_repo_local = clone(pg_repo_remote, download_all=False)
+    image = pg_repo_local.images["latest"]
+    assert len(image.get_table("words").objects) == 2
+
+    image.checkout(layered=True, direct=True)
+    assert pg_repo_local.engine.get_table_type(pg_repo_local.to_schema(), "words") == "VIEW"
+    assert pg_repo_local.run_sql('SELECT * FROM words ORDER BY word COLLATE "C"') == [
+        ("Apple", 1),
+        ("Zebra", 2),
+        ("banana", 3),
+        ("Äpfel", 4),
+        ("éclair", 5),
+    ]
+    assert pg_repo_local.run_sql("SELECT n FROM words WHERE word = 'Zebra'") == [(2,)]
+    assert pg_repo_local.run_sql("SELECT n FROM words WHERE word = 'éclair'") == [(5,)]
+
+
 @pytest.mark.registry
 def test_lq_external(
     local_engine_empty, unprivileged_pg_repo, pg_repo_remote_registry, clean_minio
@@ -710,6 +920,61 @@ def test_disjoint_table_lq_two_singletons_one_overwritten_indirect(pg_repo_local
     assert not pg_repo_local.engine.table_exists(SPLITGRAPH_META_SCHEMA, tmp_table)
 
 
+def test_disjoint_table_lq_incremental(pg_repo_local):
+    # Two non-singleton groups: materialize them one by one into the same staging table.
+    prepare_lq_repo(pg_repo_local, commit_after_every=True, include_pk=True)
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (4, 'fruit_4'), (5, 'fruit_5')")
+    pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'fruit_5_updated' WHERE fruit_id = 5")
+    fruits = pg_repo_local.commit().get_table("fruits")
+
+    tables, callback, plan = fruits.query_indirect(
+        columns=["fruit_id", "name"], quals=None, incremental=True
+    )
+    assert len(plan.non_singleton_groups) == 2
+
+    # The singleton is queried directly.
+    assert (
+        next(tables) == b'"splitgraph_meta".'
+        b'"of0fb43e477311f82aa30055be303ff00599dfe155d737def0d00f06e07228b"'
+    )
+
+    with mock.patch.object(
+        PostgresEngine, "apply_fragments", wraps=pg_repo_local.engine.apply_fragments
+    ) as apply_fragments:
+        table = next(tables)
+        assert apply_fragments.call_count == 1
+        args, _ = apply_fragments.call_args_list[0]
+        tmp_table = args[2]
+        assert args[0] == [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singleton_groups[0]]
+        assert sorted(
+            pg_repo_local.engine.run_sql("SELECT fruit_id, name FROM %s" % table.decode("utf-8"))
+        ) == [(2, "guitar")]
+
+        # The second group replaces the first one in the same staging table.
+        assert next(tables) == table
+        assert apply_fragments.call_count == 2
+        args, _ = apply_fragments.call_args_list[1]
+        assert args[2] == tmp_table
+        assert args[0] == [(SPLITGRAPH_META_SCHEMA, o) for o in plan.non_singleton_groups[1]]
+        assert sorted(
+            pg_repo_local.engine.run_sql("SELECT fruit_id, name FROM %s" % table.decode("utf-8"))
+        ) == [(4, "fruit_4"), (5, "fruit_5_updated")]
+
+    with pytest.raises(StopIteration):
+        next(tables)
+
+    callback()
+    assert not pg_repo_local.engine.table_exists(SPLITGRAPH_META_SCHEMA, tmp_table)
+
+    # Check the results are the same as with the normal mode.
+    quals = [[("fruit_id", ">=", "2")]]
+    _assert_dict_list_equal(
+        fruits.query(columns=["fruit_id", "name"], quals=quals, incremental=True),
+        fruits.query(columns=["fruit_id", "name"], quals=quals),
+    )
+
+
 def test_disjoint_table_lq_temp_table_deletion_doesnt_lock_up(pg_repo_local):
     # When Multicorn reads from the temporary table, it does that in the context of the
     # transaction that it's been called from. It hence can hold a read lock on the
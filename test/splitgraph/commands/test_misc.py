@@ -1,7 +1,12 @@
+from unittest.mock import patch
+
 import pytest
 
 from splitgraph.core.repository import Repository
+from splitgraph.core.table import Table, ParallelMaterializer, _finish_bulk_load
+from splitgraph.core.types import TableColumn
 from splitgraph.engine import ResultShape
+from splitgraph.engine.postgres.engine import PostgresEngine
 from splitgraph.exceptions import ImageNotFoundError
 
 
@@ -90,6 +95,167 @@ def test_table_changes(snap_only, pg_repo_local):
     assert not pg_repo_local.engine.table_exists(pg_repo_local.to_schema(), "fruits")
 
 
+def test_checkout_incremental(pg_repo_local):
+    # Checking out an image whose tables share fragments with the current HEAD only
+    # applies the fragments that are different instead of materializing the tables.
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    base = pg_repo_local.commit()
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
+    child = pg_repo_local.commit()
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 1")
+    grandchild = pg_repo_local.commit()
+
+    base_objects = base.get_table("fruits").objects
+    child_objects = child.get_table("fruits").objects
+    assert grandchild.get_table("fruits").objects[: len(child_objects)] == child_objects
+    assert child_objects[: len(base_objects)] == base_objects
+
+    schema = pg_repo_local.to_schema()
+    with patch.object(
+        Table, "materialize", autospec=True, side_effect=Table.materialize
+    ) as materialize:
+        # Revert the last fragment
+        child.checkout()
+        assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+            (1, "apple"),
+            (2, "orange"),
+            (3, "mayonnaise"),
+        ]
+        assert materialize.call_count == 0
+
+        # Apply it again
+        grandchild.checkout()
+        assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+            (1, "pineapple"),
+            (2, "orange"),
+            (3, "mayonnaise"),
+        ]
+        assert materialize.call_count == 0
+
+        # The tables are tracked again and the checkout didn't create any pending changes.
+        assert (schema, "fruits") in pg_repo_local.engine.get_tracked_tables()
+        assert not pg_repo_local.has_pending_changes()
+
+        # Reverting more fragments than the images share rematerializes the table.
+        base.checkout()
+        assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+            (1, "apple"),
+            (2, "orange"),
+        ]
+        assert materialize.call_count == 1
+
+        # Pending changes that are discarded make checkout rematerialize all tables.
+        pg_repo_local.run_sql("DELETE FROM fruits WHERE fruit_id = 1")
+        child.checkout(force=True)
+        assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+            (1, "apple"),
+            (2, "orange"),
+            (3, "mayonnaise"),
+        ]
+        assert materialize.call_count == 3
+
+
+def test_checkout_parallel(pg_repo_local):
+    # Split fruits into two singleton fragments and then add a fragment that overlaps one of them.
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise'), (4, 'kiwi')")
+    pg_repo_local.commit(chunk_size=2)
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 4")
+    head = pg_repo_local.commit()
+    assert len(head.get_table("fruits").objects) == 3
+
+    pg_repo_local.uncheckout()
+    materializer = ParallelMaterializer(pg_repo_local, workers=2)
+    pg_repo_local.object_engine.create_schema(pg_repo_local.to_schema())
+    materializer.materialize(
+        [(head.get_table(t), t) for t in head.get_tables()], pg_repo_local.to_schema()
+    )
+
+    assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+        (1, "apple"),
+        (2, "orange"),
+        (3, "mayonnaise"),
+        (4, "pineapple"),
+    ]
+    assert pg_repo_local.run_sql("SELECT * FROM vegetables ORDER BY vegetable_id") == [
+        (1, "potato"),
+        (2, "carrot"),
+    ]
+    assert materializer.stats
+    assert all(elapsed >= 0 for _, elapsed in materializer.stats.values())
+
+    # Check out through the image as well.
+    pg_repo_local.uncheckout()
+    head.checkout(workers=2)
+    assert pg_repo_local.head == head
+    assert pg_repo_local.run_sql("SELECT name FROM fruits WHERE fruit_id = 4") == [("pineapple",)]
+    assert not pg_repo_local.has_pending_changes()
+
+
+def test_checkout_bulk_load(pg_repo_local):
+    # Tables whose fragments don't overlap are loaded without a PK, which is added afterwards.
+    pg_repo_local.run_sql("ALTER TABLE fruits ADD PRIMARY KEY (fruit_id)")
+    pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise'), (4, 'kiwi')")
+    head = pg_repo_local.commit(chunk_size=2)
+    assert len(head.get_table("fruits").objects) == 2
+
+    schema = pg_repo_local.to_schema()
+    with patch.object(
+        PostgresEngine, "apply_fragments", autospec=True, side_effect=PostgresEngine.apply_fragments
+    ) as apply_fragments:
+        pg_repo_local.uncheckout()
+        head.checkout()
+    assert apply_fragments.call_args[1]["insert_only"] is True
+
+    assert pg_repo_local.run_sql("SELECT * FROM fruits ORDER BY fruit_id") == [
+        (1, "apple"),
+        (2, "orange"),
+        (3, "mayonnaise"),
+        (4, "kiwi"),
+    ]
+    assert pg_repo_local.engine.get_primary_keys(schema, "fruits") == [("fruit_id", "integer")]
+    # The table has been analyzed.
+    assert pg_repo_local.run_sql(
+        "SELECT COUNT(*) FROM pg_stats WHERE schemaname = %s AND tablename = 'fruits'",
+        (schema,),
+        return_shape=ResultShape.ONE_ONE,
+    )
+
+    # Overlapping fragments still get applied into a table with a PK.
+    pg_repo_local.run_sql("UPDATE fruits SET name = 'pineapple' WHERE fruit_id = 4")
+    head = pg_repo_local.commit()
+    pg_repo_local.uncheckout()
+    head.checkout()
+    assert pg_repo_local.run_sql("SELECT name FROM fruits WHERE fruit_id = 4") == [("pineapple",)]
+    assert pg_repo_local.engine.get_primary_keys(schema, "fruits") == [("fruit_id", "integer")]
+
+
+def test_finish_bulk_load_restores_settings(local_engine_empty):
+    # The number of index build workers is only changed for the PK build.
+    engine = local_engine_empty
+    engine.run_sql("CREATE TABLE public.bulk (key INTEGER, value VARCHAR)")
+    engine.run_sql("INSERT INTO public.bulk VALUES (1, 'one'), (2, 'two')")
+    previous = engine.run_sql(
+        "SHOW max_parallel_maintenance_workers", return_shape=ResultShape.ONE_ONE
+    )
+    with patch.dict("splitgraph.core.table.CONFIG", {"SG_INDEX_BUILD_WORKERS": "7"}):
+        _finish_bulk_load(
+            engine,
+            "public",
+            "bulk",
+            [
+                TableColumn(1, "key", "integer", True),
+                TableColumn(2, "value", "character varying", False),
+            ],
+        )
+    assert engine.get_primary_keys("public", "bulk") == [("key", "integer")]
+    assert (
+        engine.run_sql("SHOW max_parallel_maintenance_workers", return_shape=ResultShape.ONE_ONE)
+        == previous
+    )
+    engine.rollback()
+
+
 def test_tagging(pg_repo_local):
     head = pg_repo_local.head
     pg_repo_local.run_sql("INSERT INTO fruits VALUES (3, 'mayonnaise')")
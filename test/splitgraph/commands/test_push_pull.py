@@ -5,7 +5,11 @@ from test.splitgraph.conftest import PG_MNT
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
 from splitgraph.core.repository import clone, Repository
 from splitgraph.engine import ResultShape
-from splitgraph.exceptions import ImageNotFoundError
+from splitgraph.exceptions import (
+    ImageNotFoundError,
+    IncompleteObjectUploadError,
+    IncompleteObjectDownloadError,
+)
 
 
 def _add_image_to_repo(repository):
@@ -289,6 +293,38 @@ def test_push(local_engine_empty, pg_repo_remote):
     # apple, mayonnaise, orange (alphabetical order since we sorted on fruit name)
 
 
+def _get_object_contents(engine, object_id):
+    return engine.run_sql(
+        SQL("SELECT * FROM {}.{} ORDER BY 1").format(
+            Identifier(SPLITGRAPH_META_SCHEMA), Identifier(object_id)
+        )
+    )
+
+
+def test_object_transfer_partial_failure(pg_repo_local, remote_engine):
+    # Objects are streamed between engines by a pool of workers: check that
+    # failing to copy one object doesn't prevent others from being copied.
+    objects = pg_repo_local.objects.get_all_objects()
+    missing_object = "o" + "0" * 62
+    engine = pg_repo_local.object_engine
+
+    with pytest.raises(IncompleteObjectUploadError) as e:
+        engine.upload_objects(objects + [missing_object], remote_engine)
+    assert sorted(e.value.successful_objects) == sorted(objects)
+    assert e.value.successful_object_urls == [None] * len(objects)
+    expected = {o: _get_object_contents(engine, o) for o in objects}
+    assert {o: _get_object_contents(remote_engine, o) for o in objects} == expected
+
+    engine.delete_objects(objects)
+    engine.commit()
+
+    with pytest.raises(IncompleteObjectDownloadError) as e:
+        engine.download_objects(objects + [missing_object], remote_engine)
+    assert sorted(e.value.successful_objects) == sorted(objects)
+    assert {o: _get_object_contents(engine, o) for o in objects} == expected
+    assert engine.get_object_schema(objects[0]) == remote_engine.get_object_schema(objects[0])
+
+
 def test_push_single_image(pg_repo_local, remote_engine):
     original_head = pg_repo_local.head
     _add_image_to_repo(pg_repo_local)
@@ -17,7 +17,7 @@ from splitgraph.config.system_config import (
     get_config_file,
     VALID_CONFIG_FILE_NAMES,
 )
-from splitgraph.core.engine import _parse_paths_overrides
+from splitgraph.core.engine import _parse_paths_overrides, get_change_tracking_mode
 
 
 @contextmanager
@@ -566,3 +566,14 @@ def test_lookup_override_parser():
     assert _parse_paths_overrides(
         lookup_path="remote_engine", override_path="override_repo_1:local"
     ) == (["remote_engine"], {"override_repo_1": "local"})
+
+
+def test_change_tracking_mode():
+    with patch.dict(
+        CONFIG,
+        {"SG_CHANGE_TRACKING": "row", "SG_CHANGE_TRACKING_OVERRIDE": "ns/repo_1:statement"},
+    ):
+        assert get_change_tracking_mode("ns/repo_1") == "statement"
+        assert get_change_tracking_mode("ns/repo_2") == "row"
+    with patch.dict(CONFIG, {"SG_CHANGE_TRACKING": "", "SG_CHANGE_TRACKING_OVERRIDE": ""}):
+        assert get_change_tracking_mode("ns/repo_1") == "row"
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
 from unittest import mock
 from unittest.mock import Mock, MagicMock, call
@@ -122,6 +123,31 @@ def test_run_sql_namedtuple(local_engine_empty):
     assert one_many_result[1] == 2
 
 
+def test_copy_to_temporary_table(local_engine_empty):
+    columns = [
+        ("key", "integer"),
+        ("text_val", "character varying"),
+        ("json_val", "jsonb"),
+        ("array_val", "text[]"),
+        ("bool_val", "boolean"),
+    ]
+    rows = [
+        (1, "tab\there\nnewline \\N", {"a": [1, "b"]}, ["a b", 'q"t', "\\", None], True),
+        ("2", "", ["c", 3], [["a", "b"], ["c", None]], "false"),
+        (3, None, None, None, None),
+    ]
+    local_engine_empty.copy_to_temporary_table("test_copy", columns, rows)
+
+    # Values get loaded as text and can be cast into the same values
+    # as with query arguments.
+    query = "SELECT " + ",".join("{0}::{1}".format(c, t) for c, t in columns)
+    assert local_engine_empty.run_sql(query + " FROM pg_temp.test_copy ORDER BY 1") == [
+        (1, "tab\there\nnewline \\N", {"a": [1, "b"]}, ["a b", 'q"t', "\\", None], True),
+        (2, "", ["c", 3], [["a", "b"], ["c", None]], False),
+        (3, None, None, None, None),
+    ]
+
+
 def test_uninitialized_engine_error(local_engine_empty):
     # Test things like the audit triggers/splitgraph meta schema missing raise
     # uninitialized engine errors rather than generic SQL errors.
@@ -399,3 +425,40 @@ def test_object_storage_remounting(pg_repo_local):
             "no physical file, recreating" in c[1][0] and c[1][1] == missing_object
             for c in log.info.mock_calls
         )
+
+
+def test_close_others_threads(local_engine_empty):
+    # close_others releases connections of finished workers when it's called from
+    # any thread, not just the main one.
+    engine = PostgresEngine(
+        name="test", conn_params=local_engine_empty.conn_params, check_version=False
+    )
+
+    def _parallel_operation():
+        with ThreadPoolExecutor(max_workers=2) as tpe:
+            list(tpe.map(lambda _: engine.run_sql("SELECT 1"), range(4)))
+        engine.close_others()
+        return len(engine._pool._used)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as tpe:
+            assert tpe.submit(_parallel_operation).result() == 0
+    finally:
+        engine.close_pool()
+
+    # Engines with their own pool for a background thread only close connections
+    # of threads that have finished.
+    background = local_engine_empty.clone(share_pool=False)
+
+    def _background_operation():
+        background.run_sql("SELECT 1")
+        with ThreadPoolExecutor(max_workers=2) as tpe:
+            list(tpe.map(lambda _: background.run_sql("SELECT 1"), range(4)))
+        background.close_others()
+        return len(background._pool._used)
+
+    try:
+        with ThreadPoolExecutor(max_workers=1) as tpe:
+            assert tpe.submit(_background_operation).result() == 1
+    finally:
+        background.close_pool()
@@ -1,3 +1,5 @@
+import os
+import tempfile
 from datetime import datetime as dt, datetime
 from unittest.mock import patch
 
@@ -5,10 +7,14 @@ import pytest
 from psycopg2.errors import CheckViolation
 
 from splitgraph.core.common import Tracer, adapt, coerce_val_to_json
+from splitgraph.core.indexing.bloom import _hash_value, build_bloom_index
+from splitgraph.core.indexing.fragment_index import FragmentIndex
 from splitgraph.core.output import parse_dt
 from splitgraph.core.engine import lookup_repository
-from splitgraph.core.metadata_manager import Object
+from splitgraph.core.metadata_manager import COPY_MIN_ROWS, Object, ObjectMetaCache
 from splitgraph.core.repository import Repository
+from splitgraph.core.table import QueryPlanCache, _normalize_quals
+from splitgraph.core.types import TableColumn
 from splitgraph.engine.postgres.engine import API_MAX_QUERY_LENGTH
 from splitgraph.exceptions import RepositoryNotFoundError
 from splitgraph.hooks.s3 import get_object_upload_urls
@@ -307,3 +313,228 @@ def test_parse_dt():
 
     with pytest.raises(ValueError):
         parse_dt("not a dt")
+
+
+def _make_object(object_id, size=42, object_index=None):
+    return Object(
+        object_id=object_id,
+        format="FRAG",
+        namespace="",
+        size=size,
+        created=datetime.utcnow(),
+        insertion_hash="0" * 64,
+        deletion_hash="0" * 64,
+        object_index=object_index or {},
+        rows_inserted=10,
+        rows_deleted=0,
+    )
+
+
+def test_object_meta_cache_lru():
+    cache = ObjectMetaCache(capacity=2)
+    cache.put_many("engine", [_make_object("o1"), _make_object("o2")])
+    assert list(cache.get_many("engine", ["o1"])) == ["o1"]
+
+    # o2 is the least recently used object and gets evicted.
+    cache.put_many("engine", [_make_object("o3")])
+    assert list(cache.get_many("engine", ["o1", "o2", "o3"])) == ["o1", "o3"]
+
+    # Metadata from different engines doesn't clash.
+    assert cache.get_many("other_engine", ["o1"]) == {}
+
+    cache.invalidate("engine", ["o1"])
+    assert list(cache.get_many("engine", ["o1", "o3"])) == ["o3"]
+    assert cache.get_stats() == {"hits": 4, "misses": 3, "size": 1, "capacity": 2}
+
+    cache.clear()
+    assert cache.get_stats() == {"hits": 0, "misses": 0, "size": 0, "capacity": 2}
+
+    # Capacity of 0 disables the cache.
+    cache = ObjectMetaCache(capacity=0)
+    cache.put_many("engine", [_make_object("o1")])
+    assert cache.get_many("engine", ["o1"]) == {}
+
+
+def test_object_meta_cache_invalidation(local_engine_empty):
+    R = Repository("some", "repo")
+    om = R.objects
+    object_id = "o" + "a" * 62
+    om.register_objects([_make_object(object_id, size=42)])
+
+    with patch.object(om, "object_meta_cache", ObjectMetaCache(capacity=10)) as cache:
+        assert om.get_object_meta([object_id])[object_id].size == 42
+        assert om.get_object_meta([object_id])[object_id].size == 42
+        assert cache.get_stats()["hits"] == 1
+        assert cache.get_stats()["misses"] == 1
+
+        # Overwriting the object's metadata invalidates the cache
+        om.register_objects([_make_object(object_id, size=43)])
+        assert om.get_object_meta([object_id])[object_id].size == 43
+
+        om.delete_object_meta([object_id])
+        assert om.get_object_meta([object_id]) == {}
+        assert cache.get_stats()["size"] == 0
+
+
+def test_object_meta_cache_rollback(local_engine_empty):
+    R = Repository("some", "repo")
+    om = R.objects
+    object_id = "o" + "b" * 62
+    om.register_objects([_make_object(object_id, size=42)])
+    R.commit_engines()
+
+    with patch.object(om, "object_meta_cache", ObjectMetaCache(capacity=10)):
+        # Metadata cached inside of a transaction that gets rolled back is dropped.
+        om.register_objects([_make_object(object_id, size=43)])
+        assert om.get_object_meta([object_id])[object_id].size == 43
+        R.rollback_engines()
+        assert om.get_object_meta([object_id])[object_id].size == 42
+
+        om.delete_object_meta([object_id])
+        assert om.get_object_meta([object_id]) == {}
+        R.rollback_engines()
+        assert om.get_object_meta([object_id])[object_id].size == 42
+
+
+def test_bulk_metadata_registration(local_engine_empty):
+    # Large batches of metadata on a local engine get loaded with COPY and merged
+    # with one API call instead of being sent as one API call per row.
+    R = Repository("some", "repo")
+    om = R.objects
+    objects = [
+        _make_object("o%062d" % i, size=i, object_index={"range": {"key": [i, i + 1]}})
+        for i in range(COPY_MIN_ROWS * 2)
+    ]
+    all_ids = [o.object_id for o in objects]
+    image_hash = "0" * 63 + "1"
+    R.images.add(parent_id=None, image=image_hash)
+
+    with patch.object(local_engine_empty, "run_sql_batch") as run_sql_batch:
+        # Duplicate objects: the last one wins, same as with add_object
+        om.register_objects(objects + [_make_object(all_ids[0], size=1000)], namespace="some")
+        om.register_tables(
+            R,
+            [
+                (image_hash, "table", [(1, "key", "integer", True)], all_ids[:COPY_MIN_ROWS]),
+                (image_hash, "table", [(1, "key", "integer", True)], all_ids[COPY_MIN_ROWS:]),
+            ]
+            + [
+                (image_hash, "table_%d" % i, [(1, "key", "integer", True)], [all_ids[i]])
+                for i in range(COPY_MIN_ROWS)
+            ],
+        )
+        om.register_object_locations([(o, "http://example.com/" + o, "HTTP") for o in all_ids])
+    run_sql_batch.assert_not_called()
+
+    meta = om.get_object_meta(all_ids)
+    assert len(meta) == len(all_ids)
+    assert meta[all_ids[0]].size == 1000
+    assert meta[all_ids[0]].namespace == "some"
+    assert meta[all_ids[1]].object_index == {"range": {"key": [1, 2]}}
+
+    image = R.images[image_hash]
+    assert image.get_table("table").objects == all_ids
+    assert image.get_table("table_1").objects == [all_ids[1]]
+    assert len(image.get_tables()) == COPY_MIN_ROWS + 1
+
+    assert sorted(om.get_external_object_locations(all_ids)) == [
+        (o, "http://example.com/" + o, "HTTP") for o in all_ids
+    ]
+
+    # Small batches still go through the API calls and tables get extended
+    om.register_tables(R, [(image_hash, "table_1", [(1, "key", "integer", True)], [all_ids[2]])])
+    assert R.images[image_hash].get_table("table_1").objects == [all_ids[1], all_ids[2]]
+
+
+def test_fragment_index_filtering():
+    bloom = build_bloom_index([_hash_value(v) for v in ["apple", "banana"]], None, "value", size=16)
+    objects = {
+        "o1": _make_object("o1", object_index={"range": {"key": [1, 5], "value": ["B", "a"]}}),
+        "o2": _make_object(
+            "o2",
+            object_index={
+                "range": {"key": [6, 10], "value": ["apple", "banana"]},
+                "bloom": {"value": bloom},
+            },
+        ),
+        # No range information for "value": might match any qual on it.
+        "o3": _make_object("o3", object_index={"range": {"key": [11, 15]}}),
+        "o4": _make_object(
+            "o4", object_index={"range": {"key": [None, None], "value": [None, None]}}
+        ),
+    }
+    # o5 doesn't have any metadata and never gets returned by the range filter.
+    object_ids = ["o1", "o2", "o3", "o4", "o5"]
+    index = FragmentIndex(
+        object_ids, objects, {"key": "integer", "value": "character varying(10)", "r": "real"}
+    )
+
+    assert index.filter_range([[("key", ">", 5)]]) == ["o2", "o3"]
+    assert index.filter_range([[("key", ">=", 5)]]) == ["o1", "o2", "o3"]
+    assert index.filter_range([[("key", "<", "6")]]) == ["o1"]
+    assert index.filter_range([[("key", "=", 5.5)]]) == []
+    assert index.filter_range([[("key", "=", 10)]]) == ["o2"]
+    assert index.filter_range([[("key", "=", 3), ("key", ">", 12)]]) == ["o1", "o3"]
+    assert index.filter_range([[("key", "<", 12)], [("value", "=", "Z")]]) == ["o1", "o3"]
+    assert index.filter_range([[("key", "<>", 3)]]) == ["o1", "o2", "o3", "o4"]
+    assert index.filter_range([[("key", "=", None)]]) == []
+
+    # Code point comparison, same as COLLATE "C" on the engine ("B" < "a").
+    assert index.filter_range([[("value", "<", "C")]]) == ["o1", "o3"]
+
+    # Quals that can't be evaluated in Python are left to the engine.
+    assert index.filter_range([[("r", ">", 1.0)]]) is None
+    assert index.filter_range([[("key", "=", "not a number")]]) is None
+    assert index.filter_range([[("value", "=", 42)]]) is None
+
+    candidates = ["o1", "o2", "o3"]
+    assert index.filter_bloom(candidates, [[("value", "=", "apple")]]) == candidates
+    assert index.filter_bloom(candidates, [[("value", "=", "avocado")]]) == ["o1", "o3"]
+    assert index.filter_bloom(candidates, [[("key", ">", 2)]]) == candidates
+
+
+def test_query_plan_cache_quals_normalization():
+    quals = [[("a", "=", 1), ("b", ">", 2)], [("c", "=", [1, 2])]]
+    equivalent = [[("c", "=", [1, 2])], [("b", ">", 2), ("a", "=", 1), ("a", "=", 1)]]
+    assert _normalize_quals(quals) == _normalize_quals(equivalent)
+    assert _normalize_quals(quals) != _normalize_quals([[("a", "=", 1)], [("b", ">", 2)]])
+    assert _normalize_quals([]) is None
+
+    schema = [TableColumn(1, "a", "integer", True, None)]
+    key = QueryPlanCache.get_key("engine", ["o1", "o2"], schema, quals)
+    assert key == QueryPlanCache.get_key("engine", ["o1", "o2"], schema, equivalent)
+    assert key != QueryPlanCache.get_key("engine", ["o2", "o1"], schema, quals)
+    assert key != QueryPlanCache.get_key("engine", ["o1", "o2"], schema, None)
+
+    # Plans stored in an older format (e.g. without fragment groups) aren't picked up.
+    with patch("splitgraph.core.table._PLAN_FORMAT_VERSION", 1):
+        assert key != QueryPlanCache.get_key("engine", ["o1", "o2"], schema, quals)
+
+
+def test_query_plan_cache_persistence():
+    plan = {
+        "filtered_objects": ["o1"],
+        "estimated_rows": 10,
+        "non_singletons": [],
+        "singletons": ["o1"],
+        "non_singleton_groups": [],
+    }
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = QueryPlanCache(capacity=2, cache_dir=cache_dir)
+        assert cache.get("key_1") is None
+        cache.put("key_1", plan)
+        assert cache.get("key_1") == plan
+
+        # Another process with its own cache can load the plan from disk.
+        other_cache = QueryPlanCache(capacity=2, cache_dir=cache_dir)
+        assert other_cache.get("key_1") == plan
+        assert other_cache.get_stats() == {"hits": 1, "misses": 0, "size": 1, "capacity": 2}
+
+        other_cache.put("key_2", plan)
+        other_cache.put("key_3", plan)
+        assert len(os.listdir(cache_dir)) == 2
+        assert other_cache.get("key_1") is None
+
+        # Caching can be disabled
+        assert QueryPlanCache(capacity=0, cache_dir=cache_dir).get("key_3") is None
@@ -1,5 +1,6 @@
 import itertools
-from datetime import datetime as dt
+import time
+from datetime import datetime as dt, timedelta
 from unittest import mock
 
 import pytest
@@ -12,10 +13,23 @@ from test.splitgraph.conftest import (
 )
 
 from splitgraph.config import SPLITGRAPH_META_SCHEMA
+from splitgraph.core.common import CallbackList
+from splitgraph.core.eviction import (
+    CacheEntry,
+    CacheEvictor,
+    LRUPolicy,
+    TraceEntry,
+    get_eviction_policy,
+    get_evictor_status,
+    read_trace,
+    simulate_eviction,
+    write_trace,
+)
 from splitgraph.core.indexing.range import _quals_to_clause
 from splitgraph.core.repository import clone
 from splitgraph.core.sql import select
 from splitgraph.engine import ResultShape
+from splitgraph.engine.postgres.engine import PsycopgEngine
 from splitgraph.exceptions import ObjectCacheError
 
 
@@ -27,6 +41,14 @@ def _get_refcount(object_manager, object_id):
     )
 
 
+def _get_access_count(object_manager, object_id):
+    return object_manager.object_engine.run_sql(
+        select("object_cache_status", "access_count", "object_id = %s"),
+        (object_id,),
+        return_shape=ResultShape.ONE_ONE,
+    )
+
+
 def _get_last_used(object_manager, object_id):
     return object_manager.object_engine.run_sql(
         select("object_cache_status", "last_used", "object_id = %s"),
@@ -108,6 +130,60 @@ def test_object_cache_loading(local_engine_empty, pg_repo_remote, clean_minio):
     assert len(object_manager.get_downloaded_objects()) == 2
 
 
+def test_object_cache_only_fetches_required(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    fruit_snap, fruit_diff = fruits_v3.objects
+
+    # Pretend another object manager has claimed the patch and is about to download it.
+    pg_repo_local.run_sql(
+        "INSERT INTO splitgraph_meta.object_cache_status (object_id, ready, refcount, last_used) "
+        "VALUES (%s, 'f', 1, now())",
+        (fruit_diff,),
+    )
+    pg_repo_local.commit_engines()
+
+    # Downloading the snapshot doesn't download (or wait for) the patch.
+    with object_manager.ensure_objects(None, objects=[fruit_snap]) as required_objects:
+        assert required_objects == [fruit_snap]
+        assert object_manager.get_downloaded_objects() == [fruit_snap]
+
+    assert (
+        pg_repo_local.run_sql(
+            "SELECT ready FROM splitgraph_meta.object_cache_status WHERE object_id = %s",
+            (fruit_diff,),
+            return_shape=ResultShape.ONE_ONE,
+        )
+        is False
+    )
+
+
+def test_object_cache_lock_held_during_eviction(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    with object_manager.ensure_objects(fruits_v3):
+        pass
+    assert len(object_manager.get_downloaded_objects()) == 2
+
+    def _lock_held():
+        return object_manager.object_engine.run_sql(
+            "SELECT COUNT(*) FROM pg_locks WHERE locktype = 'advisory' "
+            "AND pid = pg_backend_pid() AND granted",
+            return_shape=ResultShape.ONE_ONE,
+        )
+
+    # Deleting the evicted objects doesn't commit and so doesn't release the cache lock
+    # (or return the connection to the pool).
+    with object_manager._cache_lock():
+        assert _lock_held() == 1
+        object_manager._run_eviction(keep_objects=[], required_space=None)
+        assert _lock_held() == 1
+    assert _lock_held() == 0
+    assert object_manager.get_downloaded_objects() == []
+
+
 def test_object_cache_non_existing_objects(local_engine_empty, pg_repo_remote, clean_minio):
     pg_repo_local = _setup_object_cache_test(pg_repo_remote)
     object_manager = pg_repo_local.objects
@@ -399,6 +475,220 @@ def test_object_cache_eviction_priority(local_engine_empty, pg_repo_remote, clea
         assert "Not enough space will be reclaimed" in str(e.value)
 
 
+def test_object_cache_eviction_lfu(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    object_manager.eviction_policy = get_eviction_policy("lfu")
+    fruit_snap, fruit_diff = pg_repo_local.images["latest"].get_table("fruits").objects
+    vegetables_v3 = pg_repo_local.images["latest"].get_table("vegetables")
+
+    object_manager.cache_size = SMALL_OBJECT_SIZE * 3 + 300
+
+    # Use the original fragment twice and then the patch once.
+    for _ in range(2):
+        with object_manager.ensure_objects(None, objects=[fruit_snap]):
+            pass
+    with object_manager.ensure_objects(None, objects=[fruit_diff]):
+        pass
+    assert _get_access_count(object_manager, fruit_snap) == 2
+    assert _get_access_count(object_manager, fruit_diff) == 1
+    assert _get_last_used(object_manager, fruit_diff) > _get_last_used(object_manager, fruit_snap)
+
+    # Fetch 2 more objects: the patch was used more recently but less often than
+    # the original fragment, so it gets evicted.
+    with object_manager.ensure_objects(vegetables_v3):
+        current_objects = object_manager.get_downloaded_objects()
+        assert fruit_snap in current_objects
+        assert fruit_diff not in current_objects
+
+    # The cache's inflation value is now the score of the evicted patch, and objects
+    # accessed since then are scored on top of it.
+    assert (
+        object_manager.object_engine.run_sql(
+            "SELECT inflation FROM splitgraph_meta.object_cache_occupancy",
+            return_shape=ResultShape.ONE_ONE,
+        )
+        == 1
+    )
+    for object_id in vegetables_v3.objects:
+        assert _get_access_count(object_manager, object_id) == 1
+        assert (
+            object_manager.object_engine.run_sql(
+                select("object_cache_status", "inflation", "object_id = %s"),
+                (object_id,),
+                return_shape=ResultShape.ONE_ONE,
+            )
+            == 0
+        )
+
+
+def test_object_cache_discard_rollback(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    engine = object_manager.object_engine
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    with object_manager.ensure_objects(fruits_v3):
+        pass
+    first, second = fruits_v3.objects
+
+    # Discarding objects renames their files outside of the transaction: they're
+    # moved back if it's rolled back.
+    object_manager.delete_objects([first], discard=True)
+    assert engine.get_discarded_objects() == [first]
+    engine.rollback()
+    assert engine.get_discarded_objects() == []
+    assert sorted(object_manager.get_downloaded_objects()) == sorted([first, second])
+    assert engine.run_sql("SELECT COUNT(*) FROM splitgraph_meta." + first)[0][0] > 0
+
+    # Purging without a commit doesn't delete anything.
+    object_manager.delete_objects([first], discard=True)
+    assert engine.purge_discarded_objects() == 0
+    engine.commit()
+    assert engine.purge_discarded_objects() == 3
+    assert engine.get_discarded_objects() == []
+    assert object_manager.get_downloaded_objects() == [second]
+
+
+def test_object_cache_background_eviction(local_engine_empty, pg_repo_remote, clean_minio):
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    vegetables_v3 = pg_repo_local.images["latest"].get_table("vegetables")
+
+    # The cache fits 4 objects.
+    object_manager.cache_size = SMALL_OBJECT_SIZE * 4 + 400
+    with object_manager.ensure_objects(fruits_v3):
+        pass
+    evictor = CacheEvictor(object_manager, interval=0.1, low_watermark=0.25, high_watermark=0.75)
+
+    # Occupancy is below the high watermark: nothing to do.
+    assert evictor.run_once() == 0
+    assert len(object_manager.get_downloaded_objects()) == 2
+
+    with object_manager.ensure_objects(vegetables_v3):
+        # The cache is full. The evictor tries to bring it down to the low watermark
+        # (1 object) but the vegetables are being used, so only the fruits get evicted.
+        assert evictor.run_once() > 0
+        assert sorted(object_manager.get_downloaded_objects()) == sorted(vegetables_v3.objects)
+        _assert_cache_occupancy(object_manager, 2)
+        # Files of evicted objects have been deleted.
+        assert object_manager.object_engine.purge_discarded_objects() == 0
+
+    assert evictor.run_once() == 0
+
+    status = get_evictor_status(object_manager.object_engine)
+    assert len(status) == 1
+    assert status[0].evictor_id == evictor.evictor_id
+    assert status[0].runs == 3
+    assert status[0].evictions == 1
+    assert status[0].is_alive()
+
+    # Run the evictor in the background.
+    with object_manager.ensure_objects(fruits_v3):
+        pass
+    background = object_manager.start_background_eviction(
+        interval=0.1, low_watermark=0, high_watermark=0.25
+    )
+    try:
+        for _ in range(50):
+            if not object_manager.get_downloaded_objects():
+                break
+            object_manager.object_engine.commit()
+            time.sleep(0.1)
+        assert object_manager.get_downloaded_objects() == []
+    finally:
+        background.stop()
+    # Stopped evictors unregister themselves.
+    assert [s.evictor_id for s in get_evictor_status(object_manager.object_engine)] == [
+        evictor.evictor_id
+    ]
+
+
+def test_eviction_policies():
+    now = dt(2020, 1, 1, 12, 0, 0)
+    floor = 1024
+    entries = [
+        # Small, old and frequently used
+        CacheEntry("small", 100, now - timedelta(minutes=10), 10, 0.0),
+        # Big, used a while ago
+        CacheEntry("big", 10000, now - timedelta(minutes=5), 2, 0.0),
+        # Big, just used for the first time
+        CacheEntry("new", 10000, now, 1, 0.0),
+    ]
+
+    def _order(policy_name):
+        policy = get_eviction_policy(policy_name, decay_constant=0.002, floor=floor)
+        victims, _ = policy.select_victims(entries, required_space=1000000, now=now)
+        return [v.object_id for v in victims]
+
+    assert _order("decay") == ["small", "big", "new"]
+    assert _order("lru") == ["small", "big", "new"]
+    assert _order("lfu") == ["new", "big", "small"]
+    assert _order("gdsf") == ["new", "big", "small"]
+
+    # Only evict as much as needed
+    policy = get_eviction_policy("lfu", decay_constant=0.002, floor=floor)
+    victims, max_score = policy.select_victims(entries, required_space=10050, now=now)
+    assert [v.object_id for v in victims] == ["new", "big"]
+    assert max_score == 2
+
+    # Custom policies can be loaded by their class name.
+    policy = get_eviction_policy("splitgraph.core.eviction.LRUPolicy")
+    assert isinstance(policy, LRUPolicy)
+
+    with pytest.raises(ObjectCacheError):
+        get_eviction_policy("unknown")
+
+
+def test_eviction_simulation(tmp_path):
+    start = dt(2020, 1, 1, 12, 0, 0)
+    # The cache fits 3 objects: "a" is used often at first and then "d" pushes one
+    # object out. LRU evicts "a", whereas LFU/GDSF evict "b" and keep "a".
+    accesses = ["a", "a", "a", "b", "c", "d", "a"]
+    trace_path = str(tmp_path / "trace.csv")
+    write_trace(
+        trace_path,
+        [TraceEntry(o, 100, start + timedelta(seconds=i)) for i, o in enumerate(accesses)],
+    )
+    trace = list(read_trace(trace_path))
+    assert trace[1] == TraceEntry("a", 100, start + timedelta(seconds=1))
+
+    results = {
+        policy_name: simulate_eviction(
+            trace,
+            get_eviction_policy(policy_name, decay_constant=0.002, floor=0),
+            cache_size=300,
+            min_fraction=0,
+        )
+        for policy_name in ["decay", "lru", "lfu", "gdsf"]
+    }
+
+    for policy_name in ["decay", "lru"]:
+        assert results[policy_name].hits == 2
+        assert results[policy_name].objects_evicted == 2
+        assert results[policy_name].byte_hit_ratio == pytest.approx(2 / 7)
+
+    for policy_name in ["lfu", "gdsf"]:
+        assert results[policy_name].requests == 7
+        assert results[policy_name].bytes_requested == 700
+        assert results[policy_name].hits == 3
+        assert results[policy_name].bytes_hit == 300
+        assert results[policy_name].evictions == 1
+        assert results[policy_name].byte_hit_ratio == pytest.approx(3 / 7)
+
+    # Objects that don't fit in the cache are never cached.
+    result = simulate_eviction(
+        [TraceEntry("a", 1000, start), TraceEntry("a", 1000, start)],
+        get_eviction_policy("lru"),
+        cache_size=300,
+    )
+    assert result.hits == 0
+    assert result.hit_ratio == 0
+
+
 def test_object_cache_deferred(local_engine_empty, pg_repo_remote, clean_minio):
     # Test object manager with deferred releases (we get given a callback to
     # release objects rather than it being done when we leave the context manager)
@@ -453,6 +743,66 @@ def test_object_cache_deferred(local_engine_empty, pg_repo_remote, clean_minio):
         pass
 
 
+def test_object_cache_read_ahead(local_engine_empty, pg_repo_remote, clean_minio):
+    # Objects are claimed and downloaded one batch at a time, with the next batch
+    # being downloaded in the background.
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    first, second = fruits_v3.objects
+
+    release_callback = CallbackList()
+    batches = object_manager.ensure_objects_ahead(fruits_v3, [[first], [second]], release_callback)
+    assert object_manager.get_downloaded_objects() == []
+
+    assert next(batches) == [first]
+    assert first in object_manager.get_downloaded_objects()
+    assert next(batches) == [second]
+    assert sorted(object_manager.get_downloaded_objects()) == sorted([first, second])
+    with pytest.raises(StopIteration):
+        next(batches)
+
+    for object_id in [first, second]:
+        assert _get_refcount(object_manager, object_id) == 1
+    _assert_cache_occupancy(object_manager, 2)
+
+    release_callback()
+    for object_id in [first, second]:
+        assert _get_refcount(object_manager, object_id) == 0
+
+
+def test_object_cache_read_ahead_stop_early(local_engine_empty, pg_repo_remote, clean_minio):
+    # If the caller stops consuming batches whilst the next one is being downloaded,
+    # the download is waited for and the background engine's pool is closed. The objects
+    # are released with the foreground engine.
+    pg_repo_local = _setup_object_cache_test(pg_repo_remote)
+
+    object_manager = pg_repo_local.objects
+    fruits_v3 = pg_repo_local.images["latest"].get_table("fruits")
+    first, second = fruits_v3.objects
+
+    release_callback = CallbackList()
+    with mock.patch(
+        "splitgraph.engine.postgres.engine.PsycopgEngine.close_pool",
+        autospec=True,
+        side_effect=PsycopgEngine.close_pool,
+    ) as close_pool:
+        batches = object_manager.ensure_objects_ahead(
+            fruits_v3, [[first], [second]], release_callback
+        )
+        assert next(batches) == [first]
+        batches.close()
+
+    assert close_pool.call_count == 1
+    assert close_pool.call_args[0][0] is not object_manager.object_engine
+    assert sorted(object_manager.get_downloaded_objects()) == sorted([first, second])
+
+    release_callback()
+    for object_id in [first, second]:
+        assert _get_refcount(object_manager, object_id) == 0
+
+
 def test_object_cache_make_external(pg_repo_local, clean_minio):
     # Test marking objects as external and uploading them to S3
     all_objects = list(sorted(pg_repo_local.objects.get_all_objects()))
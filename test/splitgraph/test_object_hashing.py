@@ -1,6 +1,8 @@
+import json
 import operator
 from functools import reduce
 from hashlib import sha256
+from unittest import mock
 
 import pytest
 from test.splitgraph.conftest import OUTPUT, PG_DATA, load_splitfile
@@ -42,6 +44,19 @@ def test_digest_sum():
     ).hex() == HASH_SUM
 
 
+def test_digest_sum_many():
+    assert Digest.sum_many(TEST_ROW_HASHES_BYTES).hex() == HASH_SUM
+    assert Digest.sum_many(map(memoryview, TEST_ROW_HASHES_BYTES)).hex() == HASH_SUM
+    assert Digest.sum_many([]).hex() == Digest.empty().hex()
+
+    # Check the wraparound and batching match adding the digests up one by one.
+    many_hashes = TEST_ROW_HASHES_BYTES * 10000
+    assert (
+        Digest.sum_many(many_hashes).hex()
+        == _sum_digests(map(Digest.from_memoryview, many_hashes)).hex()
+    )
+
+
 def test_digest_subtraction():
     sub_sum = _sum_digests(map(Digest.from_hex, TEST_ROW_HASHES[:5] + TEST_ROW_HASHES[6:]))
     assert (Digest.from_hex(HASH_SUM) - Digest.from_hex(TEST_ROW_HASHES[5])).hex() == sub_sum.hex()
@@ -85,6 +100,90 @@ def test_base_fragment_hashing(pg_repo_local):
     assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == (insertion_hash, 2)
 
 
+def test_server_side_hashing_matches_client(pg_repo_local):
+    om = pg_repo_local.objects
+    object_id = pg_repo_local.head.get_table("fruits").objects[0]
+    assert om.object_engine.has_lthash_sum()
+
+    server_content_hash = om.calculate_content_hash(pg_repo_local.to_schema(), "fruits")
+    server_insertion_hash = om.calculate_fragment_insertion_hash_stats(
+        SPLITGRAPH_META_SCHEMA, object_id
+    )
+
+    # Check the fallback path (fetching and adding up all row digests in Python)
+    # gives the same result.
+    with mock.patch.object(om.object_engine, "has_lthash_sum", return_value=False):
+        assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == (
+            server_content_hash
+        )
+        client_insertion_hash = om.calculate_fragment_insertion_hash_stats(
+            SPLITGRAPH_META_SCHEMA, object_id
+        )
+    assert server_insertion_hash[0].hex() == client_insertion_hash[0].hex()
+    assert server_insertion_hash[1] == client_insertion_hash[1] == 2
+
+    # Hashing an empty set of rows returns a zero hash.
+    pg_repo_local.run_sql("DELETE FROM fruits")
+    assert om.calculate_content_hash(pg_repo_local.to_schema(), "fruits") == ("0" * 64, 0)
+
+
+def test_base_fragment_single_scan_stats(local_engine_empty):
+    # Check that the hash and the index calculated from the source table in one scan
+    # match the ones calculated on the stored object.
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key_1 INTEGER, key_2 VARCHAR, value_1 VARCHAR, value_2 NUMERIC, "
+        "PRIMARY KEY (key_1, key_2))"
+    )
+    for i in range(20):
+        OUTPUT.run_sql(
+            "INSERT INTO test VALUES (%s, %s, %s, %s)",
+            (i // 4, chr(ord("a") + i % 4), None if i % 3 else "value_%d" % i, i / 3),
+        )
+    extra_indexes = {"bloom": {"value_1": {"probability": 0.01}, "key_2": {"size": 16}}}
+    head = OUTPUT.commit(chunk_size=8, extra_indexes={"test": extra_indexes})
+
+    om = OUTPUT.objects
+    table = head.get_table("test")
+    for object_id, object_meta in om.get_object_meta(table.objects).items():
+        assert om.calculate_content_hash(SPLITGRAPH_META_SCHEMA, object_id, table.table_schema) == (
+            object_meta.insertion_hash,
+            object_meta.rows_inserted,
+        )
+        # Round-trip the index through JSON (like the metadata engine does) to compare them.
+        assert object_meta.object_index == json.loads(
+            json.dumps(
+                om.generate_object_index(object_id, table.table_schema, extra_indexes=extra_indexes)
+            )
+        )
+        assert sorted(object_meta.object_index["range"]) == [
+            "$pk",
+            "key_1",
+            "key_2",
+            "value_1",
+            "value_2",
+        ]
+
+
+def test_base_fragment_stats_column_names(local_engine_empty):
+    # Check that a column with the same name as the row digest doesn't break the hashing.
+    OUTPUT.init()
+    OUTPUT.run_sql(
+        "CREATE TABLE test (key INTEGER PRIMARY KEY, sg_row_digest VARCHAR, _sg_row_digest INTEGER)"
+    )
+    OUTPUT.run_sql("INSERT INTO test SELECT i, 'value_' || i, i * 2 FROM generate_series(1, 10) i")
+    head = OUTPUT.commit()
+
+    om = OUTPUT.objects
+    table = head.get_table("test")
+    object_meta = om.get_object_meta(table.objects)[table.objects[0]]
+    assert om.calculate_content_hash(
+        SPLITGRAPH_META_SCHEMA, table.objects[0], table.table_schema
+    ) == (object_meta.insertion_hash, 10)
+    assert object_meta.object_index["range"]["sg_row_digest"] == ["value_1", "value_9"]
+    assert object_meta.object_index["range"]["_sg_row_digest"] == [2, 20]
+
+
 def test_base_fragment_reused(pg_repo_local):
     fruits = pg_repo_local.head.get_table("fruits")
 